@@ -5,6 +5,7 @@ from blueprints.ui_training import ui_training_bp
 from blueprints.projects import projects_bp
 from blueprints.training import training_bp
 from blueprints.ui_dataset import ui_dataset_bp
+from utils.job_queue import start_scheduler
 import os
 import secrets
 
@@ -19,6 +20,9 @@ app.register_blueprint(ui_training_bp)
 app.register_blueprint(projects_bp)
 app.register_blueprint(training_bp)
 
+# Queued jobs resume as soon as the app is up; only one app process ever launches them.
+start_scheduler()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 7860))
     app.run(
@@ -1,19 +1,18 @@
-from flask import Blueprint, redirect, url_for, jsonify
-import os
-import signal
-import sys
-import subprocess
+from flask import Blueprint, redirect, request, url_for, jsonify
 
 from utils.paths import project_dir
-from utils.launch_training import launch_training, TrainingConfigError
+from utils.launch_training import TrainingConfigError
+from utils.job_queue import get_scheduler
+from trainer.train.events import read_events
 
 training_bp = Blueprint("training", __name__)
 
 @training_bp.route("/train/<project>", methods=["POST"])
 def start_training(project):
+    priority = request.form.get("priority", 0, type=int)
     try:
-        launch_training(project)
-    except TrainingConfigError as e:
+        get_scheduler().submit(project, priority=priority)
+    except (TrainingConfigError, FileNotFoundError, RuntimeError) as e:
         from flask import session
         session["ui_issues"] = [{
             "field": "__global__",
@@ -25,27 +24,17 @@ def start_training(project):
 
 @training_bp.route("/stop/<project>", methods=["POST"])
 def stop_training(project):
-    pid_file = project_dir(project) / "training.pid"
+    get_scheduler().cancel_project(project)
+    return redirect(url_for("ui.index", project=project))
 
-    if not pid_file.exists():
-        return redirect(url_for("ui.index", project=project))
+@training_bp.route("/jobs")
+def list_jobs():
+    return jsonify({"jobs": get_scheduler().list_jobs()})
 
-    pgid = int(pid_file.read_text())
-
-    try:
-        if sys.platform == "win32":
-            subprocess.run(
-                ["taskkill", "/PID", str(pgid), "/T", "/F"],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-            )
-        else:
-            os.killpg(pgid, signal.SIGTERM)
-    except Exception:
-        pass
-
-    pid_file.unlink(missing_ok=True)
-    return redirect(url_for("ui.index", project=project))
+@training_bp.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    get_scheduler().cancel(job_id)
+    return jsonify({"ok": True})
 
 @training_bp.route("/train_logs/<project>")
 def train_logs(project):
@@ -53,3 +42,11 @@ def train_logs(project):
     if not log_path.exists():
         return jsonify({"logs": ""})
     return jsonify({"logs": log_path.read_text()[-10000:]})
+
+@training_bp.route("/train_events/<project>")
+def train_events(project):
+    """Typed events after ?offset= (bytes); clients send back the returned offset on the next poll."""
+    events_path = project_dir(project) / "logs" / "events.jsonl"
+    offset = request.args.get("offset", 0, type=int)
+    events, offset = read_events(events_path, offset)
+    return jsonify({"events": events, "offset": offset})
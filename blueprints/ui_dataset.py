@@ -13,6 +13,7 @@ from utils.dataset_io import (
 from utils.paths import (
     PROJECTS_DIR,
     project_dir,
+    project_cache_dir,
 )
 
 from utils.project_config import (
@@ -70,13 +71,15 @@ def api_dataset_load():
             "path": str(dataset_root),
         }, 400
 
-    set_dataset_root(dataset_root)
+    set_dataset_root(dataset_root, project_cache_dir(project))
 
     images = []
     for img in list_dataset_images():
         images.append({
             "name": img["name"],
             "rel_path": img["rel_path"],
+            "width": img["width"],
+            "height": img["height"],
             "caption": read_caption_for_image(img["name"]),
         })
 
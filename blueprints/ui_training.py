@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, current_app
 from pathlib import Path
-from utils.paths import PROJECTS_DIR, project_dir, project_config_path, MODELS_DIR
+from utils.paths import PROJECTS_DIR, project_config_path, MODELS_DIR
 from utils.project_file import open_folder
-from utils.risk_analysis import analyze_training_risk
+from utils.risk_analysis import analyze_bucket_risk, analyze_training_risk, analyze_memory_risk, memory_budget_mb
+from utils.memory_estimate import estimate_peak_memory, plan_batch_size
+from utils.job_queue import get_scheduler
 import utils.dataset as dataset
 import utils.training as training
 import utils.lora as lora
@@ -62,6 +64,8 @@ def index():
             optimizer.apply(request.form, config, issues)
 
             issues.extend(analyze_training_risk(config["training"]))
+            issues.extend(analyze_memory_risk(config))
+            issues.extend(analyze_bucket_risk(config))
 
         if action == "cancel":
             issues.clear()
@@ -89,10 +93,13 @@ def index():
             session["ui_issues"] = issues.copy()
 
     training_status = "idle"
+    queue_position = None
     if selected:
-        pid_file = project_dir(selected) / "training.pid"
-        if pid_file.exists():
-            training_status = "running"
+        scheduler = get_scheduler()
+        job = scheduler.active_job(selected)
+        if job is not None:
+            training_status = job["status"]
+            queue_position = scheduler.queue_position(job["id"])
 
     available_models = sorted(p.name for p in MODELS_DIR.glob("*.safetensors"))
 
@@ -103,6 +110,7 @@ def index():
         config=config,
         issues=issues,
         training_status=training_status,
+        queue_position=queue_position,
         available_models=available_models,
     )
 
@@ -122,6 +130,18 @@ def vram_status():
             "text": None
         })
     
+@ui_training_bp.route("/api/memory_plan")
+def memory_plan():
+    selected = request.args.get("project")
+    if not selected:
+        return jsonify({"error": "No project selected"}), 400
+
+    config = load_config(selected)
+    budget = memory_budget_mb(config)
+    if budget is None:
+        return jsonify({"budget_mb": None, "current": estimate_peak_memory(config)})
+    return jsonify(plan_batch_size(config, budget))
+
 @ui_training_bp.route("/api/open_dataset_folder", methods=["POST"])
 def open_dataset_folder():
     selected = request.args.get("project")
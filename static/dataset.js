@@ -63,6 +63,9 @@ function renderImageList() {
 
         const nameSpan = document.createElement("span");
         nameSpan.textContent = img.name;
+        if (img.width && img.height) {
+        nameSpan.title = `${img.width}×${img.height}`;
+        }
         li.appendChild(nameSpan);
 
         if (img.flagged) {
@@ -143,6 +146,8 @@ function loadImages(imageList) {
         return {
         name: img.name,
         path: img.rel_path,
+        width: img.width,
+        height: img.height,
         caption,
         flagged: isCaptionFlagged(caption)
         };
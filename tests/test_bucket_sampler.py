@@ -0,0 +1,92 @@
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("torch")
+
+from trainer.train.loader import BucketBatchSampler
+
+BUCKET_MAP = {
+    (512, 512): list(range(0, 7)),
+    (640, 384): list(range(7, 12)),
+    (384, 640): [12, 13],
+}
+
+def _sampler(**kwargs):
+    opts = {"batch_size": 2, "repeats": 2, "shuffle": True, "seed": 0, "tail": "keep"}
+    opts.update(kwargs)
+    return BucketBatchSampler(BUCKET_MAP, **opts)
+
+def _indices(batches):
+    return Counter(idx for batch in batches for idx, _ in batch)
+
+def test_batches_come_from_one_bucket_and_cover_every_repeat():
+    s = _sampler()
+    s.set_epoch(1)
+    batches = list(s)
+    for batch in batches:
+        (bucket,) = {b for _, b in batch}
+        assert all(idx in BUCKET_MAP[bucket] for idx, _ in batch)
+    assert _indices(batches) == Counter({i: 2 for ids in BUCKET_MAP.values() for i in ids})
+    assert len(batches) == len(s) == 7 + 5 + 2  # 14, 10 and 4 samples per bucket at batch 2
+
+def test_order_is_deterministic_per_epoch_and_interleaves_buckets():
+    a, b = _sampler(), _sampler()
+    a.set_epoch(3)
+    b.set_epoch(3)
+    assert list(a) == list(b)
+    b.set_epoch(4)
+    assert list(a) != list(b)
+
+    buckets = [batch[0][1] for batch in a]
+    runs = sum(1 for prev, cur in zip(buckets, buckets[1:]) if prev != cur)
+    assert runs > len(BUCKET_MAP) - 1
+
+def test_without_shuffle_buckets_run_in_order():
+    s = _sampler(shuffle=False, repeats=1)
+    s.set_epoch(1)
+    assert [[idx for idx, _ in batch] for batch in s] == [[0, 1], [2, 3], [4, 5], [6], [7, 8], [9, 10], [11], [12, 13]]
+
+@pytest.mark.parametrize("tail,sizes", [
+    ("keep", [2, 2, 2, 1, 2, 2, 1, 2]),
+    ("drop", [2, 2, 2, 2, 2, 2]),
+    ("pad", [2] * 8),
+])
+def test_tail_modes(tail, sizes):
+    s = _sampler(shuffle=False, repeats=1, tail=tail)
+    s.set_epoch(1)
+    batches = list(s)
+    assert [len(b) for b in batches] == sizes
+    assert len(s) == len(batches)
+    if tail == "pad":
+        # Padding samples come from the bucket of the ragged batch.
+        assert all(idx in BUCKET_MAP[(512, 512)] for idx, _ in batches[3])
+
+def test_resume_replays_the_rest_of_the_epoch():
+    s = _sampler()
+    s.set_epoch(2)
+    full = list(s)
+    state = s.state_dict(2, 5)
+
+    resumed = _sampler(seed=123)  # a different seed must not matter: the order is in the state
+    resumed.load_state_dict(state)
+    resumed.set_epoch(2)
+    assert resumed.start_batch == 5
+    assert len(resumed) == len(full) - 5
+    assert list(resumed) == full[5:]
+
+    # The next epoch starts from the beginning again with its own order.
+    resumed.set_epoch(3)
+    assert resumed.start_batch == 0
+    assert len(resumed) == len(full)
+
+def test_state_dict_survives_a_torch_save_roundtrip(tmp_path):
+    import torch
+
+    s = _sampler()
+    s.set_epoch(1)
+    torch.save(s.state_dict(1, 3), tmp_path / "state.pt")
+    resumed = _sampler()
+    resumed.load_state_dict(torch.load(tmp_path / "state.pt", weights_only=False))
+    resumed.set_epoch(1)
+    assert list(resumed) == list(s)[3:]
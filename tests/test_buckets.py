@@ -0,0 +1,73 @@
+import pytest
+
+from trainer.train.buckets import bucket_crop, build_bucket_resolutions, format_bucket, pick_bucket
+
+def test_buckets_respect_area_step_and_range():
+    buckets = build_bucket_resolutions(1024, 256, 1536, 64)
+    assert (1024, 1024) in buckets
+    for w, h in buckets:
+        assert w * h <= 1024 * 1024
+        assert w % 64 == 0 and h % 64 == 0
+        assert 256 <= w <= 1536 and 256 <= h <= 1536
+
+def test_buckets_are_symmetric_and_sorted():
+    buckets = build_bucket_resolutions(1024, 256, 1536, 64)
+    assert buckets == sorted(buckets)
+    assert all((h, w) in buckets for w, h in buckets)
+
+def test_default_min_res_gives_aspect_buckets_at_sd_resolution():
+    buckets = build_bucket_resolutions(512, 256, 1536, 64)
+    assert {(256, 1024), (384, 640), (448, 576), (512, 512), (640, 384), (1024, 256)} <= set(buckets)
+    assert max(max(b) / min(b) for b in buckets) == 4
+
+def test_min_res_at_resolution_leaves_one_square_bucket():
+    assert build_bucket_resolutions(512, 512, 1536, 64) == [(512, 512)]
+
+def test_min_res_is_rounded_up_to_step():
+    buckets = build_bucket_resolutions(512, 300, 1536, 64)
+    assert min(min(b) for b in buckets) == 320
+
+def test_empty_range_falls_back_to_one_bucket_inside_the_range():
+    # min_res above what the area allows: a single square clamped into [min_res, max_res].
+    assert build_bucket_resolutions(512, 640, 1536, 64) == [(640, 640)]
+
+@pytest.mark.parametrize("size,expected", [
+    ((1000, 1000), (512, 512)),
+    ((1920, 1080), (640, 384)),
+    ((1080, 1920), (384, 640)),
+    ((600, 2400), (256, 1024)),
+    ((5000, 500), (1024, 256)),
+])
+def test_pick_bucket_matches_aspect_ratio(size, expected):
+    buckets = build_bucket_resolutions(512, 256, 1536, 64)
+    assert pick_bucket(*size, buckets) == expected
+
+def test_pick_bucket_prefers_larger_area_on_ties():
+    assert pick_bucket(100, 100, [(256, 256), (512, 512)]) == (512, 512)
+
+@pytest.mark.parametrize("size,bucket", [
+    ((1920, 1080), (640, 384)),
+    ((1000, 1000), (512, 512)),
+    ((333, 777), (384, 640)),
+])
+def test_bucket_crop_covers_bucket_and_centers(size, bucket):
+    rw, rh, left, top = bucket_crop(*size, bucket)
+    assert rw >= bucket[0] and rh >= bucket[1]
+    assert left == (rw - bucket[0]) // 2 and top == (rh - bucket[1]) // 2
+    # Cover-resize keeps the aspect ratio up to rounding.
+    assert abs(rw / rh - size[0] / size[1]) < 0.01 * size[0] / size[1] + 2 / min(rw, rh)
+
+def test_format_bucket():
+    assert format_bucket((640, 384)) == "640x384"
+
+def test_bucket_risk_flags_single_square_bucket():
+    from utils.risk_analysis import analyze_bucket_risk
+
+    config = {"model": {"architecture": "sd"}, "dataset": {"resolution": 512, "bucket": {"enabled": True, "min_res": 512}}}
+    [issue] = analyze_bucket_risk(config)
+    assert issue["field"] == "bucket_min_res" and issue["level"] == "warn"
+
+    config["dataset"]["bucket"]["min_res"] = 256
+    assert analyze_bucket_risk(config) == []
+    config["dataset"]["bucket"] = {"enabled": False, "min_res": 512}
+    assert analyze_bucket_risk(config) == []
@@ -0,0 +1,87 @@
+import json
+
+from trainer.train.events import EventStream, read_events
+
+def _write_run(path, *types):
+    stream = EventStream(path)
+    for t in types:
+        stream.emit(t)
+    stream.close()
+    return stream.run_id
+
+def test_reads_events_and_resumes_from_offset(tmp_path):
+    path = tmp_path / "events.jsonl"
+    _write_run(path, "run_start", "step")
+
+    events, offset = read_events(path)
+    assert [e["type"] for e in events] == ["run_start", "step"]
+    assert offset == path.stat().st_size
+    assert read_events(path, offset) == ([], offset)
+
+def test_missing_file_resets_offset(tmp_path):
+    assert read_events(tmp_path / "nope.jsonl", 1234) == ([], 0)
+
+def test_later_runs_append_and_continue_seq(tmp_path):
+    path = tmp_path / "events.jsonl"
+    first = _write_run(path, "run_start", "done")
+    _, offset = read_events(path)
+    second = _write_run(path, "run_start", "step")
+
+    events, _ = read_events(path, offset)
+    assert [(e["seq"], e["type"], e["run"]) for e in events] == [(3, "run_start", second), (4, "step", second)]
+    assert first != second
+
+def test_partial_last_line_waits_for_completion(tmp_path):
+    path = tmp_path / "events.jsonl"
+    _write_run(path, "run_start")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 2, "type": "st')
+
+    events, offset = read_events(path)
+    assert [e["seq"] for e in events] == [1]
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('ep"}\n')
+    events, _ = read_events(path, offset)
+    assert [e["type"] for e in events] == ["step"]
+
+def test_offset_inside_a_line_resyncs_to_the_next(tmp_path):
+    path = tmp_path / "events.jsonl"
+    _write_run(path, "a", "b", "c")
+    first_line = path.read_bytes().index(b"\n") + 1
+
+    events, offset = read_events(path, first_line - 5)
+    assert [e["type"] for e in events] == ["b", "c"]
+    assert offset == path.stat().st_size
+
+def test_undecodable_lines_are_skipped(tmp_path):
+    path = tmp_path / "events.jsonl"
+    path.write_text('{"seq": 1, "type": "a"}\nnot json\n{"seq": 2, "type": "b"}\n', encoding="utf-8")
+    events, offset = read_events(path)
+    assert [e["type"] for e in events] == ["a", "b"]
+    assert offset == path.stat().st_size
+
+def test_new_run_after_a_crash_mid_line_starts_on_a_fresh_line(tmp_path):
+    path = tmp_path / "events.jsonl"
+    _write_run(path, "run_start", "step")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 3, "type": "ste')
+    _write_run(path, "run_start")
+
+    events, _ = read_events(path)
+    assert [(e["seq"], e["type"]) for e in events] == [(1, "run_start"), (2, "step"), (3, "run_start")]
+
+def test_limit_returns_an_offset_to_continue_from(tmp_path):
+    path = tmp_path / "events.jsonl"
+    _write_run(path, *[f"e{i}" for i in range(5)])
+    events, offset = read_events(path, limit=2)
+    assert [e["type"] for e in events] == ["e0", "e1"]
+    events, _ = read_events(path, offset)
+    assert [e["type"] for e in events] == ["e2", "e3", "e4"]
+
+def test_extra_fields_are_serialized(tmp_path):
+    path = tmp_path / "events.jsonl"
+    stream = EventStream(path)
+    stream.emit("step", loss=0.5, path=tmp_path)
+    stream.close()
+    line = json.loads(path.read_text(encoding="utf-8"))
+    assert line["loss"] == 0.5 and line["path"] == str(tmp_path)
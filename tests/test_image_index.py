@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+from utils.image_index import INDEX_VERSION, probe_image_sizes, read_image_size
+
+def _save(path, size, **kwargs):
+    Image.new("RGB", size, (200, 100, 50)).save(path, **kwargs)
+    return path
+
+@pytest.mark.parametrize("name,kwargs", [
+    ("a.png", {}),
+    ("a.jpg", {}),
+    ("a_progressive.jpg", {"progressive": True}),
+    ("a_lossy.webp", {"lossless": False}),
+    ("a_lossless.webp", {"lossless": True}),
+])
+def test_read_image_size_matches_pil(tmp_path, name, kwargs):
+    path = _save(tmp_path / name, (123, 77), **kwargs)
+    assert read_image_size(path) == (123, 77)
+
+def test_read_image_size_reads_only_the_header(tmp_path):
+    # Truncated after the IHDR chunk: PIL could not decode it, the header parser still can.
+    path = _save(tmp_path / "full.png", (640, 480))
+    truncated = tmp_path / "truncated.png"
+    truncated.write_bytes(path.read_bytes()[:33])
+    assert read_image_size(truncated) == (640, 480)
+
+def test_read_image_size_falls_back_to_pil_on_mismatched_suffix(tmp_path):
+    path = _save(tmp_path / "actually_png.jpg", (31, 17), format="PNG")
+    assert read_image_size(path) == (31, 17)
+
+def test_probe_image_sizes_keeps_caller_paths_and_writes_index(tmp_path):
+    a = _save(tmp_path / "a.png", (64, 32))
+    b = _save(tmp_path / "b.jpg", (16, 48))
+    index = tmp_path / "cache" / "image_sizes.json"
+
+    sizes = probe_image_sizes([a, str(b)], index_path=index, workers=2)
+
+    assert sizes == {str(a): (64, 32), str(b): (16, 48)}
+    data = json.loads(index.read_text(encoding="utf-8"))
+    assert data["version"] == INDEX_VERSION
+    assert {tuple(e[2:]) for e in data["entries"].values()} == {(64, 32), (16, 48)}
+
+def test_probe_image_sizes_reuses_unchanged_entries(tmp_path, monkeypatch):
+    a = _save(tmp_path / "a.png", (64, 32))
+    index = tmp_path / "image_sizes.json"
+    probe_image_sizes([a], index_path=index)
+
+    def fail(path):
+        raise AssertionError(f"{path} was re-read although unchanged")
+
+    monkeypatch.setattr("utils.image_index.read_image_size", fail)
+    assert probe_image_sizes([a], index_path=index) == {str(a): (64, 32)}
+
+def test_probe_image_sizes_rereads_changed_files_and_drops_deleted(tmp_path):
+    a = _save(tmp_path / "a.png", (64, 32))
+    b = _save(tmp_path / "b.png", (8, 8))
+    index = tmp_path / "image_sizes.json"
+    probe_image_sizes([a, b], index_path=index)
+
+    _save(a, (100, 50))
+    b.unlink()
+    assert probe_image_sizes([a], index_path=index) == {str(a): (100, 50)}
+
+    entries = json.loads(index.read_text(encoding="utf-8"))["entries"]
+    assert list(entries) == [str(a.resolve())]
@@ -0,0 +1,134 @@
+import subprocess
+import sys
+
+import pytest
+
+import utils.job_queue as job_queue
+import utils.trainer_worker as trainer_worker
+
+@pytest.fixture
+def worker_dirs(tmp_path, monkeypatch):
+    for name in ("QUEUE_DIR", "RUNNING_DIR", "RESULTS_DIR"):
+        monkeypatch.setattr(trainer_worker, name, tmp_path / "worker" / name.lower())
+    trainer_worker.RUNNING_DIR.mkdir(parents=True)
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return job_queue.JobScheduler(tmp_path / "training_jobs.json")
+
+def _job(scheduler, **fields):
+    job = {
+        "id": f"job{len(scheduler.jobs)}",
+        "project": f"p{len(scheduler.jobs)}",
+        "priority": 0,
+        "status": "running",
+        "est_mem_mb": 1000,
+        "device": None,
+        "pgid": None,
+        "worker_job": None,
+        "cancel": False,
+        "submitted": 0.0,
+        "started": 0.0,
+        "finished": None,
+        "exit_code": None,
+    }
+    job.update(fields)
+    scheduler.jobs.append(job)
+    return job
+
+@pytest.mark.parametrize("status,code,expected", [
+    ("done", 0, "done"),
+    ("error", 1, "failed"),
+    ("exit 2", 2, "failed"),
+    ("cancelled", None, "cancelled"),
+    ("stopped", None, "cancelled"),
+])
+def test_reap_maps_worker_results(worker_dirs, scheduler, status, code, expected):
+    job = _job(scheduler, worker_job="w1")
+    trainer_worker.write_job_result("w1", status, code)
+
+    assert scheduler._reap()
+    assert job["status"] == expected
+    assert job["exit_code"] == code
+    assert trainer_worker.pop_job_result("w1") is None  # consumed
+
+def test_reap_treats_a_missing_worker_result_as_failed(worker_dirs, scheduler):
+    job = _job(scheduler, worker_job="w1")
+    scheduler._reap()
+    assert job["status"] == "failed"
+
+def test_reap_marks_a_cancelled_worker_job_cancelled_without_a_result(worker_dirs, scheduler):
+    # Cancelled while still queued on the worker: it never ran, so it wrote no record.
+    job = _job(scheduler, worker_job="w1", cancel=True)
+    scheduler._reap()
+    assert job["status"] == "cancelled"
+
+def test_reap_waits_for_active_worker_jobs(worker_dirs, scheduler):
+    job = _job(scheduler, worker_job="w1")
+    (trainer_worker.RUNNING_DIR / "1_w1.json").write_text("{}", encoding="utf-8")
+    assert not scheduler._reap()
+    assert job["status"] == "running"
+
+@pytest.mark.parametrize("exit_code,cancel,expected", [
+    (0, False, "done"),
+    (3, False, "failed"),
+    (3, True, "cancelled"),
+])
+def test_reap_maps_process_exit_codes(scheduler, exit_code, cancel, expected):
+    proc = subprocess.Popen([sys.executable, "-c", f"raise SystemExit({exit_code})"])
+    proc.wait()
+    job = _job(scheduler, pgid=proc.pid, cancel=cancel)
+    scheduler.processes[job["id"]] = proc
+
+    scheduler._reap()
+    assert job["status"] == expected
+    assert job["exit_code"] == exit_code
+    assert job["id"] not in scheduler.processes
+
+def test_reap_keeps_running_processes(scheduler):
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        job = _job(scheduler, pgid=proc.pid)
+        scheduler.processes[job["id"]] = proc
+        assert not scheduler._reap()
+        assert job["status"] == "running"
+    finally:
+        proc.kill()
+        proc.wait()
+
+def test_worker_runs_one_job_at_a_time(worker_dirs, scheduler, monkeypatch):
+    launched = []
+    monkeypatch.setattr(job_queue, "worker_alive", lambda: True)
+    monkeypatch.setattr(job_queue, "launch_training", lambda project, device=None: launched.append((project, device)) or {"worker_job": f"w{len(launched)}"})
+    scheduler.devices = [(0, 48_000)]
+    _job(scheduler, status="queued", submitted=1.0)
+    _job(scheduler, status="queued", submitted=2.0)
+
+    scheduler._schedule()
+    assert launched == [("p0", None)]
+    scheduler._schedule()
+    assert launched == [("p0", None)]
+
+def test_devices_fit_jobs_by_memory_and_count(scheduler, monkeypatch):
+    launched = []
+    monkeypatch.setattr(job_queue, "worker_alive", lambda: False)
+    monkeypatch.setattr(job_queue, "launch_training", lambda project, device=None: launched.append((project, device)) or {"process": None, "pgid": 0})
+    scheduler.devices = [(0, 10_000)]
+    _job(scheduler, status="queued", est_mem_mb=4000, submitted=1.0)
+    _job(scheduler, status="queued", est_mem_mb=4000, submitted=2.0)
+    _job(scheduler, status="queued", est_mem_mb=1000, submitted=3.0)
+
+    scheduler._schedule()
+    # Two fit in 90% of 10 GB; the third would too by memory, but max_jobs_per_device is 2.
+    assert launched == [("p0", 0), ("p1", 0)]
+
+def test_higher_priority_goes_first(scheduler, monkeypatch):
+    launched = []
+    monkeypatch.setattr(job_queue, "worker_alive", lambda: False)
+    monkeypatch.setattr(job_queue, "launch_training", lambda project, device=None: launched.append(project) or {"process": None, "pgid": 0})
+    scheduler.devices = [(0, 10_000)]
+    _job(scheduler, status="queued", est_mem_mb=8000, submitted=1.0)
+    _job(scheduler, status="queued", est_mem_mb=8000, submitted=2.0, priority=5)
+
+    scheduler._schedule()
+    assert launched == ["p1"]
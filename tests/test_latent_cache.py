@@ -0,0 +1,58 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+
+from trainer.train.latent_cache import LatentCache, LatentManifest, LatentStore, latent_key
+
+def test_latent_key_depends_on_content_bucket_and_vae():
+    base = latent_key("sha", (512, 512), "vae")
+    assert base == latent_key("sha", (512, 512), "vae")
+    assert len({base, latent_key("sha2", (512, 512), "vae"), latent_key("sha", (640, 384), "vae"), latent_key("sha", (512, 512), "vae2")}) == 4
+
+@pytest.mark.parametrize("on_disk", [True, False])
+def test_store_roundtrip(tmp_path, on_disk):
+    store = LatentStore(tmp_path / "latents" if on_disk else None)
+    latents = torch.randn(1, 4, 8, 8)
+    store.put("ab12", latents)
+
+    assert store.has("ab12")
+    out = store.get("ab12")
+    assert out.dtype == torch.float16
+    assert torch.equal(out, latents.to(torch.float16))
+
+    store.delete("ab12")
+    assert not store.has("ab12")
+
+def test_store_get_is_memory_mapped_and_cat_copies(tmp_path):
+    store = LatentStore(tmp_path)
+    store.put("k1", torch.ones(1, 4, 2, 2))
+    store.put("k2", torch.zeros(1, 4, 2, 2))
+    cache = LatentCache(store, {(16, 16): {0: "k1", 1: "k2"}})
+
+    batch = cache.load((16, 16), [1, 0])
+    assert batch.shape == (2, 4, 2, 2)
+    assert batch[0].sum() == 0 and batch[1].sum() == 16
+    batch += 1  # the collated batch is a private, writable copy
+    assert store.get("k1").sum() == 16
+
+def test_manifest_keeps_valid_latents_and_reports_stale_ones(tmp_path):
+    manifest = LatentManifest(tmp_path / "manifest.json")
+    stamps = {0: ("a.png", 1, 10), 1: ("b.png", 1, 20)}
+    stale, changed, deleted = manifest.update(stamps, {0: "ha", 1: "hb"}, {0: {"ka"}, 1: {"kb"}})
+    assert (stale, changed, deleted) == (set(), 0, 0)
+    manifest.save()
+
+    reloaded = LatentManifest(tmp_path / "manifest.json")
+    # Unchanged stamp: the stored hash is reused without calling hash_fn.
+    assert reloaded.content_hash(("a.png", 1, 10), lambda: pytest.fail("rehashed")) == "ha"
+    assert reloaded.content_hash(("a.png", 2, 10), lambda: "new") == "new"
+
+    # a.png changed content, b.png deleted; a latent for another bucket of unchanged content survives.
+    stale, changed, deleted = reloaded.update({0: ("a.png", 2, 10)}, {0: "ha2"}, {0: {"ka2"}})
+    assert (stale, changed, deleted) == ({"ka", "kb"}, 1, 1)
+
+def test_manifest_ignores_other_versions(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text('{"version": 999, "entries": {"a.png": {}}}', encoding="utf-8")
+    assert LatentManifest(path).entries == {}
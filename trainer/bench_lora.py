@@ -0,0 +1,163 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from trainer.train.lora import LoRALinear
+
+# (name, in_features, out_features, tokens) for attention projections at the
+# default training resolutions (SD 512px -> 64x64 latents, SDXL 1024px -> 128x128).
+LAYER_SHAPES = [
+    ("sd.down0.to_q", 320, 320, 4096),
+    ("sd.down1.to_q", 640, 640, 1024),
+    ("sd.mid.to_q", 1280, 1280, 64),
+    ("sd.down0.attn2.to_k", 768, 320, 77),
+    ("sdxl.down1.to_q", 640, 640, 4096),
+    ("sdxl.down2.to_q", 1280, 1280, 1024),
+    ("sdxl.down1.attn2.to_k", 2048, 640, 77),
+]
+
+class ReferenceLoRALinear(LoRALinear):
+    """The previous unfused forward: full-width delta with output-side dropout."""
+
+    def forward(self, x):
+        delta = self.scale * ((x @ self.A) @ self.B)
+        if self.training and self.dropout > 0:
+            delta = F.dropout(delta, p=self.dropout)
+        return self.base(x) + self.lora_scale * delta
+
+# Tokens of the CPU warmup; kept small so it stays below the peak being measured.
+CPU_WARMUP_TOKENS = 8
+
+def _max_rss_bytes() -> int | None:
+    """Process high-water RSS so far; None without the resource module (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _run_case(impl: str, in_f: int, out_f: int, tokens: int, batch: int, rank: int, dropout: float, iters: int, device: str) -> dict:
+    torch.manual_seed(0)
+    device = torch.device(device)
+    cuda = device.type == "cuda"
+    cls = ReferenceLoRALinear if impl == "reference" else LoRALinear
+    layer = cls(nn.Linear(in_f, out_f), rank, float(rank), dropout).to(device)
+    nn.init.normal_(layer.B, std=0.01)
+    layer.train()
+    x = torch.randn(batch, tokens, in_f, device=device, requires_grad=True)
+    grad = torch.randn(batch, tokens, out_f, device=device)
+
+    saved = {}
+
+    def pack(t):
+        saved[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+
+    def step(x, grad):
+        layer(x).backward(grad)
+        x.grad = layer.A.grad = layer.B.grad = None
+
+    # CUDA peak stats can be reset after a full-size warmup. The RSS high-water mark cannot,
+    # so on CPU the warmup only initializes kernels and thread pools on a short sequence.
+    if cuda:
+        warm = (x, grad)
+    else:
+        n = min(tokens, CPU_WARMUP_TOKENS)
+        warm = (torch.randn(batch, n, in_f, device=device, requires_grad=True), torch.randn(batch, n, out_f, device=device))
+    for _ in range(2):
+        step(*warm)
+
+    if cuda:
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        base = torch.cuda.memory_allocated(device)
+    else:
+        base = _max_rss_bytes()
+
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        step(x, grad)
+        if cuda:
+            torch.cuda.synchronize(device)
+        times.append(time.perf_counter() - start)
+
+    if cuda:
+        peak_mb = (torch.cuda.max_memory_allocated(device) - base) / 2**20
+    elif base is not None:
+        peak_mb = max(_max_rss_bytes() - base, 0) / 2**20
+    else:
+        peak_mb = None
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        layer(x).backward(grad)
+
+    return {
+        "ms": statistics.median(times) * 1000,
+        "peak_mb": peak_mb,
+        "saved_mb": sum(saved.values()) / 2**20,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Micro-benchmark of the LoRALinear forward+backward")
+    ap.add_argument("--batch", type=int, default=1)
+    ap.add_argument("--rank", type=int, default=16)
+    ap.add_argument("--dropout", type=float, default=0.1)
+    ap.add_argument("--iters", type=int, default=10)
+    ap.add_argument("--device", default="cpu", help="cpu or cuda[:N]; on cuda peak_mb is allocator memory")
+    ap.add_argument("--threads", type=int, default=0, help="torch CPU threads (0 = torch default)")
+    ap.add_argument("--output", default="", help="Also write the table to this file")
+    ap.add_argument("--_case", nargs=4, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    if args._case:
+        impl, in_f, out_f, tokens = args._case
+        print(json.dumps(_run_case(impl, int(in_f), int(out_f), int(tokens), args.batch, args.rank, args.dropout, args.iters, args.device)))
+        return
+
+    # Each case runs in a fresh process so the RSS high-water mark is not polluted by earlier cases.
+    base_cmd = [
+        sys.executable, __file__,
+        "--batch", str(args.batch), "--rank", str(args.rank), "--dropout", str(args.dropout),
+        "--iters", str(args.iters), "--threads", str(args.threads), "--device", args.device,
+    ]
+    lines = [
+        f"batch={args.batch} rank={args.rank} dropout={args.dropout} device={args.device} "
+        f"threads={args.threads or torch.get_num_threads()}",
+        f"{'layer':<24}{'impl':<11}{'ms':>9}{'peak_mb':>10}{'saved_mb':>10}",
+    ]
+    print(lines[0])
+    print(lines[1])
+    for name, in_f, out_f, tokens in LAYER_SHAPES:
+        for impl in ("reference", "fused"):
+            out = subprocess.run(
+                base_cmd + ["--_case", impl, str(in_f), str(out_f), str(tokens)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            peak = "n/a" if r["peak_mb"] is None else f"{r['peak_mb']:.1f}"
+            line = f"{name:<24}{impl:<11}{r['ms']:>9.2f}{peak:>10}{r['saved_mb']:>10.1f}"
+            lines.append(line)
+            print(line, flush=True)
+
+    if args.output:
+        Path(args.output).write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
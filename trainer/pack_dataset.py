@@ -0,0 +1,88 @@
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from PIL import Image
+
+from trainer.train.config import log
+from trainer.train.data import build_bucket_resolutions, format_bucket, load_dataset, pick_bucket, resize_to_bucket
+from trainer.train.latent_cache import file_sha256
+from trainer.train.shards import SHARD_ENCODINGS, ShardWriter, encode_image
+
+def _encode(img_path: str, bucket: tuple[int, int], encoding: str) -> tuple[str, bytes]:
+    with Image.open(img_path) as img:
+        img = resize_to_bucket(img.convert("RGB"), bucket)
+    return file_sha256(img_path), encode_image(img, encoding)
+
+def pack(args) -> None:
+    dataset = load_dataset(args.dataset, args.caption_ext)
+    sizes = dataset.image_sizes(None)
+
+    if args.bucket:
+        buckets = build_bucket_resolutions(args.resolution, args.bucket_min_res, args.bucket_max_res, args.bucket_step)
+    else:
+        buckets = [(args.resolution, args.resolution)]
+
+    bucket_map: dict[tuple[int, int], list[int]] = {}
+    for i, (w, h) in enumerate(sizes):
+        bucket_map.setdefault(pick_bucket(w, h, buckets), []).append(i)
+
+    # Samples of one bucket are contiguous so bucket-ordered epochs read shards sequentially.
+    writer = ShardWriter(args.output_dir, args.shard_size_mb * 1024 * 1024)
+    samples = []
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as pool:
+        for bucket, ids in bucket_map.items():
+            log(f"STATUS packing bucket={format_bucket(bucket)} images={len(ids)}")
+            # Bounded chunks keep at most a few encoded images per worker in memory.
+            chunk_size = max(args.workers, 1) * 4
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                encoded = pool.map(lambda i: _encode(dataset[i][0], bucket, args.encoding), chunk)
+                for i, (sha256, data) in zip(chunk, encoded):
+                    shard, offset, length = writer.write(data)
+                    samples.append({
+                        "name": Path(dataset[i][0]).name,
+                        "shard": shard,
+                        "offset": offset,
+                        "length": length,
+                        "bucket": list(bucket),
+                        "size": list(sizes[i]),
+                        "caption": dataset.read_caption(i),
+                        "sha256": sha256,
+                    })
+
+    writer.close({
+        "encoding": args.encoding,
+        "buckets": {
+            "resolution": args.resolution,
+            "bucket_enabled": args.bucket,
+            "bucket_min_res": args.bucket_min_res,
+            "bucket_max_res": args.bucket_max_res,
+            "bucket_step": args.bucket_step,
+        },
+        "samples": samples,
+    })
+    log(f"STATUS packed samples={len(samples)} shards={len(writer.shards)} output={args.output_dir}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Pack a dataset folder into shard files for --dataset_format shards")
+    ap.add_argument("--dataset", required=True)
+    ap.add_argument("--output_dir", required=True)
+    ap.add_argument("--caption_ext", default=".txt")
+    ap.add_argument("--resolution", type=int, default=512)
+    ap.add_argument("--bucket", action="store_true")
+    ap.add_argument("--bucket_min_res", type=int, default=256)
+    ap.add_argument("--bucket_max_res", type=int, default=1536)
+    ap.add_argument("--bucket_step", type=int, default=64)
+    ap.add_argument("--encoding", choices=SHARD_ENCODINGS, default="png", help="png = lossless compressed, raw = uncompressed RGB (largest, fastest to read)")
+    ap.add_argument("--shard_size_mb", type=int, default=1024)
+    ap.add_argument("--workers", type=int, default=8)
+    pack(ap.parse_args())
+
+if __name__ == "__main__":
+    main()
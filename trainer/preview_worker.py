@@ -0,0 +1,129 @@
+import sys
+import time
+import traceback
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from utils.hf_cache import setup_hf_env
+setup_hf_env()
+
+import torch
+from safetensors.torch import load_file
+
+from trainer.train.config import build_arg_parser, cfg_from_args, log, resolve_dtype
+from trainer.train.lora import merge_lora_weights
+from trainer.train.preview import MANIFEST_NAME, write_json_atomic
+
+LORA_WAIT_SECONDS = 600
+
+def wait_for_lora(path: Path) -> dict:
+    """The trainer may still be writing the checkpoint in the background; it appears via atomic rename."""
+    deadline = time.monotonic() + LORA_WAIT_SECONDS
+    while not path.is_file():
+        if time.monotonic() > deadline:
+            raise FileNotFoundError(f"LoRA checkpoint never appeared: {path}")
+        time.sleep(0.5)
+    return load_file(str(path), device="cpu")
+
+def _freeze(*modules):
+    for m in modules:
+        m.eval()
+        m.requires_grad_(False)
+
+def render_sd(cfg, lora_path: Path, preview_dir: Path, device, dtype) -> list[str]:
+    from trainer.train.sd.inference import run_inference_preview_in_memory
+    from trainer.train.sd.models import load_sd_models
+    from trainer.train.sd.step import encode_prompt_sd
+
+    tokenizer, text_encoder, vae, unet, scheduler = load_sd_models(cfg, device, dtype)
+    _freeze(text_encoder, vae, unet)
+
+    def encode():
+        with torch.no_grad():
+            embeds = encode_prompt_sd([cfg.inference_prompt, ""], tokenizer, text_encoder, cfg.clip_skip)
+        return embeds[:1], embeds[1:]
+
+    def render(name: str):
+        cond, uncond = encode()
+        run_inference_preview_in_memory(
+            unet=unet, vae=vae, scheduler=scheduler, output_dir=preview_dir / name,
+            prompt_embeds=cond, negative_prompt_embeds=uncond, steps=cfg.inference_steps,
+            num_images=cfg.inference_images, seed=cfg.seed, device=device, dtype=dtype,
+        )
+
+    log("STATUS inference preview: BASE (LoRA OFF)")
+    render("base")
+
+    log("STATUS inference preview: LORA (LoRA ON)")
+    lora = wait_for_lora(lora_path)
+    merge_lora_weights(unet, lora, "lora_unet_")
+    merge_lora_weights(text_encoder, lora, "lora_te_")
+    render("lora")
+
+    return [f"{name}/img_{i}.png" for name in ("base", "lora") for i in range(cfg.inference_images)]
+
+def render_sdxl(cfg, lora_path: Path, preview_dir: Path, device, dtype) -> list[str]:
+    from trainer.train.sdxl.inference import run_sdxl_inference_preview
+    from trainer.train.sdxl.models import load_sdxl_components, load_sdxl_scheduler
+    from trainer.train.sdxl.step import encode_prompt_sdxl
+
+    unet, vae, text_encoder, text_encoder_2, tokenizer, tokenizer_2 = load_sdxl_components(cfg.base_model, device, dtype, cfg.model_cache_gb)
+    scheduler = load_sdxl_scheduler(cfg.base_model)
+    _freeze(text_encoder, text_encoder_2, vae, unet)
+
+    lora = wait_for_lora(lora_path)
+    merge_lora_weights(unet, lora, "lora_unet_")
+    merge_lora_weights(text_encoder, lora, "lora_te1_")
+    merge_lora_weights(text_encoder_2, lora, "lora_te2_")
+
+    log("STATUS inference preview (SDXL)")
+    prompt_embeds, pooled = encode_prompt_sdxl(
+        [cfg.inference_prompt], tokenizer, tokenizer_2, text_encoder, text_encoder_2, dtype
+    )
+    run_sdxl_inference_preview(
+        unet=unet,
+        vae=vae,
+        scheduler=scheduler,
+        prompt_embeds=prompt_embeds,
+        pooled_prompt_embeds=pooled,
+        output_dir=preview_dir,
+        steps=cfg.inference_steps,
+        seed=cfg.seed,
+        dtype=dtype,
+        resolution=cfg.resolution,
+    )
+    return ["preview.png"]
+
+def main():
+    probe = build_arg_parser(default_resolution=512)
+    model_type = probe.parse_known_args()[0].model_type
+    ap = build_arg_parser(default_resolution=1024 if model_type == "sdxl" else 512)
+    ap.add_argument("--preview_lora", required=True)
+    ap.add_argument("--preview_dir", required=True)
+    ap.add_argument("--preview_epoch", type=int, required=True)
+    args = ap.parse_args()
+    cfg = cfg_from_args(args)
+
+    preview_dir = Path(args.preview_dir)
+    manifest = {"epoch": args.preview_epoch, "lora": args.preview_lora, "status": "running"}
+    write_json_atomic(preview_dir / MANIFEST_NAME, manifest)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # Half precision sampling is only worthwhile (and fully supported) on GPU.
+    dtype = resolve_dtype(cfg.precision) if device.type == "cuda" else torch.float32
+
+    try:
+        render = render_sdxl if cfg.model_type == "sdxl" else render_sd
+        images = render(cfg, Path(args.preview_lora), preview_dir, device, dtype)
+    except Exception as e:
+        traceback.print_exc()
+        write_json_atomic(preview_dir / MANIFEST_NAME, {**manifest, "status": "failed", "error": str(e)})
+        sys.exit(1)
+
+    write_json_atomic(preview_dir / MANIFEST_NAME, {**manifest, "status": "done", "images": images})
+
+if __name__ == "__main__":
+    main()
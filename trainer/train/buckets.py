@@ -0,0 +1,40 @@
+import math
+
+def format_bucket(bucket: tuple[int, int]) -> str:
+    return f"{bucket[0]}x{bucket[1]}"
+
+def build_bucket_resolutions(resolution: int, min_res: int, max_res: int, step: int) -> list[tuple[int, int]]:
+    """
+    (width, height) buckets whose area stays within resolution**2,
+    with both sides multiples of step inside [min_res, max_res].
+    """
+    max_area = resolution * resolution
+    lo = -(-min_res // step) * step
+    hi = (max_res // step) * step
+
+    buckets = set()
+    for w in range(lo, hi + 1, step):
+        h = min(hi, (max_area // w) // step * step)
+        if h >= lo:
+            buckets.add((w, h))
+            buckets.add((h, w))
+
+    if not buckets:
+        side = min(max((resolution // step) * step, lo), hi)
+        buckets.add((side, side))
+
+    return sorted(buckets)
+
+def pick_bucket(w: int, h: int, buckets: list[tuple[int, int]]) -> tuple[int, int]:
+    # The fraction of the image kept by a cover-resize + center crop only depends
+    # on the aspect ratio mismatch, so pick the closest ratio (larger area on ties).
+    ar = math.log(w / h)
+    return min(buckets, key=lambda b: (abs(math.log(b[0] / b[1]) - ar), -b[0] * b[1]))
+
+def bucket_crop(w: int, h: int, bucket: tuple[int, int]) -> tuple[int, int, int, int]:
+    """Returns (resized_w, resized_h, crop_left, crop_top) for a cover-resize into bucket."""
+    bw, bh = bucket
+    scale = max(bw / w, bh / h)
+    rw = max(bw, round(w * scale))
+    rh = max(bh, round(h * scale))
+    return rw, rh, (rw - bw) // 2, (rh - bh) // 2
@@ -0,0 +1,95 @@
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+from safetensors.torch import save_file
+
+from .config import log
+from .events import emit
+from .lora import iter_lora_layers, lora_parts
+
+class CheckpointWriter:
+    """
+    Saves LoRA checkpoints without stalling the training loop.
+
+    save() copies A/B into reusable (pinned, when CUDA is present) fp32 host buffers, then a
+    background thread waits for the copies, writes a temp file and renames it into place.
+    At most max_pending saves are in flight; a further save() waits for the oldest one.
+    """
+
+    def __init__(self, max_pending: int = 2):
+        self.max_pending = max(max_pending, 1)
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ckpt")
+        self.pending: list[tuple[Future, dict]] = []
+        self.free_buffers: list[dict[str, torch.Tensor]] = []
+
+    def save(
+        self,
+        *,
+        unet: nn.Module,
+        text_encoders: list[nn.Module | None],
+        path: str | Path,
+        metadata: dict | None = None,
+    ) -> Future:
+        self._reap(block=len(self.pending) >= self.max_pending)
+
+        # A stale file would look finished to anyone waiting for this save (e.g. the preview worker).
+        path = Path(path)
+        path.unlink(missing_ok=True)
+
+        layers = list(iter_lora_layers(lora_parts(unet, text_encoders)))
+        buffers = self.free_buffers.pop() if self.free_buffers else {}
+        tensors: dict[str, torch.Tensor] = {}
+
+        with torch.no_grad():
+            for key, m in layers:
+                for name, src in ((f"{key}.lora_down.weight", m.A.T), (f"{key}.lora_up.weight", m.B.T)):
+                    buf = buffers.get(name)
+                    if buf is None or buf.shape != src.shape:
+                        buf = torch.empty(src.shape, dtype=torch.float32, pin_memory=torch.cuda.is_available())
+                        buffers[name] = buf
+                    buf.copy_(src, non_blocking=True)
+                    tensors[name] = buf
+                tensors[f"{key}.alpha"] = torch.tensor(m.alpha)
+
+        event = None
+        if torch.cuda.is_available():
+            event = torch.cuda.Event()
+            event.record()
+
+        future = self.pool.submit(self._write, tensors, path, metadata or {}, event)
+        self.pending.append((future, buffers))
+        return future
+
+    def close(self) -> None:
+        """Waits for every in-flight save; re-raises the first write error."""
+        try:
+            while self.pending:
+                self._reap(block=True)
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def _reap(self, block: bool) -> None:
+        if block and self.pending:
+            self.pending[0][0].result()
+        still = []
+        for future, buffers in self.pending:
+            if future.done():
+                self.free_buffers.append(buffers)
+                future.result()
+            else:
+                still.append((future, buffers))
+        self.pending = still
+
+    @staticmethod
+    def _write(tensors: dict[str, torch.Tensor], path: Path, metadata: dict, event) -> Path:
+        if event is not None:
+            event.synchronize()
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        save_file(tensors, str(tmp), metadata=metadata)
+        os.replace(tmp, path)
+        log(f"STATUS checkpoint written: {path.name}")
+        emit("checkpoint", path=str(path))
+        return path
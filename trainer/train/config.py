@@ -38,6 +38,8 @@ class TrainConfig:
     precision: str
     output: str
 
+    model_cache_gb: float = 0.0
+
     gradient_checkpointing: bool = False
     grad_accum_steps: int = 1
     repeats: int = 1
@@ -49,6 +51,8 @@ class TrainConfig:
     inference_prompt: str = ""
     inference_steps: int = 20
     inference_images: int = 2
+    preview_mode: str = "auto"
+    preview_nice: int = 10
 
     clip_skip: int = 0
 
@@ -59,11 +63,18 @@ class TrainConfig:
     prepend_token: str | None = None
     append_token: str | None = None
 
+    dataset_format: str = "folder"
     cache_latents: bool = False
+    cache_dir: str | None = None
+    cache_batch_size: int = 4
+    num_workers: int = 4
+    prefetch_factor: int = 2
+    cpu_threads: int = 0
     bucket_enabled: bool = False
-    bucket_min_res: int = 512
+    bucket_min_res: int = 256
     bucket_max_res: int = 1536
     bucket_step: int = 64
+    tail_batches: str = "keep"
 
     optimizer: str = "adamw"
     weight_decay: float = 0.01
@@ -78,10 +89,20 @@ class TrainConfig:
     use_xformers: bool = False
     cpu_offload: bool = False
 
+    perf_log_every: int = 0
+    perf_trace_start: int = 0
+    perf_trace_steps: int = 0
+
+    save_state: bool = False
+    save_state_every: int = 0
+    resume: str | None = None
+    events_file: str | None = None
+
 def log_train_config(cfg: TrainConfig) -> None:
     log("===== TRAIN CONFIG =====")
     log(f"model_type={cfg.model_type}")
     log(f"base_model={cfg.base_model}")
+    log(f"model_cache_gb={cfg.model_cache_gb}")
     log(f"precision={cfg.precision}")
     log(f"device={torch.device('cuda' if torch.cuda.is_available() else 'cpu')}")
     log(f"resolution={cfg.resolution}")
@@ -106,22 +127,34 @@ def log_train_config(cfg: TrainConfig) -> None:
     log(f"lora_dropout={cfg.lora_dropout}")
     log(f"clip_skip={cfg.clip_skip}")
     log(f"train_clip={cfg.clip_lr > 0}")
+    log(f"dataset_format={cfg.dataset_format}")
     log(f"cache_latents={cfg.cache_latents}")
+    log(f"cache_dir={cfg.cache_dir}")
+    log(f"cache_batch_size={cfg.cache_batch_size}")
+    log(f"num_workers={cfg.num_workers}")
+    log(f"prefetch_factor={cfg.prefetch_factor}")
     log(f"bucket_enabled={cfg.bucket_enabled}")
     if cfg.bucket_enabled:
         log(f"bucket_min={cfg.bucket_min_res} max={cfg.bucket_max_res} step={cfg.bucket_step}")
+    log(f"tail_batches={cfg.tail_batches}")
     log(f"prepend_token={cfg.prepend_token}")
     log(f"append_token={cfg.append_token}")
     log(f"memorize_first_token={cfg.memorize_first_token}")
+    log(f"perf_log_every={cfg.perf_log_every} perf_trace={cfg.perf_trace_start}+{cfg.perf_trace_steps}")
+    log(f"save_state={cfg.save_state} every={cfg.save_state_every} resume={cfg.resume}")
     log(f"do_inference={cfg.do_inference}")
+    if cfg.do_inference:
+        log(f"preview_mode={cfg.preview_mode} preview_nice={cfg.preview_nice}")
     log("===== END CONFIG =====")
 
 def build_arg_parser(default_resolution: int):
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_type", choices=["sd", "sdxl"], required=True)
     ap.add_argument("--base_model", required=True)
+    ap.add_argument("--model_cache_gb", type=float, default=0.0, help="Size budget of the converted single-file checkpoint cache under models/.converted (0 = off)")
     ap.add_argument("--dataset", required=True)
     ap.add_argument("--caption_ext", default=".txt")
+    ap.add_argument("--dataset_format", choices=["folder", "shards"], default="folder", help="folder = loose image/caption files, shards = output of trainer/pack_dataset.py")
     ap.add_argument("--prepend_token", default="")
     ap.add_argument("--append_token", default="")
     ap.add_argument("--resolution", type=int, default=default_resolution)
@@ -130,10 +163,16 @@ def build_arg_parser(default_resolution: int):
     ap.add_argument("--epochs", type=int, default=1)
     ap.add_argument("--shuffle", action="store_true")
     ap.add_argument("--cache_latents", action="store_true")
+    ap.add_argument("--cache_dir", default="", help="Directory for persistent caches: latents, image sizes (disabled if empty)")
+    ap.add_argument("--cache_batch_size", type=int, default=4, help="Images per VAE forward while caching latents")
+    ap.add_argument("--num_workers", type=int, default=4, help="Worker threads/processes for image decoding")
+    ap.add_argument("--prefetch_factor", type=int, default=2, help="Batches prefetched per data loader worker")
+    ap.add_argument("--cpu_threads", type=int, default=0, help="torch intra-op threads on CPU (0 = auto)")
     ap.add_argument("--bucket", action="store_true")
-    ap.add_argument("--bucket_min_res", type=int, default=512)
+    ap.add_argument("--bucket_min_res", type=int, default=256)
     ap.add_argument("--bucket_max_res", type=int, default=1536)
     ap.add_argument("--bucket_step", type=int, default=64)
+    ap.add_argument("--tail_batches", choices=["keep", "drop", "pad"], default="keep", help="Ragged last batch of each bucket: keep short, drop, or pad with samples from the same bucket")
     ap.add_argument("--scheduler_type", default="constant")
     ap.add_argument("--warmup_steps", type=int, default=0)
     ap.add_argument("--num_cycles", type=int, default=1)
@@ -145,11 +184,20 @@ def build_arg_parser(default_resolution: int):
     ap.add_argument("--precision", choices=["fp32", "fp16", "bf16"], default="fp32")
     ap.add_argument("--output", required=True)
     ap.add_argument("--save_every_epochs", type=int, default=0)
+    ap.add_argument("--perf_log_every", type=int, default=0, help="Time each step's sections and print a PERF line every N steps (0 = off; syncs CUDA)")
+    ap.add_argument("--perf_trace_start", type=int, default=0, help="Step after which a torch.profiler trace starts")
+    ap.add_argument("--perf_trace_steps", type=int, default=0, help="Steps covered by the torch.profiler trace (0 = no trace)")
+    ap.add_argument("--events_file", default="", help="Append typed JSON Lines training events here (disabled if empty)")
+    ap.add_argument("--save_state", action="store_true", help="Keep <output>_state.pt with optimizer/scheduler/RNG/sampler state for --resume")
+    ap.add_argument("--save_state_every", type=int, default=0, help="Also save the train state every N optimizer steps (0 = epoch ends and stop only)")
+    ap.add_argument("--resume", nargs="?", const="auto", default="", help="Continue from a train state file (no value = this run's own state file, if any)")
     ap.add_argument("--repeats", type=int, default=1)
     ap.add_argument("--do_inference", action="store_true")
     ap.add_argument("--inference_prompt", default="")
     ap.add_argument("--inference_steps", type=int, default=20)
     ap.add_argument("--inference_images", type=int, default=2)
+    ap.add_argument("--preview_mode", choices=["auto", "inline", "async", "deferred"], default="auto", help="inline = render on the trainer, async = worker process now, deferred = worker after training; auto = async with a spare GPU, else inline")
+    ap.add_argument("--preview_nice", type=int, default=10, help="Scheduling niceness of the preview worker (0 = normal priority)")
     ap.add_argument("--clip_skip", type=int, default=0)
     ap.add_argument("--optimizer", default="adamw")
     ap.add_argument("--weight_decay", type=float, default=0.01)
@@ -169,8 +217,10 @@ def cfg_from_args(args) -> TrainConfig:
     return TrainConfig(
         model_type=args.model_type,
         base_model=args.base_model,
+        model_cache_gb=args.model_cache_gb,
         dataset=args.dataset,
         caption_ext=args.caption_ext,
+        dataset_format=args.dataset_format,
         prepend_token=args.prepend_token.strip() or None,
         append_token=args.append_token.strip() or None,
         resolution=args.resolution,
@@ -190,16 +240,24 @@ def cfg_from_args(args) -> TrainConfig:
         inference_prompt=args.inference_prompt,
         inference_steps=args.inference_steps,
         inference_images=args.inference_images,
+        preview_mode=args.preview_mode,
+        preview_nice=args.preview_nice,
         clip_skip=args.clip_skip,
         scheduler_type=args.scheduler_type,
         warmup_steps=args.warmup_steps,
         num_cycles=args.num_cycles,
         gradient_checkpointing=args.gradient_checkpointing,
         cache_latents=args.cache_latents,
+        cache_dir=args.cache_dir.strip() or None,
+        cache_batch_size=args.cache_batch_size,
+        num_workers=args.num_workers,
+        prefetch_factor=args.prefetch_factor,
+        cpu_threads=args.cpu_threads,
         bucket_enabled=args.bucket,
         bucket_min_res=args.bucket_min_res,
         bucket_max_res=args.bucket_max_res,
         bucket_step=args.bucket_step,
+        tail_batches=args.tail_batches,
         optimizer=args.optimizer,
         weight_decay=args.weight_decay,
         beta1=args.beta1,
@@ -212,4 +270,11 @@ def cfg_from_args(args) -> TrainConfig:
         target_modules=parse_target_modules(args.target_modules),
         use_xformers=args.use_xformers,
         cpu_offload=args.cpu_offload,
+        perf_log_every=args.perf_log_every,
+        perf_trace_start=args.perf_trace_start,
+        perf_trace_steps=args.perf_trace_steps,
+        save_state=args.save_state,
+        save_state_every=args.save_state_every,
+        resume=args.resume.strip() or None,
+        events_file=args.events_file.strip() or None,
     )
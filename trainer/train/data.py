@@ -1,19 +1,56 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
 from collections import Counter
 
+import numpy as np
 import torch
 from PIL import Image
 from torchvision import transforms
 
+from utils.image_index import IMAGE_SIZE_INDEX, probe_image_sizes
+
+from .buckets import bucket_crop, build_bucket_resolutions, format_bucket, pick_bucket
 from .config import TrainConfig, log
+from .latent_cache import LatentCache, LatentManifest, LatentStore, file_sha256, latent_key, vae_identity
 
 def parse_caption_tags(text: str) -> list[str]:
     parts = [t.strip() for t in text.split(",")]
     return [p for p in parts if p]
 
-def load_dataset(dataset_dir: str, caption_ext: str) -> List[Tuple[str, str]]:
+class FolderDataset:
+    """Loose image + caption file pairs in a single directory."""
+
+    def __init__(self, items: list[tuple[str, str]]):
+        self.items = items
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, idx: int) -> tuple[str, str]:
+        return self.items[idx]
+
+    def read_caption(self, idx: int) -> str:
+        return Path(self.items[idx][1]).read_text(encoding="utf-8").strip()
+
+    def image_sizes(self, index_path: Path | None) -> list[tuple[int, int]]:
+        sizes = probe_image_sizes([img_path for img_path, _ in self.items], index_path=index_path)
+        return [sizes[img_path] for img_path, _ in self.items]
+
+    def stamp(self, idx: int) -> tuple[str, int, int]:
+        """(source, mtime_ns, size) used to detect changed files between runs."""
+        img_path = self.items[idx][0]
+        st = os.stat(img_path)
+        return os.path.abspath(img_path), st.st_mtime_ns, st.st_size
+
+    def content_hash(self, idx: int) -> str:
+        return file_sha256(self.items[idx][0])
+
+    def load_image(self, idx: int, bucket: tuple[int, int]) -> torch.Tensor:
+        return load_bucket_image(self.items[idx][0], bucket)
+
+def load_dataset(dataset_dir: str, caption_ext: str) -> FolderDataset:
     items = []
     for name in sorted(os.listdir(dataset_dir)):
         if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
@@ -24,20 +61,24 @@ def load_dataset(dataset_dir: str, caption_ext: str) -> List[Tuple[str, str]]:
             items.append((img_path, cap_path))
     if not items:
         raise RuntimeError("Dataset is empty")
-    return items
+    return FolderDataset(items)
 
-def image_transform(res: int):
-    return transforms.Compose([
-        transforms.Resize(res, interpolation=transforms.InterpolationMode.BILINEAR),
-        transforms.CenterCrop(res),
-        transforms.ToTensor(),
-        transforms.Normalize([0.5] * 3, [0.5] * 3),
-    ])
+_to_normalized_tensor = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize([0.5] * 3, [0.5] * 3),
+])
 
-def pick_bucket_resolution(w: int, h: int, cfg: TrainConfig) -> int:
-    base = min(max(max(w, h), cfg.bucket_min_res), cfg.bucket_max_res)
-    step = cfg.bucket_step
-    return (base // step) * step
+def resize_to_bucket(img: Image.Image, bucket: tuple[int, int]) -> Image.Image:
+    if img.size == bucket:
+        return img
+    rw, rh, left, top = bucket_crop(img.width, img.height, bucket)
+    img = img.resize((rw, rh), Image.BILINEAR)
+    return img.crop((left, top, left + bucket[0], top + bucket[1]))
+
+def load_bucket_image(img_path: str, bucket: tuple[int, int]) -> torch.Tensor:
+    with Image.open(img_path) as img:
+        img = resize_to_bucket(img.convert("RGB"), bucket)
+    return _to_normalized_tensor(img)
 
 def apply_caption_options(text: str, cfg: TrainConfig) -> str:
     text = text.strip()
@@ -51,35 +92,92 @@ def apply_caption_options(text: str, cfg: TrainConfig) -> str:
         text = f"{text}, {cfg.append_token}"
     return text
 
+class CaptionIndex:
+    """
+    Processed captions (after apply_caption_options) and their parsed tags, read once per run.
+    Text and tag ids live in flat numpy buffers with offsets instead of per-sample Python objects.
+    """
+
+    def __init__(self, captions: list[str]):
+        encoded = [c.encode("utf-8") for c in captions]
+        self._text = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self._text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=self._text_offsets[1:])
+
+        vocab: dict[str, int] = {}
+        tag_ids: list[int] = []
+        tag_counts: list[int] = []
+        for caption in captions:
+            tags = parse_caption_tags(caption)
+            tag_ids.extend(vocab.setdefault(t, len(vocab)) for t in tags)
+            tag_counts.append(len(tags))
+
+        self.vocab = list(vocab)
+        self._tag_ids = np.asarray(tag_ids, dtype=np.int32)
+        self._tag_offsets = np.zeros(len(captions) + 1, dtype=np.int64)
+        np.cumsum(tag_counts, out=self._tag_offsets[1:])
+
+    @classmethod
+    def from_dataset(cls, cfg: TrainConfig, dataset) -> "CaptionIndex":
+        return cls([apply_caption_options(dataset.read_caption(i), cfg) for i in range(len(dataset))])
+
+    def __len__(self) -> int:
+        return len(self._text_offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = self._text_offsets[idx], self._text_offsets[idx + 1]
+        return self._text[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def tags(self, idx: int) -> list[str]:
+        start, end = self._tag_offsets[idx], self._tag_offsets[idx + 1]
+        return [self.vocab[t] for t in self._tag_ids[start:end]]
+
+    def tag_counter(self, repeats: int = 1) -> Counter:
+        counts = np.bincount(self._tag_ids, minlength=len(self.vocab)) * repeats
+        return Counter({t: int(n) for t, n in zip(self.vocab, counts) if n})
+
 def build_dataset_buckets_and_tags(cfg: TrainConfig):
     log("STATUS loading_dataset")
-    base_dataset = load_dataset(cfg.dataset, cfg.caption_ext)
-
     if cfg.repeats < 1:
         raise ValueError("repeats must be >= 1")
 
-    dataset = base_dataset * cfg.repeats
-    tag_counter = Counter()
+    # Samples are kept unique; repeats are applied when the epoch schedule is built.
+    if cfg.dataset_format == "shards":
+        from .shards import ShardDataset
+        dataset = ShardDataset(cfg.dataset)
+        log(f"STATUS dataset_format=shards shards={dataset.num_shards} samples={len(dataset)}")
+    else:
+        dataset = load_dataset(cfg.dataset, cfg.caption_ext)
 
-    for _, cap_path in dataset:
-        text = Path(cap_path).read_text(encoding="utf-8").strip()
-        text = apply_caption_options(text, cfg)
-        tag_counter.update(parse_caption_tags(text))
+    captions = CaptionIndex.from_dataset(cfg, dataset)
+    tag_counter = captions.tag_counter(cfg.repeats)
 
     trained_words = ", ".join([t for t, _ in tag_counter.most_common(200)])
 
-    bucket_map: dict[int, list[int]] = {}
-    if cfg.bucket_enabled:
-        for i, (img_path, _) in enumerate(dataset):
-            with Image.open(img_path) as img:
-                w, h = img.size
-            bucket_res = pick_bucket_resolution(w, h, cfg)
-            bucket_map.setdefault(bucket_res, []).append(i)
+    index_path = Path(cfg.cache_dir) / IMAGE_SIZE_INDEX if cfg.cache_dir else None
+    image_sizes = dataset.image_sizes(index_path)
+
+    bucket_map: dict[tuple[int, int], list[int]] = {}
+    if cfg.dataset_format == "shards":
+        # Images were resized into their buckets at pack time.
+        dataset.check_bucket_settings(cfg)
+        for i in range(len(dataset)):
+            bucket_map.setdefault(dataset.packed_bucket(i), []).append(i)
+    elif cfg.bucket_enabled:
+        buckets = build_bucket_resolutions(cfg.resolution, cfg.bucket_min_res, cfg.bucket_max_res, cfg.bucket_step)
+        log(f"STATUS bucket_resolutions={' '.join(format_bucket(b) for b in buckets)}")
+        if len(buckets) == 1:
+            log("WARN only one bucket fits the bucket range at this resolution; lower bucket_min_res for aspect buckets")
+        for i, (w, h) in enumerate(image_sizes):
+            bucket_map.setdefault(pick_bucket(w, h, buckets), []).append(i)
     else:
-        bucket_map[cfg.resolution] = list(range(len(dataset)))
+        bucket_map[(cfg.resolution, cfg.resolution)] = list(range(len(dataset)))
 
-    for res, ids in bucket_map.items():
-        log(f"STATUS bucket[{res}] size={len(ids)}")
+    for bucket, ids in bucket_map.items():
+        log(f"STATUS bucket[{format_bucket(bucket)}] size={len(ids) * cfg.repeats} unique={len(ids)}")
 
     if cfg.cache_latents and cfg.bucket_enabled:
         log("STATUS cache_latents=ENABLED (per-bucket)")
@@ -91,7 +189,69 @@ def build_dataset_buckets_and_tags(cfg: TrainConfig):
     else:
         log("STATUS bucket=DISABLED")
 
-    return dataset, bucket_map, tag_counter, trained_words
+    return dataset, bucket_map, tag_counter, trained_words, image_sizes, captions
+
+def epoch_samples(bucket_map, repeats: int) -> int:
+    return sum(len(ids) for ids in bucket_map.values()) * repeats
+
+def epoch_steps(bucket_map, repeats: int, batch_size: int, tail: str = "keep") -> int:
+    """Batches per epoch; with tail="drop" each bucket's ragged last batch is not counted."""
+    if tail == "drop":
+        return sum(len(ids) * repeats // batch_size for ids in bucket_map.values())
+    return sum(
+        (len(ids) * repeats + batch_size - 1) // batch_size
+        for ids in bucket_map.values()
+    )
+
+def resolve_cpu_threads(cfg: TrainConfig) -> int:
+    if cfg.cpu_threads > 0:
+        return cfg.cpu_threads
+    # Leave room for the decode workers so they can keep the encoder fed.
+    return max(1, (os.cpu_count() or 1) - max(cfg.num_workers, 0))
+
+def _encode_latent_batches(
+    *,
+    dataset,
+    jobs: list[tuple[str, int]],
+    pool: ThreadPoolExecutor,
+    batch_size: int,
+    store: LatentStore,
+    vae,
+    device: torch.device,
+    dtype: torch.dtype,
+    scaling_factor: float,
+    bucket: tuple[int, int],
+) -> int:
+    batches = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+    if not batches:
+        return 0
+
+    def submit(batch):
+        return [pool.submit(dataset.load_image, idx, bucket) for _, idx in batch]
+
+    start = time.perf_counter()
+    done = 0
+    pending = submit(batches[0])
+
+    for i, batch in enumerate(batches):
+        pixels = [f.result() for f in pending]
+        # Decode the next batch on the pool while the VAE runs on this one.
+        pending = submit(batches[i + 1]) if i + 1 < len(batches) else []
+
+        pixel = torch.stack(pixels).to(device=device, dtype=dtype)
+        latents = vae.encode(pixel).latent_dist.sample() * scaling_factor
+        for (key, _), lat in zip(batch, latents):
+            store.put(key, lat.unsqueeze(0))
+
+        done += len(batch)
+        if (i + 1) % 10 == 0 or i + 1 == len(batches):
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            log(
+                f"STATUS caching bucket={format_bucket(bucket)} encoded={done}/{len(jobs)} "
+                f"images_per_sec={done / elapsed:.2f}"
+            )
+
+    return done
 
 def build_latent_cache(
     *,
@@ -106,24 +266,78 @@ def build_latent_cache(
     if not cfg.cache_latents:
         return None
 
+    if cfg.cache_batch_size < 1:
+        raise ValueError("cache_batch_size must be >= 1")
+
     log("STATUS building latent cache")
-    cached_latents_by_bucket: dict[int, dict[int, torch.Tensor]] = {}
-
-    with torch.no_grad():
-        for bucket_res, bucket_indices in bucket_map.items():
-            log(f"STATUS caching bucket_res={bucket_res} samples={len(bucket_indices)}")
-            tfm_bucket = image_transform(bucket_res)
-            bucket_cache: dict[int, torch.Tensor] = {}
-
-            for idx in bucket_indices:
-                img_path, _ = dataset[idx]
-                img = Image.open(img_path).convert("RGB")
-                pixel = tfm_bucket(img).unsqueeze(0).to(device=device, dtype=dtype)
-                latents = vae.encode(pixel).latent_dist.sample() * scaling_factor
-                bucket_cache[idx] = latents.detach().to(torch.float16).cpu()
-
-            cached_latents_by_bucket[bucket_res] = bucket_cache
-
-    total_cached = sum(len(v) for v in cached_latents_by_bucket.values())
-    log(f"STATUS cached_latents_total={total_cached}")
-    return cached_latents_by_bucket
+    store_root = Path(cfg.cache_dir) / "latents" if cfg.cache_dir else None
+    store = LatentStore(store_root)
+    if store_root is not None:
+        log(f"STATUS latent_store={store_root}")
+
+    prev_threads = torch.get_num_threads()
+    if device.type == "cpu":
+        torch.set_num_threads(resolve_cpu_threads(cfg))
+        log(f"STATUS cache_cpu_threads={torch.get_num_threads()}")
+
+    manifest = LatentManifest(store_root / "manifest.json" if store_root else None)
+    vae_id = vae_identity(cfg.base_model, vae, dtype)
+    keys_by_bucket: dict[tuple[int, int], dict[int, str]] = {}
+    encoded = 0
+    reused = 0
+    start = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(cfg.num_workers, 1)) as pool, torch.no_grad():
+            indices = sorted({i for ids in bucket_map.values() for i in ids})
+            stamps = dict(zip(indices, pool.map(dataset.stamp, indices)))
+            image_hashes = dict(zip(indices, pool.map(
+                lambda i: manifest.content_hash(stamps[i], lambda: dataset.content_hash(i)), indices
+            )))
+
+            for bucket, bucket_indices in bucket_map.items():
+                log(f"STATUS caching bucket={format_bucket(bucket)} unique_samples={len(bucket_indices)}")
+                bucket_keys: dict[int, str] = {}
+                jobs: dict[str, int] = {}
+
+                for idx in bucket_indices:
+                    key = latent_key(image_hashes[idx], bucket, vae_id)
+                    bucket_keys[idx] = key
+                    if store.has(key):
+                        reused += 1
+                    else:
+                        jobs.setdefault(key, idx)
+
+                encoded += _encode_latent_batches(
+                    dataset=dataset,
+                    jobs=list(jobs.items()),
+                    pool=pool,
+                    batch_size=cfg.cache_batch_size,
+                    store=store,
+                    vae=vae,
+                    device=device,
+                    dtype=dtype,
+                    scaling_factor=scaling_factor,
+                    bucket=bucket,
+                )
+                keys_by_bucket[bucket] = bucket_keys
+    finally:
+        torch.set_num_threads(prev_threads)
+
+    keys_by_index: dict[int, set[str]] = {}
+    for bucket_keys in keys_by_bucket.values():
+        for idx, key in bucket_keys.items():
+            keys_by_index.setdefault(idx, set()).add(key)
+    stale, changed, deleted = manifest.update(stamps, image_hashes, keys_by_index)
+    for key in stale:
+        store.delete(key)
+    manifest.save()
+    log(f"STATUS latent_manifest changed={changed} deleted={deleted} dropped_latents={len(stale)}")
+
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    cache = LatentCache(store, keys_by_bucket)
+    log(
+        f"STATUS cached_latents_total={len(cache)} encoded={encoded} reused={reused} "
+        f"elapsed={elapsed:.1f}s images_per_sec={encoded / elapsed:.2f}"
+    )
+    return cache
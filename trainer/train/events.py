@@ -0,0 +1,102 @@
+import json
+import threading
+import time
+import uuid
+from pathlib import Path
+
+class EventStream:
+    """
+    Append-only JSON Lines of typed training events, next to the free-form train.log:
+    run_start, config, step, epoch_end, checkpoint, preview, error, done.
+    Every line carries a run id and a sequence number; later runs of the project append to the
+    same file and continue the sequence, so seq only grows and a reader's byte offset stays valid.
+    Readers remember the offset they stopped at and read only what came after.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.run_id = uuid.uuid4().hex[:12]
+        self.seq, complete = _stream_tail(self.path)
+        self.lock = threading.Lock()
+        self.f = open(self.path, "a", encoding="utf-8")
+        if not complete:
+            # A previous run died mid-line; readers skip the fragment.
+            self.f.write("\n")
+
+    def emit(self, type: str, **fields) -> None:
+        with self.lock:
+            self.seq += 1
+            event = {"seq": self.seq, "run": self.run_id, "time": time.time(), "type": type, **fields}
+            self.f.write(json.dumps(event, default=str) + "\n")
+            self.f.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.f.close()
+
+def _stream_tail(path: Path, chunk: int = 1 << 16) -> tuple[int, bool]:
+    """(seq of the last complete event, whether the file ends on a line break) of an existing stream."""
+    if not path.exists() or path.stat().st_size == 0:
+        return 0, True
+    with open(path, "rb") as f:
+        f.seek(max(path.stat().st_size - chunk, 0))
+        tail = f.read()
+    lines = tail.split(b"\n")
+    # The last element is empty or a partial line; the first may start mid-line.
+    for line in reversed(lines[:-1]):
+        try:
+            return int(json.loads(line)["seq"]), tail.endswith(b"\n")
+        except (ValueError, KeyError, TypeError):
+            continue
+    return 0, tail.endswith(b"\n")
+
+_stream: EventStream | None = None
+
+def open_event_stream(path: str | None) -> None:
+    global _stream
+    if not path:
+        return
+    _stream = EventStream(Path(path))
+    emit("run_start")
+
+def emit(type: str, **fields) -> None:
+    """Like log(), callable from anywhere (including background threads); a no-op without a stream."""
+    if _stream is not None:
+        _stream.emit(type, **fields)
+
+def close_event_stream() -> None:
+    global _stream
+    if _stream is not None:
+        _stream.close()
+        _stream = None
+
+def read_events(path: Path, offset: int = 0, limit: int = 1000) -> tuple[list[dict], int]:
+    """
+    Events written after byte offset, plus the offset to pass next time.
+    Only complete lines are consumed, so a line being written is picked up on the next read.
+    An offset inside a line resyncs to the next one; lines that do not decode are skipped.
+    """
+    if not path.exists():
+        return [], 0
+    if offset > path.stat().st_size:
+        offset = 0
+
+    events = []
+    with open(path, "rb") as f:
+        if offset > 0:
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                rest = f.readline()
+                if not rest.endswith(b"\n"):
+                    return [], offset
+                offset += len(rest)
+        for line in f:
+            if not line.endswith(b"\n") or len(events) >= limit:
+                break
+            offset += len(line)
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events, offset
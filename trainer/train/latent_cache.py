@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+import torch
+
+# Bump whenever load_bucket_image changes so stale latents are never reused.
+LATENT_TRANSFORM_ID = "cover_resize_bilinear+center_crop+normalize_0.5"
+
+def file_sha256(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def vae_identity(base_model: str, vae, dtype: torch.dtype) -> str:
+    config = dict(getattr(vae, "config", None) or {})
+    payload = json.dumps(
+        {"base_model": base_model, "vae_config": config, "dtype": str(dtype)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def latent_key(image_sha256: str, bucket: tuple[int, int], vae_id: str) -> str:
+    raw = f"{image_sha256}|{bucket[0]}x{bucket[1]}|{vae_id}|{LATENT_TRANSFORM_ID}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class LatentStore:
+    """
+    Content-addressed latent storage.
+    With a root directory every latent is a .npy file that is memory-mapped on read,
+    without one latents are kept in RAM for the lifetime of the run.
+    """
+
+    def __init__(self, root: str | Path | None):
+        self.root = Path(root) if root else None
+        self._mem: dict[str, torch.Tensor] = {}
+        if self.root is not None:
+            self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.npy"
+
+    def has(self, key: str) -> bool:
+        if self.root is None:
+            return key in self._mem
+        return self._path(key).is_file()
+
+    def put(self, key: str, latents: torch.Tensor) -> None:
+        latents = latents.detach().to(torch.float16).cpu()
+        if self.root is None:
+            self._mem[key] = latents
+            return
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, latents.numpy())
+        os.replace(tmp, path)
+
+    def get(self, key: str) -> torch.Tensor:
+        if self.root is None:
+            return self._mem[key]
+        arr = np.load(self._path(key), mmap_mode="r")
+        # Read-only view of the mapping; callers copy when they torch.cat the batch.
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="The given NumPy array is not writable")
+            return torch.from_numpy(arr)
+
+    def delete(self, key: str) -> None:
+        if self.root is None:
+            self._mem.pop(key, None)
+            return
+        self._path(key).unlink(missing_ok=True)
+
+class LatentManifest:
+    """
+    Per-source record of (mtime_ns, size, sha256, latent keys) written at cache time.
+    Unchanged sources skip hashing; latents only reachable from deleted or
+    modified sources are dropped from the store.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str | Path | None):
+        self.path = Path(path) if path else None
+        self.entries: dict[str, dict] = {}
+        if self.path is not None and self.path.is_file():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                if data.get("version") == self.VERSION:
+                    self.entries = data["entries"]
+            except (OSError, ValueError, KeyError):
+                self.entries = {}
+
+    def content_hash(self, stamp: tuple[str, int, int], hash_fn) -> str:
+        source, mtime_ns, size = stamp
+        entry = self.entries.get(source)
+        if entry and entry["mtime_ns"] == mtime_ns and entry["size"] == size:
+            return entry["sha256"]
+        return hash_fn()
+
+    def update(self, stamps: dict[int, tuple[str, int, int]], hashes: dict[int, str], keys: dict[int, set[str]]) -> tuple[set[str], int, int]:
+        """
+        Replaces the entries with the current sources.
+        Returns (stale latent keys, changed sources, deleted sources).
+        """
+        old = self.entries
+        new: dict[str, dict] = {}
+        changed = 0
+        for idx, (source, mtime_ns, size) in stamps.items():
+            prev = old.get(source)
+            live = set(keys.get(idx, ()))
+            if prev is not None:
+                if prev["sha256"] == hashes[idx]:
+                    # Latents for other buckets/VAEs of the same content stay valid.
+                    live |= set(prev["latents"])
+                else:
+                    changed += 1
+            new[source] = {"mtime_ns": mtime_ns, "size": size, "sha256": hashes[idx], "latents": sorted(live)}
+
+        deleted = sum(1 for source in old if source not in new)
+        referenced = {k for e in new.values() for k in e["latents"]}
+        stale = {k for e in old.values() for k in e["latents"]} - referenced
+        self.entries = new
+        return stale, changed, deleted
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"version": self.VERSION, "entries": self.entries}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+class LatentCache:
+    def __init__(self, store: LatentStore, keys_by_bucket: dict[tuple[int, int], dict[int, str]]):
+        self.store = store
+        self.keys_by_bucket = keys_by_bucket
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self.keys_by_bucket.values())
+
+    def load(self, bucket: tuple[int, int], indices: list[int]) -> torch.Tensor:
+        keys = self.keys_by_bucket[bucket]
+        return torch.cat([self.store.get(keys[i]) for i in indices], dim=0)
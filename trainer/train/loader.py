@@ -0,0 +1,167 @@
+import signal
+
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from .config import TrainConfig, log
+from .data import bucket_crop, epoch_steps
+
+TAIL_MODES = ("keep", "drop", "pad")
+
+class BucketBatchSampler(Sampler):
+    """
+    Yields batches of (dataset index, bucket) pairs; every batch comes from a single bucket.
+    Repeats are expanded here so the dataset itself stays unique.
+
+    Batches are formed per bucket first; with shuffle the batch order is then shuffled across
+    buckets so resolutions are interleaved instead of run one bucket after another.
+    tail decides a bucket's ragged last batch: keep it short, drop it, or pad it with
+    random samples from the same bucket so every step runs at full batch size.
+    """
+
+    def __init__(self, bucket_map: dict[tuple[int, int], list[int]], *, batch_size: int, repeats: int, shuffle: bool, seed: int, tail: str = "keep"):
+        if tail not in TAIL_MODES:
+            raise ValueError(f"tail must be one of {TAIL_MODES}, got {tail!r}")
+        self.bucket_map = bucket_map
+        self.batch_size = batch_size
+        self.repeats = repeats
+        self.shuffle = shuffle
+        self.seed = seed
+        self.tail = tail
+        self.epoch = 0
+        self.start_batch = 0
+        self.resume_batches: list | None = None
+
+    def set_epoch(self, epoch: int) -> None:
+        if epoch != self.epoch:
+            self.start_batch = 0
+            self.resume_batches = None
+        self.epoch = epoch
+
+    def state_dict(self, epoch: int, start_batch: int) -> dict:
+        """Cursor plus that epoch's batch order, so a resumed run replays exactly the same batches."""
+        batches = self.epoch_batches() if epoch == self.epoch else self._build_batches(epoch)
+        return {"epoch": epoch, "start_batch": start_batch, "batches": batches}
+
+    def load_state_dict(self, sd: dict) -> None:
+        self.epoch = sd["epoch"]
+        self.start_batch = sd["start_batch"]
+        self.resume_batches = [[(idx, tuple(bucket)) for idx, bucket in batch] for batch in sd["batches"]]
+
+    def bucket_samples(self, bucket: tuple[int, int]) -> int:
+        return len(self.bucket_map[bucket]) * self.repeats
+
+    def epoch_batches(self) -> list[list[tuple[int, tuple[int, int]]]]:
+        if self.resume_batches is not None:
+            return self.resume_batches
+        return self._build_batches(self.epoch)
+
+    def _build_batches(self, epoch: int) -> list[list[tuple[int, tuple[int, int]]]]:
+        gen = torch.Generator().manual_seed(self.seed + epoch)
+        batches = []
+        for bucket, unique_indices in self.bucket_map.items():
+            indices = unique_indices * self.repeats
+            if self.shuffle:
+                indices = [indices[i] for i in torch.randperm(len(indices), generator=gen).tolist()]
+
+            for start in range(0, len(indices), self.batch_size):
+                chunk = indices[start:start + self.batch_size]
+                if len(chunk) < self.batch_size:
+                    if self.tail == "drop":
+                        continue
+                    if self.tail == "pad":
+                        fill = torch.randint(len(unique_indices), (self.batch_size - len(chunk),), generator=gen)
+                        chunk = chunk + [unique_indices[i] for i in fill.tolist()]
+                batches.append([(idx, bucket) for idx in chunk])
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=gen).tolist()]
+        return batches
+
+    def __iter__(self):
+        yield from self.epoch_batches()[self.start_batch:]
+
+    def __len__(self) -> int:
+        """Batches left in the epoch; fewer than a full epoch when resumed part-way."""
+        total = len(self.resume_batches) if self.resume_batches is not None else epoch_steps(self.bucket_map, self.repeats, self.batch_size, self.tail)
+        return max(total - self.start_batch, 0)
+
+class TrainSampleDataset(Dataset):
+    def __init__(
+        self,
+        cfg: TrainConfig,
+        dataset,
+        image_sizes: list[tuple[int, int]],
+        load_images: bool,
+    ):
+        self.cfg = cfg
+        self.dataset = dataset
+        self.image_sizes = image_sizes
+        self.load_images = load_images
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, item: tuple[int, tuple[int, int]]) -> dict:
+        idx, bucket = item
+        w, h = self.image_sizes[idx]
+        _, _, left, top = bucket_crop(w, h, bucket)
+
+        sample = {
+            "index": idx,
+            "bucket": bucket,
+            "original_size": (h, w),
+            "crop_top_left": (top, left),
+        }
+        if self.load_images:
+            sample["pixel"] = self.dataset.load_image(idx, bucket)
+        return sample
+
+def collate_batch(samples: list[dict]) -> dict:
+    return {
+        "indices": [s["index"] for s in samples],
+        "bucket": samples[0]["bucket"],
+        "original_sizes": [s["original_size"] for s in samples],
+        "crops_top_left": [s["crop_top_left"] for s in samples],
+        "pixels": torch.stack([s["pixel"] for s in samples]) if "pixel" in samples[0] else None,
+    }
+
+def _ignore_sigterm(worker_id: int) -> None:
+    # /stop signals the whole process group; workers must outlive the trainer's final state save.
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def build_train_loader(cfg: TrainConfig, dataset, bucket_map, image_sizes) -> DataLoader:
+    sampler = BucketBatchSampler(
+        bucket_map,
+        batch_size=cfg.batch_size,
+        repeats=cfg.repeats,
+        shuffle=cfg.shuffle,
+        seed=cfg.seed,
+        tail=cfg.tail_batches,
+    )
+    if cfg.tail_batches == "drop":
+        starved = [b for b, ids in bucket_map.items() if len(ids) * cfg.repeats < cfg.batch_size]
+        if starved:
+            log(f"WARN tail_batches=drop skips {len(starved)} bucket(s) smaller than batch_size={cfg.batch_size}")
+    # Cached latents replace the pixels, leaving only crop metadata: not worth worker processes.
+    ds = TrainSampleDataset(cfg, dataset, image_sizes, load_images=not cfg.cache_latents)
+
+    num_workers = max(cfg.num_workers, 0) if ds.load_images else 0
+    kwargs = {}
+    if num_workers > 0:
+        kwargs["prefetch_factor"] = max(cfg.prefetch_factor, 1)
+        kwargs["persistent_workers"] = True
+        kwargs["worker_init_fn"] = _ignore_sigterm
+
+    return DataLoader(
+        ds,
+        batch_sampler=sampler,
+        num_workers=num_workers,
+        collate_fn=collate_batch,
+        pin_memory=torch.cuda.is_available(),
+        # iter(loader) draws the workers' base seed from here instead of the global generator,
+        # so a resumed run's noise/dropout stream matches an uninterrupted one.
+        generator=torch.Generator().manual_seed(cfg.seed),
+        **kwargs,
+    )
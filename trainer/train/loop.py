@@ -1,55 +1,90 @@
 from dataclasses import dataclass
 import torch
 from .config import TrainConfig, log
+from .data import format_bucket
+from .events import emit
+from .perf import StepProfiler
 
 @dataclass
 class TrainState:
     global_step: int = 0
     opt_step: int = 0
+    epoch: int = 1
+    epoch_batch: int = 0
 
 def train_epochs(
     *,
     cfg: TrainConfig,
-    dataset,
-    bucket_map,
+    loader,
     step_fn,
     optimizer,
     lr_scheduler,
     trainable_params,
     on_epoch_end=None,
-    timer=None
+    timer=None,
+    state: TrainState | None = None,
+    save_state=None,
+    stop=None,
+    perf: StepProfiler | None = None,
 ):
+    """
+    state: a TrainState restored by load_train_state to continue a run, else a fresh one.
+    save_state(state) is called every cfg.save_state_every optimizer steps and after each epoch.
+    When stop (a StopRequest) has been signalled the run saves (if it can) and exits at the next
+    optimizer step instead of finishing.
+    perf: a StepProfiler; the step_fn should share it to split its own time into sections.
+    """
     if cfg.grad_accum_steps < 1:
         raise ValueError("grad_accum_steps must be >= 1")
 
     optimizer.zero_grad(set_to_none=True)
-    state = TrainState()
-
-    for epoch in range(1, cfg.epochs + 1):
-        for bucket_res, bucket_indices in bucket_map.items():
-            log(f"STATUS training bucket_res={bucket_res} samples={len(bucket_indices)}")
-
-            if cfg.shuffle:
-                bucket_indices = torch.tensor(bucket_indices)[torch.randperm(len(bucket_indices))].tolist()
-
-            num_samples = len(bucket_indices)
-            bs = cfg.batch_size
-
-            for start in range(0, num_samples, bs):
-                batch_indices = bucket_indices[start:start + bs]
-                loss = step_fn(batch_indices, bucket_res)
-
-                (loss / cfg.grad_accum_steps).backward()
+    state = state or TrainState()
+    sampler = loader.batch_sampler
+    perf = perf or StepProfiler()
+    perf.start()
+
+    # Stopped runs exit via SystemExit; their profile is the one worth keeping.
+    try:
+        for epoch in range(state.epoch, cfg.epochs + 1):
+            state.epoch = epoch
+            sampler.set_epoch(epoch)
+            if loader.generator is not None:
+                # Same worker seeds for an epoch whether it starts fresh or mid-way after a resume.
+                loader.generator.manual_seed(cfg.seed + epoch)
+            seen_buckets = set()
+            if timer is not None:
+                timer.start_epoch(sampler.epoch_batches(), sampler.start_batch, cfg.epochs - epoch)
+
+            batches = iter(loader)
+            while True:
+                with perf.section("data"):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+
+                bucket = batch["bucket"]
+                if bucket not in seen_buckets:
+                    seen_buckets.add(bucket)
+                    log(f"STATUS training bucket={format_bucket(bucket)} samples={sampler.bucket_samples(bucket)}")
+
+                loss = step_fn(batch)
+
+                with perf.section("backward"):
+                    (loss / cfg.grad_accum_steps).backward()
                 state.global_step += 1
+                state.epoch_batch += 1
+                if timer is not None:
+                    timer.step(bucket, len(batch["indices"]))
 
                 if state.global_step % cfg.grad_accum_steps == 0:
-                    torch.nn.utils.clip_grad_norm_(trainable_params, 1.0)
-                    optimizer.step()
-                    lr_scheduler.step()
-                    optimizer.zero_grad(set_to_none=True)
+                    with perf.section("optimizer"):
+                        torch.nn.utils.clip_grad_norm_(trainable_params, 1.0)
+                        optimizer.step()
+                        lr_scheduler.step()
+                        optimizer.zero_grad(set_to_none=True)
                     state.opt_step += 1
 
-                    eta = timer.update(state.opt_step) if timer else None
+                    eta = timer.eta() if timer else None
 
                     if state.opt_step % cfg.log_every == 0:
                         lr = (
@@ -69,10 +104,47 @@ def train_epochs(
                             mins = int(eta // 60)
                             secs = int(eta % 60)
                             msg += f" eta={mins:02d}:{secs:02d}"
+                        if timer is not None and timer.samples_per_sec is not None:
+                            msg += f" samples_s={timer.samples_per_sec:.2f} mpix_s={timer.pixels_per_sec / 1e6:.2f}"
 
                         log(msg)
+                        emit(
+                            "step",
+                            epoch=epoch,
+                            opt_step=state.opt_step,
+                            lr=lr,
+                            loss=loss.item(),
+                            eta=eta,
+                            samples_per_sec=timer.samples_per_sec if timer else None,
+                            pixels_per_sec=timer.pixels_per_sec if timer else None,
+                        )
 
-        if on_epoch_end is not None:
-            on_epoch_end(epoch, state)
-
+                    if stop is not None and stop.requested:
+                        if save_state is not None:
+                            save_state(state)
+                            log("STATUS stopped (resume with --resume)")
+                        else:
+                            log("STATUS stopped")
+                        raise SystemExit(143)
+                    if save_state is not None and cfg.save_state_every > 0 and state.opt_step % cfg.save_state_every == 0:
+                        with perf.section("checkpoint"):
+                            save_state(state)
+                        if timer is not None:
+                            timer.mark()
+
+                perf.step_end(state.global_step, epoch=epoch, bucket=format_bucket(bucket))
+
+            if on_epoch_end is not None:
+                on_epoch_end(epoch, state)
+            emit("epoch_end", epoch=epoch, opt_step=state.opt_step)
+
+            state.epoch = epoch + 1
+            state.epoch_batch = 0
+            # Gradients still accumulating across the epoch boundary cannot be captured; skip until aligned.
+            if save_state is not None and state.global_step % cfg.grad_accum_steps == 0:
+                with perf.section("checkpoint"):
+                    save_state(state)
+            perf.flush_event("epoch_end", epoch=epoch)
+    finally:
+        perf.close()
     return state
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -6,6 +8,59 @@ from safetensors.torch import save_file
 DEFAULT_TARGET_MODULES = ["to_q", "to_k", "to_v", "to_out.0"]
 DEFAULT_TE_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "out_proj"]
 
+class _LoRALinearFn(torch.autograd.Function):
+    """
+    base(x) + scale * (dropout(x) @ A) @ B, accumulated into the base output with addmm.
+    Saves x, the low-rank activation h and a bool dropout mask; no output-sized
+    temporaries are kept for backward. The base weight is frozen.
+    """
+
+    @staticmethod
+    def forward(ctx, x, weight, bias, A, B, scale: float, p: float):
+        shape = x.shape
+        x2 = x.reshape(-1, shape[-1])
+
+        mask = None
+        xd = x2
+        if p > 0:
+            mask = torch.rand_like(x2) >= p
+            xd = x2 * mask / (1.0 - p)
+
+        h = xd @ A
+        if bias is not None:
+            out = torch.addmm(bias, x2, weight.t())
+        else:
+            out = x2 @ weight.t()
+        out.addmm_(h, B, alpha=scale)
+
+        ctx.save_for_backward(x2, weight, A, B, h, mask)
+        ctx.scale = scale
+        ctx.p = p
+        ctx.shape = shape
+        return out.reshape(*shape[:-1], out.shape[-1])
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        x2, weight, A, B, h, mask = ctx.saved_tensors
+        scale, p = ctx.scale, ctx.p
+        g = grad_out.reshape(-1, grad_out.shape[-1])
+
+        grad_h = (g @ B.t()).mul_(scale)
+        grad_x = grad_A = grad_B = None
+
+        if ctx.needs_input_grad[3]:
+            xd = x2 * mask / (1.0 - p) if mask is not None else x2
+            grad_A = xd.t() @ grad_h
+        if ctx.needs_input_grad[4]:
+            grad_B = (h.t() @ g).mul_(scale)
+        if ctx.needs_input_grad[0]:
+            grad_low = grad_h @ A.t()
+            if mask is not None:
+                grad_low = grad_low * mask / (1.0 - p)
+            grad_x = torch.addmm(grad_low, g, weight).reshape(ctx.shape)
+
+        return grad_x, None, None, grad_A, grad_B, None, None
+
 class LoRALinear(nn.Module):
     def __init__(self, base: nn.Linear, rank: int, alpha: float, dropout: float):
         super().__init__()
@@ -18,6 +73,8 @@ class LoRALinear(nn.Module):
         self.scale = alpha / rank
         self.lora_scale = 1.0
         self.dropout = dropout
+        self.merged = False
+        self._base_backup: torch.Tensor | None = None
 
         device = base.weight.device
         dtype = base.weight.dtype
@@ -26,10 +83,42 @@ class LoRALinear(nn.Module):
         self.B = nn.Parameter(torch.zeros(rank, base.out_features, device=device, dtype=dtype))
 
     def forward(self, x, *args, **kwargs):
-        delta = self.scale * ((x @ self.A) @ self.B)
+        if self.merged or self.lora_scale == 0.0:
+            return self.base(x, *args, **kwargs)
+        if args or kwargs:
+            return self.forward_unfused(x, *args, **kwargs)
+
+        p = self.dropout if self.training else 0.0
+        return _LoRALinearFn.apply(x, self.base.weight, self.base.bias, self.A, self.B, self.scale * self.lora_scale, p)
+
+    @torch.no_grad()
+    def merge(self) -> None:
+        """Folds scale * lora_scale * (A @ B).T into base.weight; the original weight is kept on CPU."""
+        if self.merged or self.lora_scale == 0.0:
+            return
+        w = self.base.weight
+        self._base_backup = w.detach().to("cpu", copy=True)
+        delta = (self.A.float() @ self.B.float()).t() * (self.scale * self.lora_scale)
+        w.add_(delta.to(w.dtype))
+        self.merged = True
+
+    @torch.no_grad()
+    def unmerge(self) -> None:
+        """Restores base.weight bit-exactly from the saved copy."""
+        if not self.merged:
+            return
+        self.base.weight.copy_(self._base_backup)
+        self._base_backup = None
+        self.merged = False
+
+    def forward_unfused(self, x, *args, **kwargs):
+        # Same math with plain autograd, for bases called with extra arguments.
         if self.training and self.dropout > 0:
-            delta = F.dropout(delta, p=self.dropout)
-        return self.base(x, *args, **kwargs) + self.lora_scale * delta
+            x_low = F.dropout(x, p=self.dropout)
+        else:
+            x_low = x
+        delta = (x_low @ self.A) @ self.B
+        return self.base(x, *args, **kwargs) + (self.scale * self.lora_scale) * delta
 
 def lora_parameters(module: nn.Module):
     for m in module.modules():
@@ -62,73 +151,100 @@ def inject_lora(
 
     return replaced, params
 
+def remove_lora(module: nn.Module) -> int:
+    """Undoes inject_lora: every LoRALinear is unmerged and replaced by its original nn.Linear."""
+    removed = 0
+    modules = dict(module.named_modules())
+    for name, mod in modules.items():
+        if isinstance(mod, LoRALinear):
+            mod.unmerge()
+            parent_name, _, child = name.rpartition(".")
+            setattr(modules[parent_name] if parent_name else module, child, mod.base)
+            removed += 1
+    return removed
+
 def set_lora_scale(module: nn.Module, scale: float) -> None:
     for m in module.modules():
         if isinstance(m, LoRALinear):
             m.lora_scale = float(scale)
 
-def save_lora(
-    *,
-    unet: nn.Module,
-    text_encoder: nn.Module | None,
-    path: str,
-    metadata: dict | None = None,
-):
-    tensors: dict[str, torch.Tensor] = {}
+def set_lora_training(module: nn.Module, mode: bool) -> None:
+    """Toggles LoRA dropout without touching the frozen base modules (which stay in eval)."""
+    for m in module.modules():
+        if isinstance(m, LoRALinear):
+            m.train(mode)
 
-    for name, m in unet.named_modules():
-        if not isinstance(m, LoRALinear):
-            continue
-        key = "lora_unet_" + name.replace(".", "_")
-        tensors[f"{key}.lora_down.weight"] = m.A.T.detach().float().contiguous().cpu()
-        tensors[f"{key}.lora_up.weight"] = m.B.T.detach().float().contiguous().cpu()
-        tensors[f"{key}.alpha"] = torch.tensor(m.alpha)
+def merge_lora(module: nn.Module) -> int:
+    merged = 0
+    for m in module.modules():
+        if isinstance(m, LoRALinear) and not m.merged and m.lora_scale != 0.0:
+            m.merge()
+            merged += 1
+    return merged
 
-    if text_encoder is not None:
-        for name, m in text_encoder.named_modules():
-            if not isinstance(m, LoRALinear):
-                continue
-            key = "lora_te_" + name.replace(".", "_")
-            tensors[f"{key}.lora_down.weight"] = m.A.T.detach().float().contiguous().cpu()
-            tensors[f"{key}.lora_up.weight"] = m.B.T.detach().float().contiguous().cpu()
-            tensors[f"{key}.alpha"] = torch.tensor(m.alpha)
+def unmerge_lora(module: nn.Module) -> None:
+    for m in module.modules():
+        if isinstance(m, LoRALinear):
+            m.unmerge()
+
+@contextmanager
+def merged_lora(module: nn.Module):
+    """Runs the block with LoRA folded into the base weights, e.g. for preview sampling."""
+    merge_lora(module)
+    try:
+        yield module
+    finally:
+        unmerge_lora(module)
+
+@torch.no_grad()
+def merge_lora_weights(module: nn.Module, tensors: dict[str, torch.Tensor], prefix: str) -> int:
+    """Folds a saved LoRA (lora_down/lora_up/alpha keys) straight into the matching nn.Linear weights."""
+    merged = 0
+    for name, m in module.named_modules():
+        if not isinstance(m, nn.Linear):
+            continue
+        key = prefix + name.replace(".", "_")
+        down = tensors.get(f"{key}.lora_down.weight")
+        if down is None:
+            continue
+        up = tensors[f"{key}.lora_up.weight"]
+        scale = float(tensors[f"{key}.alpha"]) / down.shape[0]
+        delta = (up.float() @ down.float()) * scale
+        m.weight.add_(delta.to(device=m.weight.device, dtype=m.weight.dtype))
+        merged += 1
+    return merged
+
+def lora_parts(unet: nn.Module, text_encoders: list[nn.Module | None]) -> list[tuple[str, nn.Module]]:
+    """
+    (key prefix, module) pairs in kohya naming: a single text encoder is lora_te_,
+    several are lora_te1_, lora_te2_, ... Encoders passed as None (not trained) are skipped.
+    """
+    parts = [("lora_unet_", unet)]
+    for i, te in enumerate(text_encoders):
+        if te is None:
+            continue
+        prefix = "lora_te_" if len(text_encoders) == 1 else f"lora_te{i + 1}_"
+        parts.append((prefix, te))
+    return parts
 
-    save_file(tensors, path, metadata=metadata or {})
+def iter_lora_layers(parts: list[tuple[str, nn.Module]]):
+    for prefix, module in parts:
+        for name, m in module.named_modules():
+            if isinstance(m, LoRALinear):
+                yield prefix + name.replace(".", "_"), m
 
-def save_lora_sdxl(
+def save_lora(
     *,
     unet: nn.Module,
-    text_encoder: nn.Module | None,
-    text_encoder_2: nn.Module | None,
+    text_encoders: list[nn.Module | None],
     path: str,
     metadata: dict | None = None,
 ):
     tensors: dict[str, torch.Tensor] = {}
 
-    for name, m in unet.named_modules():
-        if not isinstance(m, LoRALinear):
-            continue
-        key = "lora_unet_" + name.replace(".", "_")
+    for key, m in iter_lora_layers(lora_parts(unet, text_encoders)):
         tensors[f"{key}.lora_down.weight"] = m.A.T.detach().float().contiguous().cpu()
         tensors[f"{key}.lora_up.weight"] = m.B.T.detach().float().contiguous().cpu()
         tensors[f"{key}.alpha"] = torch.tensor(m.alpha)
 
-    if text_encoder is not None:
-        for name, m in text_encoder.named_modules():
-            if not isinstance(m, LoRALinear):
-                continue
-            key = "lora_te1_" + name.replace(".", "_")
-            tensors[f"{key}.lora_down.weight"] = m.A.T.detach().float().contiguous().cpu()
-            tensors[f"{key}.lora_up.weight"] = m.B.T.detach().float().contiguous().cpu()
-            tensors[f"{key}.alpha"] = torch.tensor(m.alpha)
-
-    if text_encoder_2 is not None:
-        for name, m in text_encoder_2.named_modules():
-            if not isinstance(m, LoRALinear):
-                continue
-            key = "lora_te2_" + name.replace(".", "_")
-            tensors[f"{key}.lora_down.weight"] = m.A.T.detach().float().contiguous().cpu()
-            tensors[f"{key}.lora_up.weight"] = m.B.T.detach().float().contiguous().cpu()
-            tensors[f"{key}.alpha"] = torch.tensor(m.alpha)
-
     save_file(tensors, path, metadata=metadata or {})
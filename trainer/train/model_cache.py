@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+from safetensors.torch import save_file
+
+from .config import log
+from .safetensors_io import stream_component
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+MODEL_CACHE_DIR = REPO_ROOT / "models" / ".converted"
+
+# Entries used this recently may still be streaming into another run and are never evicted.
+EVICT_GRACE_SECONDS = 3600
+
+def _write_json_atomic(path: Path, data: dict) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.iterdir() if p.is_file())
+
+class ModelCache:
+    """
+    Single-file checkpoints converted to per-component diffusers-layout safetensors, already
+    cast to the training dtype, under models/.converted/<sha256[:16]>_<dtype>/.
+
+    The first run on a checkpoint fills an entry while it loads; later runs stream each
+    component straight from the entry, with no key splitting, conversion or casting.
+    Entries are evicted least-recently-used first once the cache exceeds budget_gb, except
+    those used within EVICT_GRACE_SECONDS, which another process may be reading.
+    """
+
+    def __init__(self, budget_gb: float, root: Path = MODEL_CACHE_DIR):
+        self.budget = int(budget_gb * 2**30)
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def checkpoint_hash(self, ckpt_path: Path) -> str:
+        """sha256 of the file, remembered per (path, size, mtime) so it is computed once."""
+        index_path = self.root / "hashes.json"
+        index = json.loads(index_path.read_text(encoding="utf-8")) if index_path.is_file() else {}
+        st = ckpt_path.stat()
+        key = str(ckpt_path.resolve())
+        known = index.get(key)
+        if known and known["size"] == st.st_size and known["mtime_ns"] == st.st_mtime_ns:
+            return known["sha256"]
+
+        log(f"STATUS hashing {ckpt_path.name} for the model cache")
+        h = hashlib.sha256()
+        with open(ckpt_path, "rb") as f:
+            while chunk := f.read(16 * 2**20):
+                h.update(chunk)
+        index[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+        _write_json_atomic(index_path, index)
+        return index[key]["sha256"]
+
+    def entry_dir(self, ckpt_path: Path, dtype: torch.dtype) -> Path:
+        dtype_name = str(dtype).removeprefix("torch.")
+        return self.root / f"{self.checkpoint_hash(ckpt_path)[:16]}_{dtype_name}"
+
+    def lookup(self, entry: Path, components: list[str]) -> bool:
+        meta_path = entry / "meta.json"
+        if not meta_path.is_file():
+            return False
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("components") != components:
+                return False
+            meta["last_used"] = time.time()
+            _write_json_atomic(meta_path, meta)
+        except (OSError, ValueError):
+            # Evicted or rewritten by another process meanwhile.
+            return False
+        log(f"STATUS model cache hit: {entry.name}")
+        return True
+
+    @contextmanager
+    def fill(self, entry: Path, ckpt_path: Path):
+        """
+        Yields add(name, module); each component is written as it is loaded, before it moves
+        to the device. The entry only appears (by rename) once every component is written.
+        """
+        staging = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        names = []
+
+        def add(name: str, module: nn.Module) -> None:
+            state = module.state_dict()
+            unloaded = [k for k, v in state.items() if v.is_meta]
+            if unloaded:
+                raise RuntimeError(
+                    f"{name}: {len(unloaded)} tensors still on the meta device after loading "
+                    f"(e.g. {', '.join(unloaded[:3])}); not caching an incomplete entry"
+                )
+            tensors = {k: v.detach().contiguous() for k, v in state.items()}
+            save_file(tensors, str(staging / f"{name}.safetensors"))
+            names.append(name)
+
+        try:
+            yield add
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        now = time.time()
+        _write_json_atomic(staging / "meta.json", {
+            "source": str(ckpt_path.resolve()),
+            "components": names,
+            "created": now,
+            "last_used": now,
+        })
+        try:
+            os.replace(staging, entry)
+        except OSError:
+            # Another run filled the same entry first.
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        log(f"STATUS model cache filled: {entry.name} ({_dir_size(entry) / 2**30:.1f} GB)")
+        self.evict(keep=entry)
+
+    def evict(self, keep: Path | None = None) -> None:
+        entries = []
+        for d in self.root.iterdir():
+            meta_path = d / "meta.json"
+            # Staging dirs of in-progress fills carry meta.json just before their rename.
+            if d.is_dir() and not d.name.endswith(".tmp") and meta_path.is_file():
+                try:
+                    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+                    entries.append((meta.get("last_used", 0.0), d, _dir_size(d)))
+                except (OSError, ValueError):
+                    continue
+
+        total = sum(size for _, _, size in entries)
+        in_use = time.time() - EVICT_GRACE_SECONDS
+        for last_used, d, size in sorted(entries, key=lambda e: e[0]):
+            if total <= self.budget:
+                break
+            if d == keep or last_used > in_use:
+                continue
+            shutil.rmtree(d, ignore_errors=True)
+            total -= size
+            log(f"STATUS model cache evicted: {d.name} ({size / 2**30:.1f} GB)")
+
+        # Over budget only because of entries in use is left to a later eviction.
+        if keep is not None and total > self.budget and _dir_size(keep) > self.budget:
+            shutil.rmtree(keep, ignore_errors=True)
+            log(f"WARN model cache: {keep.name} alone exceeds the {self.budget / 2**30:.0f} GB budget, not kept")
+
+def open_model_cache(budget_gb: float) -> ModelCache | None:
+    return ModelCache(budget_gb) if budget_gb > 0 else None
+
+def materialize_components(
+    components: dict[str, nn.Module],
+    ckpt_path: Path,
+    device,
+    dtype,
+    load,
+    cache: ModelCache | None = None,
+) -> None:
+    """
+    Fills modules built under empty_modules() and moves each to the device before the next.
+    Reads the cache entry when there is one, otherwise load(name, module) streams from the
+    checkpoint and the result is written to the cache.
+    """
+    entry = cache.entry_dir(ckpt_path, dtype) if cache is not None else None
+    if entry is not None and cache.lookup(entry, list(components)):
+        for name, module in components.items():
+            stream_component(module, entry / f"{name}.safetensors", "", dtype, name=name)
+            module.to(device=device, dtype=dtype)
+        return
+
+    with cache.fill(entry, ckpt_path) if entry is not None else nullcontext() as add:
+        for name, module in components.items():
+            load(name, module)
+            if add is not None:
+                add(name, module)
+            module.to(device=device, dtype=dtype)
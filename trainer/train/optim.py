@@ -31,8 +31,7 @@ def build_optimizer(param_groups, cfg: TrainConfig):
     log(f"STATUS optimizer_param_group_lrs={lrs}")
     return opt
 
-def build_scheduler(cfg: TrainConfig, optimizer, dataset_len: int):
-    steps_per_epoch = (dataset_len + cfg.batch_size - 1) // cfg.batch_size
+def build_scheduler(cfg: TrainConfig, optimizer, steps_per_epoch: int):
     updates_per_epoch = (steps_per_epoch + cfg.grad_accum_steps - 1) // cfg.grad_accum_steps
     num_training_steps = updates_per_epoch * cfg.epochs
 
@@ -0,0 +1,168 @@
+import csv
+import json
+import statistics
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .config import TrainConfig, log
+
+SECTIONS = ("data", "text", "vae", "unet", "backward", "optimizer", "checkpoint")
+
+class StepProfiler:
+    """
+    Per-step wall time of each hot-path section plus peak memory.
+
+    Disabled profilers cost a no-op context manager per section. When enabled, CUDA is
+    synchronized at section edges so GPU work is charged to the section that queued it;
+    that serialization is the price of attributing time, so keep it off for production runs.
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        log_every: int = 0,
+        trace_start: int = 0,
+        trace_steps: int = 0,
+        output_prefix: Path | None = None,
+    ):
+        self.enabled = enabled
+        self.log_every = log_every
+        self.trace_start = trace_start
+        self.trace_steps = trace_steps
+        self.output_prefix = output_prefix
+        self.cuda = torch.cuda.is_available()
+        self.current: dict[str, float] = {}
+        self.rows: list[dict] = []
+        self.events: list[dict] = []
+        self.step_start = time.perf_counter()
+        self.trace = None
+
+    def start(self) -> None:
+        """Marks the beginning of the first step, so setup time is not charged to it."""
+        self.current = {}
+        self.step_start = time.perf_counter()
+
+    @contextmanager
+    def section(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        self._sync()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._sync()
+            self.current[name] = self.current.get(name, 0.0) + time.perf_counter() - start
+
+    def step_end(self, step: int, **fields) -> None:
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        row = {"step": step, **{k: self.current.get(k, 0.0) for k in SECTIONS}, "total": now - self.step_start}
+        row["peak_mem_mb"] = self._peak_mem_mb()
+        row.update(fields)
+        self.rows.append(row)
+        self.current = {}
+        self.step_start = now
+
+        if self.log_every > 0 and step % self.log_every == 0:
+            log("PERF " + " ".join(f"{k}={_fmt(v)}" for k, v in row.items()))
+        self._advance_trace(step)
+
+    def flush_event(self, name: str, **fields) -> None:
+        """Time spent outside steps (e.g. epoch end) is reported on its own, not charged to a step."""
+        if not self.enabled or not self.current:
+            return
+        event = {"event": name, **self.current, **fields}
+        self.events.append(event)
+        self.current = {}
+        self.step_start = time.perf_counter()
+        log("PERF " + " ".join(f"{k}={_fmt(v)}" for k, v in event.items()))
+
+    def close(self) -> None:
+        if not self.enabled:
+            return
+        if self.trace is not None:
+            self._stop_trace()
+        if self.output_prefix is None or not self.rows:
+            return
+
+        summary = {"steps": len(self.rows), "sections": {}, "events": self.events}
+        for key in (*SECTIONS, "total"):
+            values = sorted(r[key] for r in self.rows)
+            summary["sections"][key] = {
+                "total": sum(values),
+                "mean": statistics.fmean(values),
+                "p50": values[len(values) // 2],
+                "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+            }
+        summary["peak_mem_mb"] = max(r["peak_mem_mb"] for r in self.rows)
+
+        json_path = self.output_prefix.with_name(self.output_prefix.name + "_perf.json")
+        json_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+        csv_path = self.output_prefix.with_name(self.output_prefix.name + "_perf.csv")
+        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(self.rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(self.rows)
+        log(f"STATUS perf summary: {json_path.name} {csv_path.name}")
+
+    def _sync(self) -> None:
+        if self.cuda:
+            torch.cuda.synchronize()
+
+    def _peak_mem_mb(self) -> float:
+        if self.cuda:
+            peak = torch.cuda.max_memory_allocated() / 2**20
+            torch.cuda.reset_peak_memory_stats()
+            return peak
+        # ru_maxrss is KiB on Linux and cannot be reset, so on CPU this is the run's high-water mark.
+        if resource is None:
+            return 0.0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def _advance_trace(self, step: int) -> None:
+        if self.trace_steps <= 0:
+            return
+        if self.trace is None and step == self.trace_start:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.trace = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+            self.trace.__enter__()
+            log(f"STATUS torch.profiler trace started step={step} steps={self.trace_steps}")
+        elif self.trace is not None and step >= self.trace_start + self.trace_steps:
+            self._stop_trace()
+
+    def _stop_trace(self) -> None:
+        self.trace.__exit__(None, None, None)
+        if self.output_prefix is not None:
+            path = self.output_prefix.with_name(self.output_prefix.name + "_trace.json")
+            self.trace.export_chrome_trace(str(path))
+            log(f"STATUS torch.profiler trace written: {path.name}")
+        self.trace = None
+        self.trace_steps = 0
+
+def _fmt(v) -> str:
+    return f"{v:.4f}" if isinstance(v, float) else str(v)
+
+def build_step_profiler(cfg: TrainConfig, output_prefix: Path) -> StepProfiler:
+    enabled = cfg.perf_log_every > 0 or cfg.perf_trace_steps > 0
+    return StepProfiler(
+        enabled=enabled,
+        log_every=cfg.perf_log_every,
+        trace_start=max(cfg.perf_trace_start, 1),
+        trace_steps=cfg.perf_trace_steps,
+        output_prefix=output_prefix if enabled else None,
+    )
@@ -0,0 +1,157 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import torch
+
+from .config import log
+from .events import emit
+
+PREVIEW_WORKER = Path(__file__).resolve().parents[1] / "preview_worker.py"
+MANIFEST_NAME = "manifest.json"
+
+def resolve_preview_mode(mode: str, device: torch.device) -> str:
+    """auto renders in a worker on a spare GPU when there is one, otherwise inline after each epoch."""
+    if mode != "auto":
+        return mode
+    if device.type == "cuda" and torch.cuda.device_count() > 1:
+        return "async"
+    return "inline"
+
+def write_json_atomic(path: Path, data: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+@dataclass
+class PreviewJob:
+    epoch: int
+    lora_path: Path
+    preview_dir: Path
+    status: str = "queued"
+    proc: subprocess.Popen | None = None
+
+class PreviewScheduler:
+    """
+    Renders epoch previews in a separate worker process that loads the saved LoRA file.
+
+    async: the worker starts as soon as the snapshot is written (spare GPU, or lowered priority).
+    deferred: jobs are queued and rendered one after another once training is done.
+    The index at index_path lists every job and its status for the UI to poll; each worker
+    writes its own manifest.json (images, errors) inside the job's preview_dir.
+    """
+
+    def __init__(self, *, mode: str, worker_argv: list[str], index_path: Path, nice: int = 10, visible_device: str | None = None):
+        self.mode = mode
+        self.worker_argv = worker_argv
+        self.index_path = index_path
+        self.nice = nice
+        self.visible_device = visible_device
+        self.jobs: list[PreviewJob] = []
+
+    def submit(self, epoch: int, lora_path: Path, preview_dir: Path) -> None:
+        job = PreviewJob(epoch=epoch, lora_path=lora_path, preview_dir=preview_dir)
+        self.jobs.append(job)
+        write_json_atomic(preview_dir / MANIFEST_NAME, {"epoch": epoch, "lora": str(lora_path), "status": "queued"})
+
+        if self.mode == "async":
+            self._start(job)
+        else:
+            log(f"STATUS preview queued epoch={epoch} (rendered after training)")
+        self._write_index()
+
+    def poll(self) -> None:
+        changed = False
+        for job in self.jobs:
+            if job.status != "running" or job.proc.poll() is None:
+                continue
+            job.status = "done" if job.proc.returncode == 0 else "failed"
+            job.proc = None
+            log(f"STATUS preview {job.status} epoch={job.epoch}")
+            emit("preview", epoch=job.epoch, status=job.status, dir=str(job.preview_dir))
+            changed = True
+        if changed:
+            self._write_index()
+
+    def pending(self) -> bool:
+        return any(job.status in ("queued", "running") for job in self.jobs)
+
+    def finish(self) -> None:
+        """Waits for running workers, then renders deferred jobs one at a time."""
+        for job in self.jobs:
+            if job.status == "queued":
+                self._start(job)
+            if job.proc is not None:
+                job.proc.wait()
+                self.poll()
+
+    def _start(self, job: PreviewJob) -> None:
+        cmd = [
+            sys.executable, str(PREVIEW_WORKER), *self.worker_argv,
+            "--preview_lora", str(job.lora_path),
+            "--preview_dir", str(job.preview_dir),
+            "--preview_epoch", str(job.epoch),
+        ]
+        env = dict(os.environ)
+        if self.visible_device is not None:
+            env["CUDA_VISIBLE_DEVICES"] = self.visible_device
+
+        kwargs = {}
+        if self.nice > 0:
+            if os.name == "nt":
+                kwargs["creationflags"] = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+            else:
+                kwargs["preexec_fn"] = lambda: os.nice(self.nice)
+
+        # Worker output goes to its own log so it does not interleave with the trainer's STATUS lines.
+        log(f"STATUS preview started epoch={job.epoch} mode={self.mode}")
+        job.preview_dir.mkdir(parents=True, exist_ok=True)
+        with open(job.preview_dir / "worker.log", "wb") as out:
+            job.proc = subprocess.Popen(cmd, env=env, stdout=out, stderr=subprocess.STDOUT, **kwargs)
+        job.status = "running"
+        self._write_index()
+
+    def _write_index(self) -> None:
+        write_json_atomic(self.index_path, {
+            "updated": time.time(),
+            "mode": self.mode,
+            "previews": [
+                {
+                    "epoch": job.epoch,
+                    "lora": str(job.lora_path),
+                    "dir": str(job.preview_dir),
+                    "status": job.status,
+                }
+                for job in self.jobs
+            ],
+        })
+
+def build_preview_scheduler(cfg, device: torch.device, index_path: Path) -> PreviewScheduler | None:
+    """None means previews render inline on the training process (the old blocking behaviour)."""
+    mode = resolve_preview_mode(cfg.preview_mode, device)
+    log(f"STATUS preview_mode={mode}")
+    if mode == "deferred":
+        log("STATUS previews deferred: epoch previews render in a worker after training ends")
+    if mode == "inline":
+        return None
+
+    # Re-run the worker with the trainer's own arguments so it builds an identical TrainConfig.
+    worker_argv = sys.argv[1:] + ["--resolution", str(cfg.resolution)]
+    # Training uses the first visible GPU; an async worker gets the last one to itself.
+    visible_device = None
+    if mode == "async" and device.type == "cuda" and torch.cuda.device_count() > 1:
+        visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+        ids = [d.strip() for d in visible.split(",") if d.strip()] if visible else []
+        visible_device = ids[-1] if ids else str(torch.cuda.device_count() - 1)
+    return PreviewScheduler(
+        mode=mode,
+        worker_argv=worker_argv,
+        index_path=index_path,
+        nice=cfg.preview_nice,
+        visible_device=visible_device,
+    )
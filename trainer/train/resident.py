@@ -0,0 +1,91 @@
+import gc
+from collections import OrderedDict
+
+import torch
+import torch.nn as nn
+
+from .config import log
+from .lora import remove_lora
+
+class ResidentModels:
+    """
+    Base models kept loaded between jobs by the trainer worker (trainer/train_worker.py),
+    keyed by (model_type, base_model, dtype, device). Least recently used sets beyond
+    max_models are dropped before a new one loads, so two never share VRAM.
+
+    Jobs mutate what they get (LoRA injection, requires_grad, gradient checkpointing,
+    xformers, offloading, release_models); reset() undoes that after every job.
+    """
+
+    def __init__(self, max_models: int = 1):
+        self.max_models = max(max_models, 1)
+        self.models: OrderedDict[tuple, tuple] = OrderedDict()
+
+    def get(self, key: tuple, load) -> tuple:
+        if key in self.models:
+            self.models.move_to_end(key)
+            log(f"STATUS resident models reused: {key[0]} {key[1]}")
+            return self.models[key]
+
+        while len(self.models) >= self.max_models:
+            old, _ = self.models.popitem(last=False)
+            log(f"STATUS resident models dropped: {old[0]} {old[1]}")
+            _free_memory()
+
+        models = load()
+        self.models[key] = models
+        return models
+
+    def reset(self) -> None:
+        for key, models in list(self.models.items()):
+            try:
+                for m in models:
+                    if isinstance(m, nn.Module):
+                        _reset_module(m, key[3])
+            except Exception as e:
+                # A set that cannot be restored is reloaded by the next job instead.
+                log(f"WARN resident models reset failed ({e}), dropping {key[0]} {key[1]}")
+                del self.models[key]
+        _free_memory()
+
+def _reset_module(m: nn.Module, device: str) -> None:
+    remove_lora(m)
+    m.requires_grad_(False)
+    m.eval()
+    if getattr(m, "is_gradient_checkpointing", False):
+        m.disable_gradient_checkpointing()
+    if hasattr(m, "disable_xformers_memory_efficient_attention"):
+        m.disable_xformers_memory_efficient_attention()
+    m.to(device)
+
+def _free_memory() -> None:
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+_resident: ResidentModels | None = None
+
+def enable_resident_models(max_models: int) -> None:
+    global _resident
+    _resident = ResidentModels(max_models)
+
+def load_models(key: tuple, load) -> tuple:
+    """load() as is in a one-shot trainer process; in the trainer worker, reused across jobs."""
+    if _resident is None:
+        return load()
+    return _resident.get(key, load)
+
+def release_models(*modules) -> None:
+    """
+    For models a job no longer needs. In a one-shot run dropping the last reference frees them;
+    resident ones are still held here, so they move to the CPU until reset_resident_models().
+    """
+    if _resident is None:
+        return
+    for m in modules:
+        if isinstance(m, nn.Module):
+            m.to("cpu")
+
+def reset_resident_models() -> None:
+    if _resident is not None:
+        _resident.reset()
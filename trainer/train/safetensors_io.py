@@ -0,0 +1,100 @@
+import json
+import struct
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+import torch
+import torch.nn as nn
+from accelerate import init_empty_weights
+from accelerate.utils import set_module_tensor_to_device
+from safetensors import safe_open
+
+from .config import log
+
+def read_safetensors_keys(path: Path) -> list[str]:
+    """
+    Tensor names of a .safetensors file from its JSON header alone (8-byte little-endian
+    length, then the header), so format detection never touches the tensor data.
+    """
+    with open(path, "rb") as f:
+        (n,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(n))
+    return [k for k in header if k != "__metadata__"]
+
+@contextmanager
+def empty_modules():
+    """Parameters created inside are on the meta device; buffers stay real (position ids etc.)."""
+    with init_empty_weights(include_buffers=False):
+        yield
+
+def stream_component(
+    module: nn.Module,
+    ckpt_path: Path,
+    prefix: str,
+    dtype,
+    *,
+    convert: Callable[[dict], dict] | None = None,
+    name: str = "",
+) -> None:
+    """
+    Materializes a module built under empty_modules() from the keys under prefix.
+
+    Without convert, tensors are read one at a time via safe_open (mmap) and placed by key
+    after stripping the prefix. With convert (LDM -> diffusers key mapping), only this
+    component's tensors are read, with their full keys, so host RAM peaks near one component.
+    Every parameter must be covered: there is no reference model to fall back to.
+    """
+    expected = set(module.state_dict().keys())
+    unexpected = []
+
+    with safe_open(str(ckpt_path), framework="pt", device="cpu") as f:
+        keys = [k for k in f.keys() if k.startswith(prefix)]
+        if convert is None:
+            items = ((k[len(prefix):], lambda k=k: f.get_tensor(k)) for k in keys)
+        else:
+            converted = convert({k: f.get_tensor(k) for k in keys})
+            items = ((k, lambda k=k: converted.pop(k)) for k in list(converted))
+
+        for key, get in items:
+            if key not in expected:
+                unexpected.append(key)
+                continue
+            set_module_tensor_to_device(module, key, "cpu", value=get(), dtype=dtype)
+            expected.discard(key)
+
+    missing = sorted(k for k in expected if _is_meta(module, k))
+    if missing:
+        raise RuntimeError(
+            f"{name or type(module).__name__}: {len(missing)} weights missing from {ckpt_path.name} "
+            f"under '{prefix}' (first: {missing[:5]})"
+        )
+    if unexpected:
+        log(f"WARN {name or type(module).__name__}: ignored {len(unexpected)} unexpected keys (first: {unexpected[:3]})")
+
+def _is_meta(module: nn.Module, key: str) -> bool:
+    owner, _, attr = key.rpartition(".")
+    t = getattr(module.get_submodule(owner) if owner else module, attr, None)
+    return isinstance(t, torch.Tensor) and t.is_meta
+
+def ldm_converters():
+    """
+    diffusers' single-file LDM -> diffusers key converters (diffusers>=0.27).
+    Returned as (unet, vae, clip, open_clip) callables taking (state_dict, module).
+    """
+    try:
+        from diffusers.loaders.single_file_utils import (
+            convert_ldm_clip_checkpoint,
+            convert_ldm_unet_checkpoint,
+            convert_ldm_vae_checkpoint,
+            convert_open_clip_checkpoint,
+        )
+    except ImportError as e:
+        raise RuntimeError("Loading merged .safetensors checkpoints needs diffusers>=0.27") from e
+
+    return (
+        lambda sd, m: convert_ldm_unet_checkpoint(sd, m.config),
+        lambda sd, m: convert_ldm_vae_checkpoint(sd, m.config),
+        lambda sd, m: convert_ldm_clip_checkpoint(sd),
+        lambda sd, m, prefix: convert_open_clip_checkpoint(m, sd, prefix=prefix),
+    )
@@ -2,7 +2,6 @@ from pathlib import Path
 import torch
 from PIL import Image
 from diffusers import UNet2DConditionModel, AutoencoderKL, DDPMScheduler
-from transformers import CLIPTokenizer, CLIPTextModel
 
 @torch.no_grad()
 def decode_latents_to_pil(vae: AutoencoderKL, latents: torch.Tensor):
@@ -20,77 +19,55 @@ def run_inference_preview_in_memory(
     *,
     unet: UNet2DConditionModel,
     vae: AutoencoderKL,
-    text_encoder: CLIPTextModel,
-    tokenizer: CLIPTokenizer,
     scheduler: DDPMScheduler,
     output_dir: Path,
-    prompt: str,
+    prompt_embeds: torch.Tensor,
+    negative_prompt_embeds: torch.Tensor,
     steps: int,
     num_images: int,
     seed: int,
     device: torch.device,
     dtype: torch.dtype,
-    clip_skip: int,
     guidance_scale: float = 7.5,
 ):
     output_dir.mkdir(parents=True, exist_ok=True)
 
     unet.eval()
     vae.eval()
-    text_encoder.eval()
 
     scheduler.set_timesteps(steps, device=device)
 
-    text_in = tokenizer(
-        [prompt],
-        padding="max_length",
-        truncation=True,
-        max_length=77,
-        return_tensors="pt",
-    ).input_ids.to(device)
-
-    uncond_in = tokenizer(
-        [""],
-        padding="max_length",
-        truncation=True,
-        max_length=77,
-        return_tensors="pt",
-    ).input_ids.to(device)
-
-    if clip_skip > 0:
-        cond_out = text_encoder(text_in, output_hidden_states=True)
-        uncond_out = text_encoder(uncond_in, output_hidden_states=True)
-        idx = -(clip_skip + 1)
-        cond = cond_out.hidden_states[idx]
-        uncond = uncond_out.hidden_states[idx]
-    else:
-        cond = text_encoder(text_in)[0]
-        uncond = text_encoder(uncond_in)[0]
+    cond = prompt_embeds.to(device=device, dtype=dtype)
+    uncond = negative_prompt_embeds.to(device=device, dtype=dtype)
 
     h = w = 512
     latent_h = h // 8
     latent_w = w // 8
 
-    for i in range(num_images):
-        gen = torch.Generator(device=device).manual_seed(seed + i)
-
-        latents = torch.randn(
+    # One generator per seed keeps each image identical to sampling it alone.
+    latents = torch.cat([
+        torch.randn(
             (1, 4, latent_h, latent_w),
-            generator=gen,
+            generator=torch.Generator(device=device).manual_seed(seed + i),
             device=device,
             dtype=dtype,
         )
+        for i in range(num_images)
+    ])
+
+    # Uncond and cond rows for every seed go through the UNet in a single call.
+    embeds = torch.cat([uncond.expand(num_images, -1, -1), cond.expand(num_images, -1, -1)])
 
-        for t in scheduler.timesteps:
-            latent_in = latents
-            if hasattr(scheduler, "scale_model_input"):
-                latent_in = scheduler.scale_model_input(latent_in, t)
+    for t in scheduler.timesteps:
+        latent_in = torch.cat([latents, latents])
+        if hasattr(scheduler, "scale_model_input"):
+            latent_in = scheduler.scale_model_input(latent_in, t)
 
-            noise_uncond = unet(latent_in, t, encoder_hidden_states=uncond).sample
-            noise_text = unet(latent_in, t, encoder_hidden_states=cond).sample
-            noise = noise_uncond + guidance_scale * (noise_text - noise_uncond)
+        noise_uncond, noise_text = unet(latent_in, t, encoder_hidden_states=embeds).sample.chunk(2)
+        noise = noise_uncond + guidance_scale * (noise_text - noise_uncond)
 
-            latents = scheduler.step(noise, t, latents).prev_sample
+        latents = scheduler.step(noise, t, latents).prev_sample
 
-        imgs = decode_latents_to_pil(vae, latents)
-        imgs[0].save(output_dir / f"img_{i}.png")
+    imgs = decode_latents_to_pil(vae, latents)
+    for i, img in enumerate(imgs):
+        img.save(output_dir / f"img_{i}.png")
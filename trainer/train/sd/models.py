@@ -1,11 +1,12 @@
 import torch
 from pathlib import Path
-from safetensors.torch import load_file
 
 from diffusers import UNet2DConditionModel, AutoencoderKL, DDPMScheduler
-from transformers import CLIPTokenizer, CLIPTextModel
+from transformers import CLIPTokenizer, CLIPTextModel, CLIPTextConfig
 
 from ..config import TrainConfig, log
+from ..model_cache import ModelCache, materialize_components, open_model_cache
+from ..safetensors_io import empty_modules, ldm_converters, stream_component
 
 REPO_ROOT = Path(__file__).resolve().parents[3]
 MODELS_DIR = REPO_ROOT / "models"
@@ -33,33 +34,29 @@ def _load_sd_models_diffusers(base: str, device, dtype):
     sched = DDPMScheduler.from_pretrained(base, subfolder="scheduler")
     return tok, te, vae, unet, sched
 
-def _load_sd_models_safetensors(ckpt_path: Path, device, dtype):
+def _load_sd_models_safetensors(ckpt_path: Path, device, dtype, cache: ModelCache | None = None):
     log("STATUS loading merged SD checkpoint (.safetensors)")
 
+    # Only configs and tokenizer come from the reference repo; weights stream from the checkpoint.
     tok = CLIPTokenizer.from_pretrained(SD15_REF, subfolder="tokenizer")
-    te = CLIPTextModel.from_pretrained(SD15_REF, subfolder="text_encoder", torch_dtype=dtype)
-    vae = AutoencoderKL.from_pretrained(SD15_REF, subfolder="vae", torch_dtype=dtype)
-    unet = UNet2DConditionModel.from_pretrained(SD15_REF, subfolder="unet", torch_dtype=dtype)
     sched = DDPMScheduler.from_pretrained(SD15_REF, subfolder="scheduler")
+    with empty_modules():
+        te = CLIPTextModel(CLIPTextConfig.from_pretrained(SD15_REF, subfolder="text_encoder"))
+        vae = AutoencoderKL.from_config(AutoencoderKL.load_config(SD15_REF, subfolder="vae"))
+        unet = UNet2DConditionModel.from_config(UNet2DConditionModel.load_config(SD15_REF, subfolder="unet"))
 
-    ckpt = load_file(str(ckpt_path), device="cpu")
+    conv_unet, conv_vae, conv_clip, _ = ldm_converters()
+    sources = {
+        "unet": ("model.diffusion_model.", conv_unet),
+        "vae": ("first_stage_model.", conv_vae),
+        "text_encoder": ("cond_stage_model.transformer.", conv_clip),
+    }
 
-    unet_sd, vae_sd, te_sd = {}, {}, {}
-    for k, v in ckpt.items():
-        if k.startswith("model.diffusion_model."):
-            unet_sd[k.replace("model.diffusion_model.", "")] = v
-        elif k.startswith("first_stage_model."):
-            vae_sd[k.replace("first_stage_model.", "")] = v
-        elif k.startswith("cond_stage_model."):
-            te_sd[k.replace("cond_stage_model.", "")] = v
+    def load(name, module):
+        prefix, convert = sources[name]
+        stream_component(module, ckpt_path, prefix, dtype, convert=lambda sd: convert(sd, module), name=name)
 
-    unet.load_state_dict(unet_sd, strict=False)
-    vae.load_state_dict(vae_sd, strict=False)
-    te.load_state_dict(te_sd, strict=False)
-
-    unet.to(device=device, dtype=dtype)
-    vae.to(device=device, dtype=dtype)
-    te.to(device=device, dtype=dtype)
+    materialize_components({"unet": unet, "vae": vae, "text_encoder": te}, ckpt_path, device, dtype, load, cache)
 
     log("STATUS all SD components loaded (safetensors)")
     return tok, te, vae, unet, sched
@@ -71,14 +68,8 @@ def load_sd_models(cfg: TrainConfig, device, dtype):
         p = Path(ident)
         if not p.is_file():
             raise FileNotFoundError(f"SD checkpoint not found: {ident}")
-        tok, te, vae, unet, sched = _load_sd_models_safetensors(p, device, dtype)
+        tok, te, vae, unet, sched = _load_sd_models_safetensors(p, device, dtype, open_model_cache(cfg.model_cache_gb))
     else:
         tok, te, vae, unet, sched = _load_sd_models_diffusers(ident, device, dtype)
 
-    if cfg.gradient_checkpointing:
-        unet.enable_gradient_checkpointing()
-        log("STATUS gradient_checkpointing=ENABLED")
-    else:
-        log("STATUS gradient_checkpointing=DISABLED")
-
     return tok, te, vae, unet, sched
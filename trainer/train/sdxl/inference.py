@@ -10,10 +10,18 @@ def decode_latents_to_pil(vae, latents):
     images = (images * 255).round().astype("uint8")
     return [Image.fromarray(img) for img in images]
 
-def make_add_time_ids(batch_size: int, bucket_res: int, dtype: torch.dtype):
-    h = w = int(bucket_res)
-    t = torch.tensor([h, w, 0, 0, h, w], dtype=dtype)
-    return t.unsqueeze(0).repeat(batch_size, 1)
+def make_add_time_ids(
+    original_sizes: list[tuple[int, int]],
+    crops_top_left: list[tuple[int, int]],
+    target_size: tuple[int, int],
+    dtype: torch.dtype,
+):
+    """SDXL micro-conditioning rows: original (h, w), crop (top, left), target (h, w)."""
+    rows = [
+        [int(oh), int(ow), int(top), int(left), int(target_size[0]), int(target_size[1])]
+        for (oh, ow), (top, left) in zip(original_sizes, crops_top_left)
+    ]
+    return torch.tensor(rows, dtype=dtype)
 
 @torch.no_grad()
 def run_sdxl_inference_preview(
@@ -44,7 +52,7 @@ def run_sdxl_inference_preview(
 
     scheduler.set_timesteps(steps, device=unet_device)
 
-    time_ids = make_add_time_ids(batch_size=1, bucket_res=resolution, dtype=dtype).to(unet_device)
+    time_ids = make_add_time_ids([(resolution, resolution)], [(0, 0)], (resolution, resolution), dtype).to(unet_device)
 
     for t in scheduler.timesteps:
         noise_pred = unet(
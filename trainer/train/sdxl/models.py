@@ -1,11 +1,12 @@
 import torch
 from pathlib import Path
-from safetensors.torch import load_file
 
 from diffusers import UNet2DConditionModel, AutoencoderKL, DDPMScheduler
-from transformers import CLIPTextModel, CLIPTokenizer
+from transformers import CLIPTextModel, CLIPTextConfig, CLIPTokenizer
 
 from ..config import log
+from ..model_cache import ModelCache, materialize_components, open_model_cache
+from ..safetensors_io import empty_modules, ldm_converters, read_safetensors_keys, stream_component
 
 REPO_ROOT = Path(__file__).resolve().parents[3]
 MODELS_DIR = REPO_ROOT / "models"
@@ -26,14 +27,25 @@ def resolve_model_identifier(model_id_or_path: str) -> str:
     return raw  # assume HF id
 
 def detect_sdxl_safetensors_format(ckpt_path: Path) -> str:
-    ckpt = load_file(str(ckpt_path), device="cpu")
-    for k in ckpt.keys():
+    for k in read_safetensors_keys(ckpt_path):
         if k.startswith("model.diffusion_model."):
             return "merged"
         if k.startswith("unet.") or k.startswith("vae.") or k.startswith("text_encoder."):
             return "diffusers"
     raise RuntimeError(f"Unrecognized SDXL safetensors format: {ckpt_path.name}")
 
+def _empty_sdxl_components():
+    """Modules from SDXL_REF configs with weights on the meta device, plus the tokenizers."""
+    with empty_modules():
+        unet = UNet2DConditionModel.from_config(UNet2DConditionModel.load_config(SDXL_REF, subfolder="unet"))
+        vae = AutoencoderKL.from_config(AutoencoderKL.load_config(SDXL_REF, subfolder="vae"))
+        te1 = CLIPTextModel(CLIPTextConfig.from_pretrained(SDXL_REF, subfolder="text_encoder"))
+        te2 = CLIPTextModel(CLIPTextConfig.from_pretrained(SDXL_REF, subfolder="text_encoder_2"))
+
+    tok1 = CLIPTokenizer.from_pretrained(SDXL_REF, subfolder="tokenizer")
+    tok2 = CLIPTokenizer.from_pretrained(SDXL_REF, subfolder="tokenizer_2")
+    return unet, vae, te1, te2, tok1, tok2
+
 def _load_sdxl_components_diffusers(base: str, device, dtype):
     unet = UNet2DConditionModel.from_pretrained(base, subfolder="unet", torch_dtype=dtype).to(device)
     vae = AutoencoderKL.from_pretrained(base, subfolder="vae", torch_dtype=dtype).to(device)
@@ -46,70 +58,47 @@ def _load_sdxl_components_diffusers(base: str, device, dtype):
     log("STATUS all SDXL components loaded (diffusers)")
     return unet, vae, te1, te2, tok1, tok2
 
-def _load_sdxl_components_safetensors_diffusers(ckpt_path: Path, device, dtype):
+def _load_sdxl_components_safetensors_diffusers(ckpt_path: Path, device, dtype, cache: ModelCache | None = None):
     log("STATUS detected diffusers-style SDXL safetensors")
 
-    unet = UNet2DConditionModel.from_pretrained(SDXL_REF, subfolder="unet", torch_dtype=dtype)
-    vae = AutoencoderKL.from_pretrained(SDXL_REF, subfolder="vae", torch_dtype=dtype)
-    te1 = CLIPTextModel.from_pretrained(SDXL_REF, subfolder="text_encoder", torch_dtype=dtype)
-    te2 = CLIPTextModel.from_pretrained(SDXL_REF, subfolder="text_encoder_2", torch_dtype=dtype)
-
-    tok1 = CLIPTokenizer.from_pretrained(SDXL_REF, subfolder="tokenizer")
-    tok2 = CLIPTokenizer.from_pretrained(SDXL_REF, subfolder="tokenizer_2")
-
-    ckpt = load_file(str(ckpt_path), device="cpu")
+    unet, vae, te1, te2, tok1, tok2 = _empty_sdxl_components()
 
-    unet.load_state_dict({k[5:]: v for k, v in ckpt.items() if k.startswith("unet.")}, strict=True)
-    vae.load_state_dict({k[4:]: v for k, v in ckpt.items() if k.startswith("vae.")}, strict=True)
-    te1.load_state_dict({k[13:]: v for k, v in ckpt.items() if k.startswith("text_encoder.")}, strict=True)
-    te2.load_state_dict({k[15:]: v for k, v in ckpt.items() if k.startswith("text_encoder_2.")}, strict=True)
+    # Keys already match the modules: each tensor goes straight from the mmap to its parameter.
+    def load(name, module):
+        stream_component(module, ckpt_path, f"{name}.", dtype, name=name)
 
-    unet.to(device=device, dtype=dtype)
-    vae.to(device=device, dtype=dtype)
-    te1.to(device=device, dtype=dtype)
-    te2.to(device=device, dtype=dtype)
+    components = {"unet": unet, "vae": vae, "text_encoder": te1, "text_encoder_2": te2}
+    materialize_components(components, ckpt_path, device, dtype, load, cache)
 
     log("STATUS all SDXL components loaded (diffusers safetensors)")
     return unet, vae, te1, te2, tok1, tok2
 
-def _load_sdxl_components_safetensors_merged(ckpt_path: Path, device, dtype):
+def _load_sdxl_components_safetensors_merged(ckpt_path: Path, device, dtype, cache: ModelCache | None = None):
     log("STATUS detected merged SDXL safetensors")
 
-    unet = UNet2DConditionModel.from_pretrained(SDXL_REF, subfolder="unet", torch_dtype=dtype)
-    vae = AutoencoderKL.from_pretrained(SDXL_REF, subfolder="vae", torch_dtype=dtype)
-    te1 = CLIPTextModel.from_pretrained(SDXL_REF, subfolder="text_encoder", torch_dtype=dtype)
-    te2 = CLIPTextModel.from_pretrained(SDXL_REF, subfolder="text_encoder_2", torch_dtype=dtype)
+    unet, vae, te1, te2, tok1, tok2 = _empty_sdxl_components()
 
-    tok1 = CLIPTokenizer.from_pretrained(SDXL_REF, subfolder="tokenizer")
-    tok2 = CLIPTokenizer.from_pretrained(SDXL_REF, subfolder="tokenizer_2")
+    # LDM keys are converted one component at a time.
+    conv_unet, conv_vae, conv_clip, conv_open_clip = ldm_converters()
+    te2_prefix = "conditioner.embedders.1.model."
+    sources = {
+        "unet": ("model.diffusion_model.", conv_unet),
+        "vae": ("first_stage_model.", conv_vae),
+        "text_encoder": ("conditioner.embedders.0.transformer.", conv_clip),
+        "text_encoder_2": (te2_prefix, lambda sd, m: conv_open_clip(sd, m, te2_prefix)),
+    }
 
-    ckpt = load_file(str(ckpt_path), device="cpu")
+    def load(name, module):
+        prefix, convert = sources[name]
+        stream_component(module, ckpt_path, prefix, dtype, convert=lambda sd: convert(sd, module), name=name)
 
-    unet_sd, vae_sd, te1_sd, te2_sd = {}, {}, {}, {}
-    for k, v in ckpt.items():
-        if k.startswith("model.diffusion_model."):
-            unet_sd[k.replace("model.diffusion_model.", "")] = v
-        elif k.startswith("first_stage_model."):
-            vae_sd[k.replace("first_stage_model.", "")] = v
-        elif k.startswith("conditioner.embedders.0."):
-            te1_sd[k.replace("conditioner.embedders.0.", "")] = v
-        elif k.startswith("conditioner.embedders.1."):
-            te2_sd[k.replace("conditioner.embedders.1.", "")] = v
-
-    unet.load_state_dict(unet_sd, strict=False)
-    vae.load_state_dict(vae_sd, strict=False)
-    te1.load_state_dict(te1_sd, strict=False)
-    te2.load_state_dict(te2_sd, strict=False)
-
-    unet.to(device=device, dtype=dtype)
-    vae.to(device=device, dtype=dtype)
-    te1.to(device=device, dtype=dtype)
-    te2.to(device=device, dtype=dtype)
+    components = {"unet": unet, "vae": vae, "text_encoder": te1, "text_encoder_2": te2}
+    materialize_components(components, ckpt_path, device, dtype, load, cache)
 
     log("STATUS all SDXL components loaded (merged safetensors)")
     return unet, vae, te1, te2, tok1, tok2
 
-def load_sdxl_components(base_model: str, device, dtype):
+def load_sdxl_components(base_model: str, device, dtype, cache_gb: float = 0.0):
     ident = resolve_model_identifier(base_model)
 
     if ident.endswith(".safetensors"):
@@ -118,10 +107,11 @@ def load_sdxl_components(base_model: str, device, dtype):
             raise FileNotFoundError(f"SDXL checkpoint not found: {ident}")
 
         fmt = detect_sdxl_safetensors_format(p)
+        cache = open_model_cache(cache_gb)
         if fmt == "diffusers":
-            return _load_sdxl_components_safetensors_diffusers(p, device, dtype)
+            return _load_sdxl_components_safetensors_diffusers(p, device, dtype, cache)
         if fmt == "merged":
-            return _load_sdxl_components_safetensors_merged(p, device, dtype)
+            return _load_sdxl_components_safetensors_merged(p, device, dtype, cache)
 
     return _load_sdxl_components_diffusers(ident, device, dtype)
 
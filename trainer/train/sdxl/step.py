@@ -1,10 +1,8 @@
-from pathlib import Path
 import torch
 import torch.nn.functional as F
-from PIL import Image
 
 from ..config import TrainConfig
-from ..data import image_transform, apply_caption_options
+from ..perf import StepProfiler
 from .inference import make_add_time_ids
 
 @torch.no_grad()
@@ -48,8 +46,9 @@ class SDXLTrainStep:
         self,
         *,
         cfg: TrainConfig,
-        dataset,
+        captions,
         cached_latents_by_bucket,
+        text_cache,
         tokenizer,
         tokenizer_2,
         text_encoder,
@@ -60,10 +59,12 @@ class SDXLTrainStep:
         device: torch.device,
         dtype: torch.dtype,
         scaling_factor: float,
+        perf: StepProfiler | None = None,
     ):
         self.cfg = cfg
-        self.dataset = dataset
+        self.captions = captions
         self.cached = cached_latents_by_bucket
+        self.text_cache = text_cache
         self.tokenizer = tokenizer
         self.tokenizer_2 = tokenizer_2
         self.text_encoder = text_encoder
@@ -74,30 +75,21 @@ class SDXLTrainStep:
         self.device = device
         self.dtype = dtype
         self.scaling_factor = scaling_factor
-
-    def __call__(self, batch_indices: list[int], bucket_res: int) -> torch.Tensor:
-        tfm_bucket = image_transform(bucket_res)
-
-        images = []
-        captions = []
-
-        for idx in batch_indices:
-            img_path, cap_path = self.dataset[idx]
-            text = Path(cap_path).read_text(encoding="utf-8").strip()
-            text = apply_caption_options(text, self.cfg)
-            img = Image.open(img_path).convert("RGB")
-            images.append(tfm_bucket(img))
-            captions.append(text)
-
-        pixel = torch.stack(images).to(device=self.device, dtype=self.dtype)
-
-        if self.cfg.cache_latents:
-            assert self.cached is not None
-            bucket_cache = self.cached[bucket_res]
-            latents = torch.cat([bucket_cache[i] for i in batch_indices], dim=0).to(device=self.device, dtype=self.dtype)
-        else:
-            with torch.no_grad():
-                latents = self.vae.encode(pixel).latent_dist.sample() * self.scaling_factor
+        self.perf = perf or StepProfiler()
+
+    def __call__(self, batch: dict) -> torch.Tensor:
+        batch_indices = batch["indices"]
+        bucket = batch["bucket"]
+        captions = [self.captions[i] for i in batch_indices]
+
+        with self.perf.section("vae"):
+            if self.cfg.cache_latents:
+                assert self.cached is not None
+                latents = self.cached.load(bucket, batch_indices).to(device=self.device, dtype=self.dtype)
+            else:
+                pixel = batch["pixels"].to(device=self.device, dtype=self.dtype, non_blocking=True)
+                with torch.no_grad():
+                    latents = self.vae.encode(pixel).latent_dist.sample() * self.scaling_factor
 
         noise = torch.randn_like(latents)
         t = torch.randint(
@@ -109,27 +101,36 @@ class SDXLTrainStep:
 
         noisy = self.scheduler.add_noise(latents, noise, t)
 
-        with torch.no_grad():
-            prompt_embeds, pooled = encode_prompt_sdxl(
-                captions,
-                self.tokenizer,
-                self.tokenizer_2,
-                self.text_encoder,
-                self.text_encoder_2,
+        with torch.no_grad(), self.perf.section("text"):
+            if self.text_cache is not None:
+                prompt_embeds, pooled = (t.to(self.dtype) for t in self.text_cache.load(captions))
+            else:
+                prompt_embeds, pooled = encode_prompt_sdxl(
+                    captions,
+                    self.tokenizer,
+                    self.tokenizer_2,
+                    self.text_encoder,
+                    self.text_encoder_2,
+                    self.dtype,
+                )
+            add_time_ids = make_add_time_ids(
+                batch["original_sizes"],
+                batch["crops_top_left"],
+                (bucket[1], bucket[0]),
                 self.dtype,
             )
-            add_time_ids = make_add_time_ids(latents.size(0), bucket_res, self.dtype)
 
         unet_device = next(self.unet.parameters()).device
-        pred = self.unet(
-            noisy.to(unet_device),
-            t.to(unet_device),
-            encoder_hidden_states=prompt_embeds.to(unet_device),
-            added_cond_kwargs={
-                "text_embeds": pooled.to(unet_device),
-                "time_ids": add_time_ids.to(unet_device),
-            },
-        ).sample
-
-        loss = F.mse_loss(pred.float().to(self.device), noise.float())
+        with self.perf.section("unet"):
+            pred = self.unet(
+                noisy.to(unet_device),
+                t.to(unet_device),
+                encoder_hidden_states=prompt_embeds.to(unet_device),
+                added_cond_kwargs={
+                    "text_embeds": pooled.to(unet_device),
+                    "time_ids": add_time_ids.to(unet_device),
+                },
+            ).sample
+
+            loss = F.mse_loss(pred.float().to(self.device), noise.float())
         return loss
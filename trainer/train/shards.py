@@ -0,0 +1,157 @@
+import io
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .config import TrainConfig, log
+from .data import _to_normalized_tensor, resize_to_bucket
+
+SHARD_INDEX = "index.json"
+SHARD_FORMAT_VERSION = 1
+SHARD_ENCODINGS = ("png", "raw")
+
+def encode_image(img: Image.Image, encoding: str) -> bytes:
+    if encoding == "raw":
+        return np.asarray(img, dtype=np.uint8).tobytes()
+    buf = io.BytesIO()
+    img.save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+class ShardWriter:
+    """
+    Appends encoded images to fixed-size shard files and records their offsets.
+    Shards are written under a temporary name and renamed once complete.
+    """
+
+    def __init__(self, output_dir: str | Path, shard_size: int):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.shards: list[str] = []
+        self._f = None
+        self._offset = 0
+
+    def _open_next(self) -> None:
+        self._close_current()
+        name = f"shard-{len(self.shards):05d}.bin"
+        self.shards.append(name)
+        self._f = open(self.output_dir / f"{name}.tmp", "wb")
+        self._offset = 0
+
+    def _close_current(self) -> None:
+        if self._f is None:
+            return
+        self._f.close()
+        name = self.shards[-1]
+        os.replace(self.output_dir / f"{name}.tmp", self.output_dir / name)
+        self._f = None
+
+    def write(self, data: bytes) -> tuple[int, int, int]:
+        """Returns (shard number, offset, length)."""
+        if self._f is None or (self._offset > 0 and self._offset + len(data) > self.shard_size):
+            self._open_next()
+        offset = self._offset
+        self._f.write(data)
+        self._offset += len(data)
+        return len(self.shards) - 1, offset, len(data)
+
+    def close(self, index: dict) -> None:
+        self._close_current()
+        index = {**index, "version": SHARD_FORMAT_VERSION, "shards": self.shards}
+        tmp = self.output_dir / f"{SHARD_INDEX}.tmp"
+        tmp.write_text(json.dumps(index), encoding="utf-8")
+        os.replace(tmp, self.output_dir / SHARD_INDEX)
+
+class ShardDataset:
+    """
+    Reads a dataset packed by trainer/pack_dataset.py.
+    Images are stored already resized to their bucket; captions and offsets live in index.json.
+    Shards are memory-mapped lazily in each process, so the object is cheap to send to loader workers.
+    """
+
+    def __init__(self, root: str | Path):
+        self.root = Path(root)
+        index_path = self.root / SHARD_INDEX
+        if not index_path.is_file():
+            raise RuntimeError(f"No packed dataset found: {index_path}")
+
+        index = json.loads(index_path.read_text(encoding="utf-8"))
+        if index.get("version") != SHARD_FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported shard format version {index.get('version')} in {index_path}")
+
+        self.index = index
+        self._index_mtime_ns = index_path.stat().st_mtime_ns
+        self.encoding = index["encoding"]
+        self.shards = index["shards"]
+        self.samples = index["samples"]
+        if not self.samples:
+            raise RuntimeError("Dataset is empty")
+        self._maps: dict[int, np.memmap] = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_maps"] = {}
+        return state
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    @property
+    def num_shards(self) -> int:
+        return len(self.shards)
+
+    def read_caption(self, idx: int) -> str:
+        return self.samples[idx]["caption"].strip()
+
+    def image_sizes(self, index_path: Path | None = None) -> list[tuple[int, int]]:
+        return [tuple(s["size"]) for s in self.samples]
+
+    def packed_bucket(self, idx: int) -> tuple[int, int]:
+        return tuple(self.samples[idx]["bucket"])
+
+    def stamp(self, idx: int) -> tuple[str, int, int]:
+        # Repacking rewrites index.json, so its mtime invalidates every sample.
+        s = self.samples[idx]
+        return str(self.root.resolve() / s["name"]), self._index_mtime_ns, s["length"]
+
+    def content_hash(self, idx: int) -> str:
+        # Hash of the source image, so latents are shared with the folder format.
+        return self.samples[idx]["sha256"]
+
+    def check_bucket_settings(self, cfg: TrainConfig) -> None:
+        packed = self.index.get("buckets", {})
+        wanted = {
+            "resolution": cfg.resolution,
+            "bucket_enabled": cfg.bucket_enabled,
+            "bucket_min_res": cfg.bucket_min_res,
+            "bucket_max_res": cfg.bucket_max_res,
+            "bucket_step": cfg.bucket_step,
+        }
+        if not cfg.bucket_enabled:
+            wanted = {k: wanted[k] for k in ("resolution", "bucket_enabled")}
+        diff = [f"{k}={packed.get(k)}" for k, v in wanted.items() if packed.get(k) != v]
+        if diff:
+            log(f"WARN packed dataset uses {' '.join(diff)}; training on the packed buckets (re-run pack_dataset to change them)")
+
+    def _shard(self, n: int) -> np.memmap:
+        mm = self._maps.get(n)
+        if mm is None:
+            mm = np.memmap(self.root / self.shards[n], dtype=np.uint8, mode="r")
+            self._maps[n] = mm
+        return mm
+
+    def read_image(self, idx: int) -> Image.Image:
+        s = self.samples[idx]
+        data = self._shard(s["shard"])[s["offset"]:s["offset"] + s["length"]]
+        if self.encoding == "raw":
+            w, h = s["bucket"]
+            return Image.fromarray(np.array(data).reshape(h, w, 3))
+        with Image.open(io.BytesIO(data.tobytes())) as img:
+            return img.convert("RGB")
+
+    def load_image(self, idx: int, bucket: tuple[int, int]) -> torch.Tensor:
+        return _to_normalized_tensor(resize_to_bucket(self.read_image(idx), bucket))
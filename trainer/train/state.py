@@ -0,0 +1,149 @@
+import os
+import random
+import signal
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from .config import log
+
+TRAIN_STATE_VERSION = 1
+
+def capture_rng_state() -> dict:
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+def restore_rng_state(rng: dict) -> None:
+    random.setstate(rng["python"])
+    np.random.set_state(rng["numpy"])
+    torch.set_rng_state(rng["torch"])
+    if rng["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(rng["cuda"])
+
+def save_train_state(path: Path, *, state, trainable_params, optimizer, lr_scheduler, sampler) -> None:
+    """
+    Everything needed to continue a run exactly: LoRA params, optimizer moments, LR schedule,
+    RNG streams and the sampler cursor. Only taken at optimizer-step boundaries (no pending grads).
+    """
+    payload = {
+        "version": TRAIN_STATE_VERSION,
+        "state": {
+            "global_step": state.global_step,
+            "opt_step": state.opt_step,
+            "epoch": state.epoch,
+            "epoch_batch": state.epoch_batch,
+        },
+        "params": [p.detach().cpu().clone() for p in trainable_params],
+        "optimizer": optimizer.state_dict(),
+        "lr_scheduler": lr_scheduler.state_dict(),
+        "sampler": sampler.state_dict(state.epoch, state.epoch_batch),
+        "rng": capture_rng_state(),
+    }
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    torch.save(payload, tmp)
+    os.replace(tmp, path)
+    log(f"STATUS train_state saved: {path.name} epoch={state.epoch} batch={state.epoch_batch} opt_step={state.opt_step}")
+
+def load_train_state(path: Path, *, state, trainable_params, optimizer, lr_scheduler, sampler) -> None:
+    payload = torch.load(path, map_location="cpu", weights_only=False)
+    if payload.get("version") != TRAIN_STATE_VERSION:
+        raise RuntimeError(f"Unsupported train state version in {path}: {payload.get('version')}")
+
+    params = payload["params"]
+    if len(params) != len(trainable_params) or any(a.shape != b.shape for a, b in zip(params, trainable_params)):
+        raise RuntimeError(f"Train state {path.name} does not match the LoRA layout of this run (rank/targets changed?)")
+
+    with torch.no_grad():
+        for p, saved in zip(trainable_params, params):
+            p.copy_(saved)
+    optimizer.load_state_dict(payload["optimizer"])
+    lr_scheduler.load_state_dict(payload["lr_scheduler"])
+    sampler.load_state_dict(payload["sampler"])
+    restore_rng_state(payload["rng"])
+
+    for k, v in payload["state"].items():
+        setattr(state, k, v)
+    log(f"STATUS resumed from {path.name} epoch={state.epoch} batch={state.epoch_batch} opt_step={state.opt_step}")
+
+def resolve_resume_path(resume: str | None, default_path: Path) -> Path | None:
+    """'auto' resumes from the run's own state file when it exists, otherwise starts fresh."""
+    if not resume:
+        return None
+    if resume == "auto":
+        return default_path if default_path.is_file() else None
+    p = Path(resume)
+    if not p.is_file():
+        raise FileNotFoundError(f"Resume state not found: {p}")
+    return p
+
+class StopRequest:
+    """
+    Turns SIGTERM (what /stop/<project> sends) into a flag the training loop checks at the
+    next optimizer step, so it can write a final train state (when saving one) before exiting.
+    """
+
+    def __init__(self, saves_state: bool = True):
+        global _active_stop
+        self.requested = False
+        self.saves_state = saves_state
+        if hasattr(signal, "SIGTERM"):
+            signal.signal(signal.SIGTERM, self._handle)
+        _active_stop = self
+
+    def _handle(self, signum, frame):
+        if self.requested:
+            raise SystemExit(128 + signum)
+        self.requested = True
+        if self.saves_state:
+            log("STATUS stop requested, saving train state at next optimizer step")
+        else:
+            log("STATUS stop requested, stopping at next optimizer step")
+
+_active_stop: StopRequest | None = None
+
+def request_stop() -> bool:
+    """
+    Same as SIGTERM, for the trainer worker whose jobs share one process.
+    Returns False before the run installed its StopRequest (still loading or caching).
+    """
+    if _active_stop is None:
+        return False
+    _active_stop._handle(signal.SIGTERM, None)
+    return True
+
+def clear_stop_request() -> None:
+    global _active_stop
+    _active_stop = None
+
+def prepare_train_state(cfg, state_path: Path, *, trainable_params, optimizer, lr_scheduler, sampler):
+    """
+    Returns (state, save_state, stop) for train_epochs: a TrainState restored from cfg.resume when
+    requested, a saver when cfg.save_state is on (else None) and the SIGTERM hook.
+    """
+    from .loop import TrainState
+
+    state = TrainState()
+    resume_path = resolve_resume_path(cfg.resume, state_path)
+    if resume_path is not None:
+        load_train_state(
+            resume_path, state=state, trainable_params=trainable_params,
+            optimizer=optimizer, lr_scheduler=lr_scheduler, sampler=sampler,
+        )
+    elif cfg.resume:
+        log("STATUS resume: no train state found, starting fresh")
+
+    if not cfg.save_state:
+        return state, None, StopRequest(saves_state=False)
+
+    def save_state(s) -> None:
+        save_train_state(
+            state_path, state=s, trainable_params=trainable_params,
+            optimizer=optimizer, lr_scheduler=lr_scheduler, sampler=sampler,
+        )
+
+    return state, save_state, StopRequest()
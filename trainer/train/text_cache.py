@@ -0,0 +1,68 @@
+import hashlib
+from pathlib import Path
+
+import torch
+
+from .config import TrainConfig, log
+from .latent_cache import LatentStore
+
+def text_encoder_identity(cfg: TrainConfig, dtype: torch.dtype) -> str:
+    raw = f"{cfg.model_type}|{cfg.base_model}|clip_skip={cfg.clip_skip}|dtype={dtype}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def caption_key(caption: str, encoder_id: str) -> str:
+    return hashlib.sha256(f"{encoder_id}|{caption}".encode("utf-8")).hexdigest()
+
+class TextEmbeddingCache:
+    """
+    Maps processed captions to precomputed encoder outputs.
+    load() returns one batch-first tensor per encoder output (e.g. hidden states, pooled).
+    """
+
+    def __init__(self, store: LatentStore, keys: dict[str, str], num_outputs: int):
+        self.store = store
+        self.keys = keys
+        self.num_outputs = num_outputs
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def load(self, captions: list[str]) -> tuple[torch.Tensor, ...]:
+        keys = [self.keys[c] for c in captions]
+        return tuple(
+            torch.cat([self.store.get(f"{k}.{i}") for k in keys], dim=0)
+            for i in range(self.num_outputs)
+        )
+
+def build_text_embedding_cache(
+    *,
+    cfg: TrainConfig,
+    captions,
+    encode_fn,
+    num_outputs: int,
+    dtype: torch.dtype,
+) -> TextEmbeddingCache:
+    """
+    encode_fn(list[str]) -> tuple of batch-first tensors, one per encoder output;
+    dtype is what the encoders run in, as embeddings differ between precisions.
+    Each unique caption is encoded once; with cfg.cache_dir results persist across runs.
+    """
+    log("STATUS building text embedding cache")
+    store_root = Path(cfg.cache_dir) / "text_embeds" if cfg.cache_dir else None
+    store = LatentStore(store_root)
+
+    encoder_id = text_encoder_identity(cfg, dtype)
+    keys = {c: caption_key(c, encoder_id) for c in dict.fromkeys(captions)}
+    missing = [c for c, k in keys.items() if not store.has(f"{k}.{num_outputs - 1}")]
+
+    bs = max(cfg.cache_batch_size, 1)
+    with torch.no_grad():
+        for start in range(0, len(missing), bs):
+            chunk = missing[start:start + bs]
+            outputs = encode_fn(chunk)
+            for i, out in enumerate(outputs):
+                for caption, emb in zip(chunk, out):
+                    store.put(f"{keys[caption]}.{i}", emb.unsqueeze(0))
+
+    log(f"STATUS text_embeds_total={len(keys)} encoded={len(missing)} reused={len(keys) - len(missing)}")
+    return TextEmbeddingCache(store, keys, num_outputs)
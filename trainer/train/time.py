@@ -1,23 +1,77 @@
 import time
 
 class ETATimer:
-    def __init__(self, total_steps: int):
-        self.total_steps = total_steps
-        self.start_time = time.perf_counter()
+    """
+    Step-time estimator that projects the remaining batches per bucket.
 
-    def update(self, completed_steps: int) -> float | None:
+    Each bucket keeps an exponentially weighted average of its step time, since a 1536px
+    step costs several times a 512px one. Only time between mark() and step() counts, so
+    model loading, caching, previews and checkpoints do not leak into the estimate. The first
+    step of each bucket (kernel selection, allocator growth) is not averaged in.
+    """
+
+    def __init__(self, alpha: float = 0.1):
+        self.alpha = alpha
+        self.remaining: dict[tuple[int, int], int] = {}
+        self.step_time: dict[tuple[int, int], float] = {}
+        self.warmed: set[tuple[int, int]] = set()
+        self.samples_per_sec: float | None = None
+        self.pixels_per_sec: float | None = None
+        self.last = time.perf_counter()
+
+    def start_epoch(self, batches: list, start: int, epochs_after: int) -> None:
+        """batches: the epoch's batch order; start: batches already done (resume); epochs_after: full epochs still to come."""
+        per_epoch: dict[tuple[int, int], int] = {}
+        current: dict[tuple[int, int], int] = {}
+        for i, batch in enumerate(batches):
+            bucket = batch[0][1]
+            per_epoch[bucket] = per_epoch.get(bucket, 0) + 1
+            if i >= start:
+                current[bucket] = current.get(bucket, 0) + 1
+        self.remaining = {b: current.get(b, 0) + n * epochs_after for b, n in per_epoch.items()}
+        self.mark()
+
+    def mark(self) -> None:
+        """Restarts the step clock, e.g. after a pause that is not training work."""
+        self.last = time.perf_counter()
+
+    def step(self, bucket: tuple[int, int], samples: int) -> None:
+        now = time.perf_counter()
+        dt = now - self.last
+        self.last = now
+
+        if bucket in self.remaining:
+            self.remaining[bucket] = max(self.remaining[bucket] - 1, 0)
+        if bucket not in self.warmed:
+            self.warmed.add(bucket)
+            return
+        if dt <= 0:
+            return
+
+        prev = self.step_time.get(bucket)
+        self.step_time[bucket] = dt if prev is None else prev + self.alpha * (dt - prev)
+
+        rate = samples / dt
+        pixels = rate * bucket[0] * bucket[1]
+        if self.samples_per_sec is None:
+            self.samples_per_sec, self.pixels_per_sec = rate, pixels
+        else:
+            self.samples_per_sec += self.alpha * (rate - self.samples_per_sec)
+            self.pixels_per_sec += self.alpha * (pixels - self.pixels_per_sec)
+
+    def eta(self) -> float | None:
         """
         Returns ETA in seconds, or None if not enough info yet.
+        Buckets not measured yet are costed from the measured ones' time per pixel.
         """
-        if completed_steps <= 0:
+        if not self.step_time:
             return None
 
-        elapsed = time.perf_counter() - self.start_time
-        steps_left = self.total_steps - completed_steps
-
-        if steps_left <= 0:
-            return 0.0
-
-        avg_step_time = elapsed / completed_steps
-        eta_seconds = steps_left * avg_step_time
-        return eta_seconds
+        sec_per_pixel = sum(t / (b[0] * b[1]) for b, t in self.step_time.items()) / len(self.step_time)
+        total = 0.0
+        for bucket, n in self.remaining.items():
+            t = self.step_time.get(bucket)
+            if t is None:
+                t = sec_per_pixel * bucket[0] * bucket[1]
+            total += n * t
+        return total
@@ -1,4 +1,6 @@
+import gc
 import sys
+from dataclasses import asdict
 from pathlib import Path
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
@@ -10,13 +12,21 @@ setup_hf_env()
 
 import torch
 from trainer.train.config import build_arg_parser, cfg_from_args, log, resolve_dtype, log_train_config
-from trainer.train.data import build_dataset_buckets_and_tags, build_latent_cache
+from trainer.train.data import build_dataset_buckets_and_tags, build_latent_cache, epoch_steps
+from trainer.train.loader import build_train_loader
 from trainer.train.meta import build_lora_metadata
-from trainer.train.lora import DEFAULT_TARGET_MODULES, DEFAULT_TE_TARGET_MODULES, inject_lora, set_lora_scale, save_lora
+from trainer.train.lora import DEFAULT_TARGET_MODULES, DEFAULT_TE_TARGET_MODULES, inject_lora, merged_lora, set_lora_scale, set_lora_training
+from trainer.train.checkpoint import CheckpointWriter
+from trainer.train.preview import build_preview_scheduler
+from trainer.train.state import prepare_train_state
+from trainer.train.perf import build_step_profiler
+from trainer.train.events import close_event_stream, emit, open_event_stream
+from trainer.train.resident import load_models, release_models
 from trainer.train.optim import build_optimizer, build_scheduler
 from trainer.train.loop import train_epochs
 from trainer.train.sd.models import load_sd_models
-from trainer.train.sd.step import SDTrainStep
+from trainer.train.sd.step import SDTrainStep, encode_prompt_sd
+from trainer.train.text_cache import build_text_embedding_cache
 from trainer.train.sd.inference import run_inference_preview_in_memory
 from trainer.train.time import ETATimer
 from utils.ensure_models import ensure_base_model_available
@@ -28,6 +38,7 @@ def train(cfg):
 
     log(f"STATUS device={device.type} dtype={dtype}")
     log_train_config(cfg)
+    emit("config", **asdict(cfg))
     ensure_base_model_available(cfg.base_model)
     
     if cfg.cpu_offload and not cfg.cache_latents:
@@ -39,18 +50,21 @@ def train(cfg):
     if cfg.model_type != "sd":
         raise RuntimeError("train_lora_v1.py currently supports only --model_type sd (SD 1.x)")
 
-    dataset, bucket_map, tag_counter, trained_words = build_dataset_buckets_and_tags(cfg)
-    steps_per_epoch = sum(
-        (len(ids) + cfg.batch_size - 1) // cfg.batch_size
-        for ids in bucket_map.values()
-    )
-    updates_per_epoch = (steps_per_epoch + cfg.grad_accum_steps - 1) // cfg.grad_accum_steps
-    total_opt_steps = updates_per_epoch * cfg.epochs
+    dataset, bucket_map, tag_counter, trained_words, image_sizes, captions = build_dataset_buckets_and_tags(cfg)
+    steps_per_epoch = epoch_steps(bucket_map, cfg.repeats, cfg.batch_size, cfg.tail_batches)
 
-    timer = ETATimer(total_steps=total_opt_steps)
+    timer = ETATimer()
 
     log("STATUS loading_models")
-    tokenizer, text_encoder, vae, unet, scheduler = load_sd_models(cfg, device, dtype)
+    tokenizer, text_encoder, vae, unet, scheduler = load_models(
+        ("sd", cfg.base_model, str(dtype), str(device)), lambda: load_sd_models(cfg, device, dtype)
+    )
+
+    if cfg.gradient_checkpointing:
+        unet.enable_gradient_checkpointing()
+        log("STATUS gradient_checkpointing=ENABLED")
+    else:
+        log("STATUS gradient_checkpointing=DISABLED")
 
     if cfg.use_xformers:
         try:
@@ -102,7 +116,7 @@ def train(cfg):
     trainable_params = list(unet_lora_params) + (list(te_lora_params) if train_clip else [])
 
     optimizer = build_optimizer(param_groups, cfg)
-    lr_scheduler, _ = build_scheduler(cfg, optimizer, len(dataset))
+    lr_scheduler, _ = build_scheduler(cfg, optimizer, steps_per_epoch)
 
     output_path = Path(cfg.output)
     output_dir = output_path.parent
@@ -119,13 +133,38 @@ def train(cfg):
         scaling_factor=0.18215,
     )
 
+    def encode_preview_prompts():
+        with torch.no_grad():
+            embeds = encode_prompt_sd([cfg.inference_prompt, ""], tokenizer, text_encoder, cfg.clip_skip)
+        return embeds[:1], embeds[1:]
+
+    text_cache = None
+    preview_embeds = None
+    if not train_clip:
+        text_cache = build_text_embedding_cache(
+            cfg=cfg,
+            captions=captions,
+            encode_fn=lambda caps: (encode_prompt_sd(caps, tokenizer, text_encoder, cfg.clip_skip),),
+            num_outputs=1,
+            dtype=dtype,
+        )
+        if cfg.do_inference:
+            preview_embeds = encode_preview_prompts()
+
+        # The frozen encoder is never needed again once every prompt is cached.
+        release_models(text_encoder)
+        text_encoder = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        log("STATUS text_encoder=FREED (text embeddings cached)")
+
     if cfg.cpu_offload:
         vae.to("cpu")
         log("STATUS cpu_offload=ENABLED components=vae")
 
         if not train_clip:
-            text_encoder.to("cpu")
-            log("STATUS cpu_offload=ENABLED components+=text_encoder")
+            log("STATUS cpu_offload=SKIPPED text_encoder (freed)")
         else:
             log("STATUS cpu_offload=PARTIAL text_encoder=GPU (train_clip=True)")
     else:
@@ -135,10 +174,13 @@ def train(cfg):
         log("WARN do_inference disabled because cpu_offload=True (preview expects GPU models)")
         cfg.do_inference = False
 
+    perf = build_step_profiler(cfg, output_dir / base_name)
+
     step = SDTrainStep(
         cfg=cfg,
-        dataset=dataset,
+        captions=captions,
         cached_latents_by_bucket=cached_latents_by_bucket,
+        text_cache=text_cache,
         tokenizer=tokenizer,
         text_encoder=text_encoder,
         vae=vae,
@@ -146,59 +188,109 @@ def train(cfg):
         scheduler=scheduler,
         device=device,
         dtype=dtype,
+        perf=perf,
     )
 
+    loader = build_train_loader(cfg, dataset, bucket_map, image_sizes)
+    log(f"STATUS data_loader workers={cfg.num_workers} prefetch={cfg.prefetch_factor}")
+
+    previews = None
+    if cfg.do_inference:
+        previews = build_preview_scheduler(cfg, device, output_dir / f"{base_name}_previews.json")
+
+    writer = CheckpointWriter()
+
     def on_epoch_end(epoch, state):
+        if previews is not None:
+            previews.poll()
+
         if cfg.save_every_epochs > 0 and epoch % cfg.save_every_epochs == 0:
             out = output_dir / f"{base_name}_epoch_{epoch}.safetensors"
             log(f"STATUS saving checkpoint: {out.name}")
             metadata = build_lora_metadata(cfg, tag_counter, trained_words)
-            save_lora(unet=unet, text_encoder=text_encoder if train_clip else None, path=str(out), metadata=metadata)
+            with perf.section("checkpoint"):
+                writer.save(unet=unet, text_encoders=[text_encoder if train_clip else None], path=out, metadata=metadata)
 
-            if cfg.do_inference:
+            if previews is not None:
+                previews.submit(epoch, out, output_dir / f"{base_name}_epoch_{epoch}_preview")
+            elif cfg.do_inference:
                 preview_dir = output_dir / f"{base_name}_epoch_{epoch}_preview"
                 preview_dir.mkdir(parents=True, exist_ok=True)
 
-                prompt = cfg.inference_prompt
+                cond, uncond = preview_embeds if preview_embeds is not None else encode_preview_prompts()
 
                 log("STATUS inference preview: BASE (LoRA OFF)")
                 set_lora_scale(unet, 0.0)
                 run_inference_preview_in_memory(
-                    unet=unet, vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, scheduler=scheduler,
-                    output_dir=preview_dir / "base", prompt=prompt, steps=cfg.inference_steps,
-                    num_images=cfg.inference_images, seed=cfg.seed, device=device, dtype=dtype, clip_skip=cfg.clip_skip
+                    unet=unet, vae=vae, scheduler=scheduler, output_dir=preview_dir / "base",
+                    prompt_embeds=cond, negative_prompt_embeds=uncond, steps=cfg.inference_steps,
+                    num_images=cfg.inference_images, seed=cfg.seed, device=device, dtype=dtype,
                 )
 
                 log("STATUS inference preview: LORA (LoRA ON)")
                 set_lora_scale(unet, 1.0)
-                run_inference_preview_in_memory(
-                    unet=unet, vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, scheduler=scheduler,
-                    output_dir=preview_dir / "lora", prompt=prompt, steps=cfg.inference_steps,
-                    num_images=cfg.inference_images, seed=cfg.seed, device=device, dtype=dtype, clip_skip=cfg.clip_skip
-                )
+                with merged_lora(unet):
+                    run_inference_preview_in_memory(
+                        unet=unet, vae=vae, scheduler=scheduler, output_dir=preview_dir / "lora",
+                        prompt_embeds=cond, negative_prompt_embeds=uncond, steps=cfg.inference_steps,
+                        num_images=cfg.inference_images, seed=cfg.seed, device=device, dtype=dtype,
+                    )
+                # Preview switches the UNet to eval; LoRA dropout must be active again for training.
+                set_lora_training(unet, True)
+
+    state, save_state, stop = prepare_train_state(
+        cfg,
+        output_dir / f"{base_name}_state.pt",
+        trainable_params=trainable_params,
+        optimizer=optimizer,
+        lr_scheduler=lr_scheduler,
+        sampler=loader.batch_sampler,
+    )
 
     train_epochs(
         cfg=cfg,
-        dataset=dataset,
-        bucket_map=bucket_map,
+        loader=loader,
         step_fn=step,
         optimizer=optimizer,
         lr_scheduler=lr_scheduler,
         trainable_params=trainable_params,
         on_epoch_end=on_epoch_end,
         timer=timer,
+        state=state,
+        save_state=save_state,
+        stop=stop,
+        perf=perf,
     )
 
     final_out = output_dir / f"{base_name}_final.safetensors"
     log(f"STATUS saving final: {final_out.name}")
     metadata = build_lora_metadata(cfg, tag_counter, trained_words)
-    save_lora(unet=unet, text_encoder=text_encoder if train_clip else None, path=str(final_out), metadata=metadata)
+    writer.save(unet=unet, text_encoders=[text_encoder if train_clip else None], path=final_out, metadata=metadata)
+    writer.close()
 
-def main():
+    if previews is not None and previews.pending():
+        # Workers load their own copy of the model; give them the GPU memory held by training.
+        unet.to("cpu")
+        vae.to("cpu")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        log("STATUS waiting for preview renders")
+        previews.finish()
+
+def main(argv: list[str] | None = None):
     ap = build_arg_parser(default_resolution=512)
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
     cfg = cfg_from_args(args)
-    train(cfg)
+    open_event_stream(cfg.events_file)
+    try:
+        train(cfg)
+    except Exception as e:
+        emit("error", message=str(e), kind=type(e).__name__)
+        raise
+    else:
+        emit("done")
+    finally:
+        close_event_stream()
 
 if __name__ == "__main__":
     main()
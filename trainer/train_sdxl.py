@@ -1,4 +1,6 @@
+import gc
 import sys
+from dataclasses import asdict
 from pathlib import Path
 
 REPO_ROOT = Path(__file__).resolve().parents[1]
@@ -10,14 +12,22 @@ setup_hf_env()
 
 import torch
 from trainer.train.config import build_arg_parser, cfg_from_args, log, resolve_dtype, log_train_config
-from trainer.train.data import build_dataset_buckets_and_tags, build_latent_cache
+from trainer.train.data import build_dataset_buckets_and_tags, build_latent_cache, epoch_steps
+from trainer.train.loader import build_train_loader
 from trainer.train.meta import build_lora_metadata
-from trainer.train.lora import DEFAULT_TARGET_MODULES, DEFAULT_TE_TARGET_MODULES, inject_lora, set_lora_scale, save_lora_sdxl
+from trainer.train.lora import DEFAULT_TARGET_MODULES, DEFAULT_TE_TARGET_MODULES, inject_lora, merged_lora, set_lora_scale, set_lora_training
+from trainer.train.checkpoint import CheckpointWriter
+from trainer.train.preview import build_preview_scheduler
+from trainer.train.state import prepare_train_state
+from trainer.train.perf import build_step_profiler
+from trainer.train.events import close_event_stream, emit, open_event_stream
+from trainer.train.resident import load_models, release_models
 from trainer.train.optim import build_optimizer, build_scheduler
 from trainer.train.loop import train_epochs
 from trainer.train.sdxl.models import load_sdxl_components, load_sdxl_scheduler
 from trainer.train.sdxl.step import SDXLTrainStep, encode_prompt_sdxl
 from trainer.train.sdxl.inference import run_sdxl_inference_preview
+from trainer.train.text_cache import build_text_embedding_cache
 from trainer.train.time import ETATimer
 from utils.ensure_models import ensure_base_model_available
 
@@ -28,6 +38,7 @@ def train(cfg):
 
     log(f"STATUS device={device.type} dtype={dtype}")
     log_train_config(cfg)
+    emit("config", **asdict(cfg))
     ensure_base_model_available(cfg.base_model)
     
     if cfg.cpu_offload and not cfg.cache_latents:
@@ -39,17 +50,15 @@ def train(cfg):
     if cfg.model_type != "sdxl":
         raise RuntimeError("train_lora_sdxl_v1.py supports only --model_type sdxl")
 
-    dataset, bucket_map, tag_counter, trained_words = build_dataset_buckets_and_tags(cfg)
-    steps_per_epoch = sum(
-        (len(ids) + cfg.batch_size - 1) // cfg.batch_size
-        for ids in bucket_map.values()
-    )
+    dataset, bucket_map, tag_counter, trained_words, image_sizes, captions = build_dataset_buckets_and_tags(cfg)
+    steps_per_epoch = epoch_steps(bucket_map, cfg.repeats, cfg.batch_size, cfg.tail_batches)
 
-    updates_per_epoch = (steps_per_epoch + cfg.grad_accum_steps - 1) // cfg.grad_accum_steps
-    total_opt_steps = updates_per_epoch * cfg.epochs
-    timer = ETATimer(total_steps=total_opt_steps)
+    timer = ETATimer()
 
-    unet, vae, text_encoder, text_encoder_2, tokenizer, tokenizer_2 = load_sdxl_components(cfg.base_model, device, dtype)
+    unet, vae, text_encoder, text_encoder_2, tokenizer, tokenizer_2 = load_models(
+        ("sdxl", cfg.base_model, str(dtype), str(device)),
+        lambda: load_sdxl_components(cfg.base_model, device, dtype, cfg.model_cache_gb),
+    )
 
     if cfg.gradient_checkpointing:
         unet.enable_gradient_checkpointing()
@@ -113,7 +122,7 @@ def train(cfg):
     trainable_params = list(unet_lora_params) + (list(te1_lora_params) + list(te2_lora_params) if train_clip else [])
 
     optimizer = build_optimizer(param_groups, cfg)
-    lr_scheduler, _ = build_scheduler(cfg, optimizer, len(dataset))
+    lr_scheduler, _ = build_scheduler(cfg, optimizer, steps_per_epoch)
 
     output_path = Path(cfg.output)
     output_dir = output_path.parent
@@ -132,14 +141,41 @@ def train(cfg):
         scaling_factor=scaling_factor,
     )
 
+    def encode_preview_prompt():
+        return encode_prompt_sdxl(
+            [cfg.inference_prompt], tokenizer, tokenizer_2, text_encoder, text_encoder_2, dtype
+        )
+
+    text_cache = None
+    preview_embeds = None
+    if not train_clip:
+        text_cache = build_text_embedding_cache(
+            cfg=cfg,
+            captions=captions,
+            encode_fn=lambda caps: encode_prompt_sdxl(
+                caps, tokenizer, tokenizer_2, text_encoder, text_encoder_2, dtype
+            ),
+            num_outputs=2,
+            dtype=dtype,
+        )
+        if cfg.do_inference:
+            preview_embeds = encode_preview_prompt()
+
+        # Neither encoder is needed again once every prompt is cached.
+        release_models(text_encoder, text_encoder_2)
+        text_encoder = None
+        text_encoder_2 = None
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        log("STATUS text_encoders=FREED (text embeddings cached)")
+
     if cfg.cpu_offload:
         vae.to("cpu")
         log("STATUS cpu_offload=ENABLED components=vae")
 
         if not train_clip:
-            text_encoder.to("cpu")
-            text_encoder_2.to("cpu")
-            log("STATUS cpu_offload=ENABLED components+=text_encoder,text_encoder_2")
+            log("STATUS cpu_offload=SKIPPED text_encoders (freed)")
         else:
             log("STATUS cpu_offload=PARTIAL text_encoders=GPU (train_clip=True)")
     else:
@@ -152,10 +188,13 @@ def train(cfg):
         log("WARN do_inference disabled because cpu_offload=True (preview expects GPU models)")
         cfg.do_inference = False
 
+    perf = build_step_profiler(cfg, output_dir / base_name)
+
     step = SDXLTrainStep(
         cfg=cfg,
-        dataset=dataset,
+        captions=captions,
         cached_latents_by_bucket=cached_latents_by_bucket,
+        text_cache=text_cache,
         tokenizer=tokenizer,
         tokenizer_2=tokenizer_2,
         text_encoder=text_encoder,
@@ -166,68 +205,110 @@ def train(cfg):
         device=device,
         dtype=dtype,
         scaling_factor=scaling_factor,
+        perf=perf,
     )
 
+    loader = build_train_loader(cfg, dataset, bucket_map, image_sizes)
+    log(f"STATUS data_loader workers={cfg.num_workers} prefetch={cfg.prefetch_factor}")
+
+    previews = None
+    if cfg.do_inference:
+        previews = build_preview_scheduler(cfg, device, output_dir / f"{base_name}_previews.json")
+
+    writer = CheckpointWriter()
+    text_encoders = [text_encoder, text_encoder_2] if train_clip else [None, None]
+
     def on_epoch_end(epoch, state):
+        out = None
         if cfg.save_every_epochs > 0 and epoch % cfg.save_every_epochs == 0:
             out = output_dir / f"{base_name}_epoch_{epoch}.safetensors"
             log(f"STATUS saving checkpoint: {out.name}")
             metadata = build_lora_metadata(cfg, tag_counter, trained_words)
-            save_lora_sdxl(
-                unet=unet,
-                text_encoder=text_encoder if train_clip else None,
-                text_encoder_2=text_encoder_2 if train_clip else None,
-                path=str(out),
-                metadata=metadata,
-            )
+            with perf.section("checkpoint"):
+                writer.save(unet=unet, text_encoders=text_encoders, path=out, metadata=metadata)
 
-        if cfg.do_inference:
+        if previews is not None:
+            previews.poll()
+            preview_dir = output_dir / f"{base_name}_epoch_{epoch}_preview"
+            if out is None:
+                # No checkpoint this epoch: snapshot the (small) LoRA tensors for the worker.
+                out = preview_dir / "lora.safetensors"
+                preview_dir.mkdir(parents=True, exist_ok=True)
+                writer.save(unet=unet, text_encoders=text_encoders, path=out)
+            previews.submit(epoch, out, preview_dir)
+        elif cfg.do_inference:
             preview_dir = output_dir / f"{base_name}_epoch_{epoch}_preview"
             log("STATUS inference preview (SDXL)")
-            prompt_embeds, pooled = encode_prompt_sdxl(
-                [cfg.inference_prompt], tokenizer, tokenizer_2, text_encoder, text_encoder_2, dtype
-            )
-            run_sdxl_inference_preview(
-                unet=unet,
-                vae=vae,
-                scheduler=scheduler,
-                prompt_embeds=prompt_embeds,
-                pooled_prompt_embeds=pooled,
-                output_dir=preview_dir,
-                steps=cfg.inference_steps,
-                seed=cfg.seed,
-                dtype=dtype,
-                resolution=cfg.resolution,
-            )
+            prompt_embeds, pooled = preview_embeds if preview_embeds is not None else encode_preview_prompt()
+            set_lora_training(unet, False)
+            with merged_lora(unet):
+                run_sdxl_inference_preview(
+                    unet=unet,
+                    vae=vae,
+                    scheduler=scheduler,
+                    prompt_embeds=prompt_embeds,
+                    pooled_prompt_embeds=pooled,
+                    output_dir=preview_dir,
+                    steps=cfg.inference_steps,
+                    seed=cfg.seed,
+                    dtype=dtype,
+                    resolution=cfg.resolution,
+                )
+            set_lora_training(unet, True)
+
+    state, save_state, stop = prepare_train_state(
+        cfg,
+        output_dir / f"{base_name}_state.pt",
+        trainable_params=trainable_params,
+        optimizer=optimizer,
+        lr_scheduler=lr_scheduler,
+        sampler=loader.batch_sampler,
+    )
 
     train_epochs(
         cfg=cfg,
-        dataset=dataset,
-        bucket_map=bucket_map,
+        loader=loader,
         step_fn=step,
         optimizer=optimizer,
         lr_scheduler=lr_scheduler,
         trainable_params=trainable_params,
         on_epoch_end=on_epoch_end,
         timer=timer,
+        state=state,
+        save_state=save_state,
+        stop=stop,
+        perf=perf,
     )
 
     final_out = output_dir / f"{base_name}_final.safetensors"
     log(f"STATUS saving final: {final_out.name}")
     metadata = build_lora_metadata(cfg, tag_counter, trained_words)
-    save_lora_sdxl(
-        unet=unet,
-        text_encoder=text_encoder if train_clip else None,
-        text_encoder_2=text_encoder_2 if train_clip else None,
-        path=str(final_out),
-        metadata=metadata,
-    )
+    writer.save(unet=unet, text_encoders=text_encoders, path=final_out, metadata=metadata)
+    writer.close()
 
-def main():
+    if previews is not None and previews.pending():
+        # Workers load their own copy of the model; give them the GPU memory held by training.
+        unet.to("cpu")
+        vae.to("cpu")
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        log("STATUS waiting for preview renders")
+        previews.finish()
+
+def main(argv: list[str] | None = None):
     ap = build_arg_parser(default_resolution=1024)
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
     cfg = cfg_from_args(args)
-    train(cfg)
+    open_event_stream(cfg.events_file)
+    try:
+        train(cfg)
+    except Exception as e:
+        emit("error", message=str(e), kind=type(e).__name__)
+        raise
+    else:
+        emit("done")
+    finally:
+        close_event_stream()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,192 @@
+"""
+Long-lived trainer that keeps recently used base models loaded and runs queued jobs back to
+back, so a job on the same base model skips interpreter start, imports and the model load.
+
+    python trainer/train_worker.py [--max_models 1]
+
+While it runs, launch_training() queues jobs here instead of spawning a trainer process.
+Each job writes its own train.log and events.jsonl, exactly like a one-shot run.
+"""
+import _thread
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+if str(REPO_ROOT) not in sys.path:
+    sys.path.insert(0, str(REPO_ROOT))
+
+from utils.hf_cache import setup_hf_env
+setup_hf_env()
+
+from trainer import train_sd, train_sdxl
+from trainer.train.config import log
+from trainer.train.resident import enable_resident_models, reset_resident_models
+from trainer.train.state import clear_stop_request, request_stop
+from utils.trainer_worker import QUEUE_DIR, RUNNING_DIR, stop_marker, write_heartbeat, write_job_result
+
+SCRIPTS = {"sd": train_sd, "sdxl": train_sdxl}
+
+POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 2.0
+
+class JobWatch(threading.Thread):
+    """
+    Keeps the heartbeat fresh while the main thread trains, and turns a job's stop marker
+    into a stop request: a graceful one at the next optimizer step once the run is in its
+    training loop (with a StopRequest), otherwise a KeyboardInterrupt in the main thread. The interrupt is only sent while
+    run_job has armed the watch, so it cannot land outside the job's handler.
+    """
+
+    def __init__(self):
+        super().__init__(name="job-watch", daemon=True)
+        self.lock = threading.Lock()
+        self.job_id: str | None = None
+        self.armed = False
+        self.cancelled = False
+        self.interrupted = False
+
+    def start_job(self, job_id: str) -> None:
+        with self.lock:
+            self.cancelled = False
+            self.interrupted = False
+            self.job_id = job_id
+        write_heartbeat(job_id)
+
+    def end_job(self) -> None:
+        with self.lock:
+            self.job_id = None
+        write_heartbeat(None)
+
+    def arm(self) -> None:
+        with self.lock:
+            self.armed = True
+
+    def disarm(self) -> None:
+        with self.lock:
+            self.armed = False
+
+    def run(self):
+        while True:
+            with self.lock:
+                job_id = self.job_id
+                if job_id is not None and self.armed and not self.cancelled and stop_marker(job_id).exists():
+                    self.cancelled = True
+                    if not request_stop():
+                        self.interrupted = True
+                        _thread.interrupt_main()
+            write_heartbeat(job_id)
+            time.sleep(HEARTBEAT_SECONDS)
+
+def claim_next_job() -> tuple[Path, dict] | None:
+    for p in sorted(QUEUE_DIR.glob("*.json")):
+        running = RUNNING_DIR / p.name
+        try:
+            os.replace(p, running)
+        except FileNotFoundError:
+            continue  # cancelled meanwhile
+        return running, json.loads(running.read_text(encoding="utf-8"))
+    return None
+
+def run_job(job: dict, watch: JobWatch) -> tuple[str, int | None]:
+    """Returns (status, exit code); the code is None when the job was cancelled or stopped."""
+    script = SCRIPTS[job["model_type"]]
+    prev_cwd, prev_argv = os.getcwd(), sys.argv
+    prev_sigterm = signal.getsignal(signal.SIGTERM) if hasattr(signal, "SIGTERM") else None
+    status, code = "done", 0
+
+    with open(job["log"], "w", encoding="utf-8", buffering=1) as logfile, \
+            redirect_stdout(logfile), redirect_stderr(logfile):
+        os.chdir(job["cwd"])
+        # The preview scheduler re-launches the trainer's own arguments for its worker.
+        sys.argv = [script.__file__, *job["args"]]
+        try:
+            watch.arm()
+            try:
+                script.main(job["args"])
+            finally:
+                watch.disarm()
+            if watch.interrupted:
+                # Sent just before disarm() and not delivered yet; let it land in this handler.
+                for _ in range(100):
+                    time.sleep(0.01)
+        except KeyboardInterrupt:
+            if not watch.interrupted:
+                raise
+            status, code = "cancelled", None
+            log("STATUS job cancelled")
+        except SystemExit as e:
+            if watch.cancelled:
+                status, code = "stopped", None
+            else:
+                code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+                status = "done" if code == 0 else f"exit {code}"
+        except Exception:
+            status, code = "error", 1
+            traceback.print_exc()
+        finally:
+            os.chdir(prev_cwd)
+            sys.argv = prev_argv
+            if prev_sigterm is not None:
+                signal.signal(signal.SIGTERM, prev_sigterm)
+            clear_stop_request()
+            reset_resident_models()
+    return status, code
+
+def finish_job(running: Path, job: dict, status: str, code: int | None) -> None:
+    write_job_result(job["id"], status, code)
+    running.unlink(missing_ok=True)
+    stop_marker(job["id"]).unlink(missing_ok=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max_models", type=int, default=1, help="Base model sets kept loaded between jobs")
+    args = ap.parse_args()
+
+    QUEUE_DIR.mkdir(parents=True, exist_ok=True)
+    RUNNING_DIR.mkdir(parents=True, exist_ok=True)
+    # Jobs left in running/ by a worker that died are not retried.
+    for p in RUNNING_DIR.iterdir():
+        p.unlink(missing_ok=True)
+
+    enable_resident_models(args.max_models)
+    watch = JobWatch()
+    watch.start()
+    log(f"STATUS trainer worker ready pid={os.getpid()} max_models={args.max_models}")
+
+    try:
+        while True:
+            claimed = claim_next_job()
+            if claimed is None:
+                time.sleep(POLL_SECONDS)
+                continue
+
+            running, job = claimed
+            log(f"STATUS job start id={job['id']} project={job['project']} type={job['model_type']}")
+            watch.start_job(job["id"])
+            start = time.perf_counter()
+            # What the job is recorded as if the worker itself is stopped mid-job.
+            status, code = "error", None
+            try:
+                status, code = run_job(job, watch)
+            except KeyboardInterrupt:
+                # Only a real Ctrl+C stops the worker, never a late job cancel.
+                if not watch.interrupted:
+                    raise
+                status, code = "cancelled", None
+            finally:
+                watch.end_job()
+                finish_job(running, job, status, code)
+            log(f"STATUS job end id={job['id']} status={status} time={time.perf_counter() - start:.1f}s")
+    except KeyboardInterrupt:
+        log("STATUS trainer worker stopped")
+
+if __name__ == "__main__":
+    main()
@@ -17,7 +17,8 @@ def build_default_config(project_name: str):
 
         "model": {
             "architecture": "sdxl",
-            "checkpoint": None
+            "checkpoint": None,
+            "cache_gb": 0
         },
 
         "dataset": {
@@ -33,9 +34,12 @@ def build_default_config(project_name: str):
                 "append_token": ""
             },
             "cache_latents": True,
+            "cache_batch_size": 4,
+            "num_workers": 4,
+            "tail_batches": "keep",
             "bucket": {
                 "enabled": True,
-                "min_res": 512,
+                "min_res": 256,
                 "max_res": 1536,
                 "step": 64
             }
@@ -45,6 +49,7 @@ def build_default_config(project_name: str):
             "epochs": 10,
             "save_every_epochs": 1,
             "do_inference": True,
+            "preview_mode": "auto",
             "gradient_accumulation": 1,
             "conditioning": {
                 "clip_skip": 1
@@ -80,6 +85,7 @@ def build_default_config(project_name: str):
             "gradient_checkpointing": False,
             "xformers": False,
             "cpu_offload": False,
+            "vram_budget_gb": None,
         },
 
         "logging": {
@@ -90,6 +96,8 @@ def build_default_config(project_name: str):
 
         "output": {
             "save_state": False,
+            "save_state_every": 0,
+            "resume": False,
             "save_format": "safetensors"
         },
     }
@@ -1,24 +1,40 @@
 from pathlib import Path
 
+from utils.image_index import IMAGE_SIZE_INDEX, probe_image_sizes
+
 _SUPPORTED_IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
 
 _dataset_root: Path | None = None
+_size_index_path: Path | None = None
 
-def set_dataset_root(path: str | Path):
-    global _dataset_root
+def set_dataset_root(path: str | Path, cache_dir: str | Path | None = None):
+    global _dataset_root, _size_index_path
     _dataset_root = Path(path).expanduser().resolve()
+    _size_index_path = Path(cache_dir) / IMAGE_SIZE_INDEX if cache_dir else None
 
 def list_dataset_images():
     if _dataset_root is None or not _dataset_root.exists():
         return []
 
+    paths = [
+        p for p in sorted(_dataset_root.iterdir())
+        if p.is_file() and p.suffix.lower() in _SUPPORTED_IMAGE_EXTS
+    ]
+
+    try:
+        sizes = probe_image_sizes(paths, index_path=_size_index_path)
+    except Exception:
+        sizes = {}
+
     images = []
-    for p in sorted(_dataset_root.iterdir()):
-        if p.is_file() and p.suffix.lower() in _SUPPORTED_IMAGE_EXTS:
-            images.append({
-                "name": p.name,
-                "rel_path": p.name,
-            })
+    for p in paths:
+        w, h = sizes.get(str(p), (None, None))
+        images.append({
+            "name": p.name,
+            "rel_path": p.name,
+            "width": w,
+            "height": h,
+        })
 
     return images
 
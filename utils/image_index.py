@@ -0,0 +1,142 @@
+import json
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+INDEX_VERSION = 1
+IMAGE_SIZE_INDEX = "image_sizes.json"
+DEFAULT_PROBE_WORKERS = 16
+
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def _png_size(f) -> tuple[int, int] | None:
+    head = f.read(24)
+    if len(head) < 24 or head[:8] != b"\x89PNG\r\n\x1a\n" or head[12:16] != b"IHDR":
+        return None
+    w, h = struct.unpack(">II", head[16:24])
+    return w, h
+
+def _jpeg_size(f) -> tuple[int, int] | None:
+    if f.read(2) != b"\xff\xd8":
+        return None
+    while True:
+        b = f.read(1)
+        while b and b != b"\xff":
+            b = f.read(1)
+        while b == b"\xff":
+            b = f.read(1)
+        if not b:
+            return None
+        marker = b[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            continue
+        seg = f.read(2)
+        if len(seg) < 2:
+            return None
+        seg_len = struct.unpack(">H", seg)[0]
+        if marker in _JPEG_SOF_MARKERS:
+            data = f.read(5)
+            if len(data) < 5:
+                return None
+            h, w = struct.unpack(">HH", data[1:5])
+            return w, h
+        f.seek(seg_len - 2, os.SEEK_CUR)
+
+def _webp_size(f) -> tuple[int, int] | None:
+    head = f.read(30)
+    if len(head) < 30 or head[:4] != b"RIFF" or head[8:12] != b"WEBP":
+        return None
+    chunk = head[12:16]
+    if chunk == b"VP8X":
+        w = 1 + int.from_bytes(head[24:27], "little")
+        h = 1 + int.from_bytes(head[27:30], "little")
+        return w, h
+    if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+        w, h = struct.unpack("<HH", head[26:30])
+        return w & 0x3FFF, h & 0x3FFF
+    if chunk == b"VP8L" and head[20] == 0x2F:
+        bits = int.from_bytes(head[21:25], "little")
+        return 1 + (bits & 0x3FFF), 1 + ((bits >> 14) & 0x3FFF)
+    return None
+
+def read_image_size(path: str | Path) -> tuple[int, int]:
+    """
+    Returns (width, height) by parsing only the file header.
+    Falls back to PIL for formats/variants the fast path does not understand.
+    """
+    suffix = Path(path).suffix.lower()
+    parser = {
+        ".png": _png_size,
+        ".jpg": _jpeg_size,
+        ".jpeg": _jpeg_size,
+        ".webp": _webp_size,
+    }.get(suffix)
+
+    if parser is not None:
+        try:
+            with open(path, "rb") as f:
+                size = parser(f)
+            if size is not None:
+                return size
+        except (OSError, struct.error, IndexError):
+            pass
+
+    with Image.open(path) as img:
+        return img.size
+
+def _load_index(index_path: Path | None) -> dict[str, list[int]]:
+    if index_path is None or not index_path.is_file():
+        return {}
+    try:
+        data = json.loads(index_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != INDEX_VERSION:
+        return {}
+    return data.get("entries", {})
+
+def _save_index(index_path: Path, entries: dict[str, list[int]]) -> None:
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = index_path.with_name(f"{index_path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps({"version": INDEX_VERSION, "entries": entries}), encoding="utf-8")
+    os.replace(tmp, index_path)
+
+def _probe_one(path: str, known: dict[str, list[int]]) -> list[int]:
+    st = os.stat(path)
+    entry = known.get(path)
+    if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+        return entry
+    w, h = read_image_size(path)
+    return [st.st_mtime_ns, st.st_size, w, h]
+
+def probe_image_sizes(
+    paths,
+    index_path: str | Path | None = None,
+    workers: int = DEFAULT_PROBE_WORKERS,
+) -> dict[str, tuple[int, int]]:
+    """
+    Returns {path: (width, height)} for every path, reading headers on a thread pool.
+    When index_path is given, results are cached there by (path, mtime, size).
+    """
+    index_path = Path(index_path) if index_path else None
+    originals = [str(p) for p in paths]
+    resolved = [str(Path(p).resolve()) for p in originals]
+    known = _load_index(index_path)
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        results = list(pool.map(lambda p: _probe_one(p, known), resolved))
+
+    fresh = dict(zip(resolved, results))
+
+    if index_path is not None:
+        # Entries in the probed folders that were not requested belong to deleted files.
+        probed_dirs = {os.path.dirname(p) for p in resolved}
+        merged = {p: e for p, e in known.items() if os.path.dirname(p) not in probed_dirs}
+        merged.update(fresh)
+        if merged != known:
+            _save_index(index_path, merged)
+
+    return {orig: (e[2], e[3]) for orig, e in zip(originals, results)}
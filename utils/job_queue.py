@@ -0,0 +1,352 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils.launch_training import launch_training, prepare_training
+from utils.memory_estimate import estimate_job_memory_mb
+from utils.paths import TRAINING_JOBS_PATH
+from utils.trainer_worker import cancel_job as cancel_worker_job, pop_job_result, worker_alive, worker_job_active
+
+ACTIVE = ("queued", "running")
+
+# Leave part of each device to the CUDA context of other processes and fragmentation.
+DEVICE_HEADROOM = 0.9
+
+# Finished jobs kept in the state file.
+HISTORY_LIMIT = 200
+
+def _write_json_atomic(path: Path, data) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def _lock(f, blocking: bool) -> bool:
+    """OS lock on an open file, released when it is closed or the process dies."""
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except OSError:
+        if blocking:
+            raise
+        return False
+    return True
+
+def _try_lock(path: Path):
+    """The open lock file when this process got the lock, else None."""
+    f = open(path, "a+")
+    if _lock(f, blocking=False):
+        return f
+    f.close()
+    return None
+
+@contextmanager
+def _locked(path: Path):
+    with open(path, "a+") as f:
+        _lock(f, blocking=True)
+        yield
+
+def _devices() -> list[tuple[int | None, int | None]]:
+    """(index, total MB) per GPU; a single unbounded slot when NVML is unavailable."""
+    try:
+        from pynvml import nvmlInit, nvmlDeviceGetCount, nvmlDeviceGetHandleByIndex, nvmlDeviceGetMemoryInfo
+        nvmlInit()
+        return [
+            (i, nvmlDeviceGetMemoryInfo(nvmlDeviceGetHandleByIndex(i)).total // 2**20)
+            for i in range(nvmlDeviceGetCount())
+        ] or [(None, None)]
+    except Exception:
+        return [(None, None)]
+
+def _process_alive(pid: int) -> bool:
+    if sys.platform == "win32":
+        out = subprocess.run(["tasklist", "/FI", f"PID eq {pid}"], capture_output=True, text=True).stdout
+        return str(pid) in out
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _terminate(pgid: int) -> None:
+    try:
+        if sys.platform == "win32":
+            subprocess.run(
+                ["taskkill", "/PID", str(pgid), "/T", "/F"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        else:
+            os.killpg(pgid, signal.SIGTERM)
+    except Exception:
+        pass
+
+def _worker_outcome(job: dict) -> tuple[str, int | None]:
+    """Status and exit code from the trainer worker's result record; none means it died mid-job."""
+    result = pop_job_result(job["worker_job"])
+    code = result["exit_code"] if result is not None else None
+    if job["cancel"] or (result is not None and result["status"] in ("cancelled", "stopped")):
+        return "cancelled", code
+    if result is None or code != 0:
+        return "failed", code
+    return "done", code
+
+class JobScheduler:
+    """
+    Persistent training queue. Jobs start by priority (higher first, then submission order)
+    on the first device whose running jobs plus the job's estimated footprint fit in its memory,
+    up to max_jobs_per_device at once. A job that fits nowhere holds back lower-priority ones,
+    so big runs are not starved by a stream of small ones; a lone job always gets an idle device.
+
+    While the trainer worker is up, jobs go to it instead and it counts as a single slot,
+    since it runs one job at a time on its own device.
+
+    State lives in training_jobs.json, so the queue survives an app restart; runs started
+    before the restart are tracked by pid until they exit. Every app process (reloader,
+    several server workers) may submit, cancel and read through the file under a lock, but
+    only the one holding the scheduler lock file starts jobs; another takes over if it exits.
+    """
+
+    def __init__(self, state_path: Path = TRAINING_JOBS_PATH, max_jobs_per_device: int = 2, interval: float = 2.0):
+        self.state_path = state_path
+        self.state_lock_path = state_path.with_name(f"{state_path.name}.lock")
+        self.owner_lock_path = state_path.with_name(f"{state_path.stem}.scheduler.lock")
+        self.max_jobs_per_device = max(max_jobs_per_device, 1)
+        self.interval = interval
+        self.lock = threading.RLock()
+        self.processes: dict[str, subprocess.Popen] = {}
+        self.devices = _devices()
+        self.jobs: list[dict] = []
+        self.owner = None
+        self.thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="job-scheduler", daemon=True)
+            self.thread.start()
+
+    @contextmanager
+    def _update(self):
+        """Reloads the shared state, lets the caller change self.jobs and writes it back."""
+        with self.lock, _locked(self.state_lock_path):
+            self.jobs = self._load()
+            yield
+            self._save()
+
+    def _refresh(self) -> None:
+        self.jobs = self._load()
+
+    def submit(self, project: str, priority: int = 0) -> dict:
+        """Validates the project now (raising config errors to the caller) and queues it."""
+        run = prepare_training(project)
+        with self._update():
+            if self._active(project) is not None:
+                raise RuntimeError(f"Project '{project}' already has a queued or running job")
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "project": project,
+                "priority": int(priority),
+                "status": "queued",
+                "est_mem_mb": estimate_job_memory_mb(run["config"]),
+                "device": None,
+                "pgid": None,
+                "worker_job": None,
+                "cancel": False,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+                "exit_code": None,
+            }
+            self.jobs.append(job)
+        self.tick()
+        return job
+
+    def cancel(self, job_id: str) -> None:
+        with self._update():
+            job = self._find(job_id)
+            if job is None or job["status"] not in ACTIVE:
+                return
+            if job["status"] == "queued":
+                self._finish(job, "cancelled")
+            else:
+                job["cancel"] = True
+                if job["worker_job"]:
+                    cancel_worker_job(job["worker_job"])
+                elif job["pgid"]:
+                    _terminate(job["pgid"])
+
+    def cancel_project(self, project: str) -> None:
+        job = self.active_job(project)
+        if job is not None:
+            self.cancel(job["id"])
+
+    def active_job(self, project: str) -> dict | None:
+        with self.lock:
+            self._refresh()
+            return self._active(project)
+
+    def project_status(self, project: str) -> str:
+        job = self.active_job(project)
+        return job["status"] if job is not None else "idle"
+
+    def queue_position(self, job_id: str) -> int | None:
+        with self.lock:
+            self._refresh()
+            queued = self._queued()
+            return next((i + 1 for i, j in enumerate(queued) if j["id"] == job_id), None)
+
+    def list_jobs(self, limit: int = 50) -> list[dict]:
+        with self.lock:
+            self._refresh()
+            active = [j for j in self.jobs if j["status"] in ACTIVE]
+            past = [j for j in self.jobs if j["status"] not in ACTIVE][-limit:]
+            return [dict(j) for j in active + past]
+
+    def tick(self) -> None:
+        """Reaps finished runs and starts what fits; a no-op outside the scheduling process."""
+        if self.owner is None:
+            return
+        with self.lock, _locked(self.state_lock_path):
+            self._refresh()
+            changed = self._reap()
+            changed |= self._schedule()
+            if changed:
+                self._save()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                if self.owner is None:
+                    self.owner = _try_lock(self.owner_lock_path)
+                    if self.owner is not None:
+                        print(f"[QUEUE] scheduler running in pid {os.getpid()}")
+                self.tick()
+            except Exception as e:
+                print(f"[QUEUE] scheduler error: {e}")
+            time.sleep(self.interval)
+
+    def _reap(self) -> bool:
+        changed = False
+        for job in self.jobs:
+            if job["status"] != "running":
+                continue
+            if job["worker_job"]:
+                if worker_job_active(job["worker_job"]):
+                    continue
+                status, code = _worker_outcome(job)
+            else:
+                proc = self.processes.get(job["id"])
+                if proc is not None:
+                    code = proc.poll()
+                    if code is None:
+                        continue
+                    del self.processes[job["id"]]
+                elif _process_alive(job["pgid"]):
+                    continue
+                else:
+                    code = None  # started before an app restart; exit code unknown
+                status = "cancelled" if job["cancel"] else "failed" if code not in (0, None) else "done"
+            job["exit_code"] = code
+            self._finish(job, status)
+            changed = True
+        return changed
+
+    def _schedule(self) -> bool:
+        changed = False
+        use_worker = worker_alive()
+        for job in self._queued():
+            if use_worker:
+                if any(j["status"] == "running" and j["worker_job"] for j in self.jobs):
+                    break
+                device = None  # the worker runs on whatever device it was started on
+            else:
+                slot = self._pick_device(job)
+                if slot is None:
+                    break
+                device = self.devices[slot][0]
+            self._launch(job, device)
+            changed = True
+        return changed
+
+    def _pick_device(self, job: dict) -> int | None:
+        """Position in self.devices of the first device the job fits on."""
+        for slot, (index, total_mb) in enumerate(self.devices):
+            running = [j for j in self.jobs if j["status"] == "running" and j["device"] == index]
+            if not running:
+                return slot
+            if len(running) >= self.max_jobs_per_device or total_mb is None:
+                continue
+            if sum(j["est_mem_mb"] for j in running) + job["est_mem_mb"] <= total_mb * DEVICE_HEADROOM:
+                return slot
+        return None
+
+    def _launch(self, job: dict, device: int | None) -> None:
+        try:
+            handle = launch_training(job["project"], device=device)
+        except Exception as e:
+            print(f"[QUEUE] job {job['id']} ({job['project']}) failed to start: {e}")
+            self._finish(job, "failed")
+            return
+        job["status"] = "running"
+        job["device"] = device
+        job["started"] = time.time()
+        if "worker_job" in handle:
+            job["worker_job"] = handle["worker_job"]
+        else:
+            job["pgid"] = handle["pgid"]
+            self.processes[job["id"]] = handle["process"]
+        print(f"[QUEUE] started job {job['id']} ({job['project']}) device={device} est={job['est_mem_mb']}MB")
+
+    def _active(self, project: str) -> dict | None:
+        return next((j for j in self.jobs if j["project"] == project and j["status"] in ACTIVE), None)
+
+    def _queued(self) -> list[dict]:
+        queued = [j for j in self.jobs if j["status"] == "queued"]
+        return sorted(queued, key=lambda j: (-j["priority"], j["submitted"]))
+
+    def _find(self, job_id: str) -> dict | None:
+        return next((j for j in self.jobs if j["id"] == job_id), None)
+
+    def _finish(self, job: dict, status: str) -> None:
+        job["status"] = status
+        job["finished"] = time.time()
+
+    def _load(self) -> list[dict]:
+        if not self.state_path.is_file():
+            return []
+        return json.loads(self.state_path.read_text(encoding="utf-8"))
+
+    def _save(self) -> None:
+        past = [j for j in self.jobs if j["status"] not in ACTIVE]
+        if len(past) > HISTORY_LIMIT:
+            drop = {j["id"] for j in past[:-HISTORY_LIMIT]}
+            self.jobs = [j for j in self.jobs if j["id"] not in drop]
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        _write_json_atomic(self.state_path, self.jobs)
+
+_scheduler: JobScheduler | None = None
+
+def get_scheduler() -> JobScheduler:
+    """This process's view of the queue; start_scheduler() runs it at app startup."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler()
+    return _scheduler
+
+def start_scheduler() -> JobScheduler:
+    scheduler = get_scheduler()
+    scheduler.start()
+    return scheduler
@@ -14,6 +14,7 @@ from utils.paths import (
 )
 
 from utils.trainer_cli_adapter import build_train_lora_cli_args
+from utils.trainer_worker import submit_job, worker_alive
 from utils.hf_cache import setup_hf_env
 
 setup_hf_env
@@ -24,7 +25,8 @@ class TrainingConfigError(Exception):
     """Fatal configuration error that should never occur if Save validation is correct."""
     pass
 
-def launch_training(project_name: str):
+def prepare_training(project_name: str) -> dict:
+    """Validates the project and builds the trainer command; raises before anything is started."""
     proj_dir = project_dir(project_name)
     config_path = proj_dir / "config.yaml"
 
@@ -70,12 +72,45 @@ def launch_training(project_name: str):
     if not trainer_script.exists():
         raise FileNotFoundError(f"Trainer not found: {trainer_script}")
 
-    cmd = ["python", str(trainer_script), *args]
+    return {
+        "config": config,
+        "model_type": model_type,
+        "args": args,
+        "cmd": ["python", str(trainer_script), *args],
+        "proj_dir": proj_dir,
+        "log_path": log_dir / "train.log",
+    }
+
+def launch_training(project_name: str, device: int | None = None) -> dict:
+    """
+    Starts a prepared run and returns how to track it: {"worker_job": id} when handed to a
+    running trainer worker, else {"process": Popen, "pgid": int}. device pins the run to one GPU.
+    """
+    run = prepare_training(project_name)
+    proj_dir = run["proj_dir"]
+
+    if worker_alive():
+        # A running trainer/train_worker.py keeps base models loaded between jobs.
+        job_id = submit_job(
+            project=project_name,
+            model_type=run["model_type"],
+            args=run["args"],
+            cwd=proj_dir,
+            log_path=run["log_path"],
+        )
+        print(f"[TRAIN] Training queued on trainer worker (job {job_id})")
+        return {"worker_job": job_id}
+
+    cmd = run["cmd"]
 
     print("[TRAIN] Launching training:")
     print(" ".join(shlex.quote(c) for c in cmd))
 
-    logfile = open(log_dir / "train.log", "w")
+    run_env = env.copy()
+    if device is not None:
+        run_env["CUDA_VISIBLE_DEVICES"] = str(device)
+
+    logfile = open(run["log_path"], "w")
 
     if sys.platform == "win32":
         process = subprocess.Popen(
@@ -83,7 +118,7 @@ def launch_training(project_name: str):
             stdout=logfile,
             stderr=subprocess.STDOUT,
             creationflags=subprocess.CREATE_NEW_PROCESS_GROUP,
-            env=env,
+            env=run_env,
             cwd=str(proj_dir),
         )
         pgid = process.pid
@@ -93,12 +128,10 @@ def launch_training(project_name: str):
             stdout=logfile,
             stderr=subprocess.STDOUT,
             preexec_fn=os.setsid,
-            env=env,
+            env=run_env,
             cwd=str(proj_dir),
         )
         pgid = os.getpgid(process.pid)
 
-    pid_file = proj_dir / "training.pid"
-    pid_file.write_text(str(pgid))
-
     print(f"[TRAIN] Training started (PGID {pgid})")
+    return {"process": process, "pgid": pgid}
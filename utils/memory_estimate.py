@@ -0,0 +1,307 @@
+"""
+Peak VRAM estimate for a training config, and the largest batch size that fits a budget.
+
+Parameter counts come from the reference architectures built on the meta device (no weights,
+no download); activations from a per-block model of the UNet at the largest bucket. Runs on
+CPU-only hosts; without torch/diffusers it falls back to stored parameter counts.
+"""
+from functools import lru_cache
+
+from utils.trainer_cli_adapter import BUCKET_DEFAULTS
+
+BYTES_PER_PARAM = {"fp32": 4, "fp16": 2, "bf16": 2}
+
+# Optimizer state tensors per trainable parameter.
+OPTIMIZER_STATES = {"adamw": 2, "adam": 2, "sgd": 1}
+
+# Same architectures as SD15_REF / SDXL_REF in the trainer, spelled out so nothing is fetched.
+UNET_CONFIGS = {
+    "sd": {
+        "sample_size": 64,
+        "block_out_channels": [320, 640, 1280, 1280],
+        "down_block_types": ["CrossAttnDownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D", "DownBlock2D"],
+        "up_block_types": ["UpBlock2D", "CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "CrossAttnUpBlock2D"],
+        "layers_per_block": 2,
+        "transformer_layers_per_block": 1,
+        "cross_attention_dim": 768,
+        "attention_head_dim": 8,
+    },
+    "sdxl": {
+        "sample_size": 128,
+        "block_out_channels": [320, 640, 1280],
+        "down_block_types": ["DownBlock2D", "CrossAttnDownBlock2D", "CrossAttnDownBlock2D"],
+        "up_block_types": ["CrossAttnUpBlock2D", "CrossAttnUpBlock2D", "UpBlock2D"],
+        "layers_per_block": 2,
+        "transformer_layers_per_block": [1, 2, 10],
+        "cross_attention_dim": 2048,
+        "attention_head_dim": [5, 10, 20],
+        "use_linear_projection": True,
+        "addition_embed_type": "text_time",
+        "addition_time_embed_dim": 256,
+        "projection_class_embeddings_input_dim": 2816,
+    },
+}
+
+_CLIP_L = {"hidden_size": 768, "intermediate_size": 3072, "num_hidden_layers": 12, "num_attention_heads": 12, "hidden_act": "quick_gelu"}
+_CLIP_BIGG = {"hidden_size": 1280, "intermediate_size": 5120, "num_hidden_layers": 32, "num_attention_heads": 20, "hidden_act": "gelu"}
+TEXT_ENCODER_CONFIGS = {"sd": [_CLIP_L], "sdxl": [_CLIP_L, _CLIP_BIGG]}
+
+VAE_CONFIG = {
+    "block_out_channels": [128, 256, 512, 512],
+    "down_block_types": ["DownEncoderBlock2D"] * 4,
+    "up_block_types": ["UpDecoderBlock2D"] * 4,
+    "layers_per_block": 2,
+    "latent_channels": 4,
+}
+
+# (unet, text encoders, vae) parameter counts when the models cannot be built.
+FALLBACK_PARAMS = {
+    "sd": (859_520_964, [123_060_480], 83_653_863),
+    "sdxl": (2_567_463_684, [123_060_480, 694_659_840], 83_653_863),
+}
+
+DEFAULT_TARGET_MODULES = ["to_q", "to_k", "to_v", "to_out.0"]
+DEFAULT_TE_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "out_proj"]
+
+# Elements kept for backward per channel per latent pixel: a ResnetBlock2D (norms, SiLUs, convs,
+# residual) and one BasicTransformerBlock (norms, self/cross attention, GEGLU feed-forward).
+# Rough fits to measured SD1.5/SDXL training peaks with SDPA attention.
+RESNET_FACTOR = 16
+TRANSFORMER_FACTOR = 60
+CLIP_LAYER_FACTOR = 30
+# Kept per checkpointed layer with gradient checkpointing (input, residual, norm statistics).
+CHECKPOINT_FACTOR = 4
+# VAE encoder peak (no grad) per image pixel, when latents are not cached.
+VAE_ENCODE_FACTOR = 512
+
+# CUDA context and kernels, plus allocator fragmentation on top of live tensors.
+CONTEXT_MB = 800
+FRAGMENTATION = 1.15
+
+MAX_PLANNED_BATCH = 64
+
+def config_model_type(config: dict) -> str:
+    arch = config.get("model", {}).get("architecture", "sdxl")
+    return "sdxl" if arch == "sdxl" else "sd"
+
+def _per_level(value, levels: int) -> list:
+    return list(value) if isinstance(value, (list, tuple)) else [value] * levels
+
+def _max_bucket_pixels(resolution: int, bucket: dict) -> int:
+    """Largest bucket area, mirroring build_bucket_resolutions in trainer/train/buckets.py."""
+    if not bucket.get("enabled", False):
+        return resolution * resolution
+    step = int(bucket.get("step", BUCKET_DEFAULTS["step"]))
+    lo = -(-int(bucket.get("min_res", BUCKET_DEFAULTS["min_res"])) // step) * step
+    hi = (int(bucket.get("max_res", BUCKET_DEFAULTS["max_res"])) // step) * step
+    best = 0
+    for w in range(lo, hi + 1, step):
+        h = min(hi, (resolution * resolution // w) // step * step)
+        if h >= lo:
+            best = max(best, w * h)
+    return best or resolution * resolution
+
+@lru_cache(maxsize=None)
+def _model_params(model_type: str, unet_targets: tuple[str, ...], te_targets: tuple[str, ...]) -> dict:
+    """Parameter counts from the architectures built on the meta device."""
+    try:
+        import torch.nn as nn
+        from accelerate import init_empty_weights
+        from diffusers import AutoencoderKL, UNet2DConditionModel
+        from transformers import CLIPTextConfig, CLIPTextModel
+    except ImportError:
+        return _fallback_params(model_type, unet_targets, te_targets)
+
+    def lora_params(module, targets) -> int:
+        return sum(
+            m.in_features + m.out_features
+            for name, m in module.named_modules()
+            if isinstance(m, nn.Linear) and any(name.endswith(t) for t in targets)
+        )
+
+    with init_empty_weights():
+        unet = UNet2DConditionModel(**UNET_CONFIGS[model_type])
+        tes = [CLIPTextModel(CLIPTextConfig(**c)) for c in TEXT_ENCODER_CONFIGS[model_type]]
+        vae = AutoencoderKL(**VAE_CONFIG)
+
+    return {
+        "unet": sum(p.numel() for p in unet.parameters()),
+        "text_encoders": [sum(p.numel() for p in te.parameters()) for te in tes],
+        "vae": sum(p.numel() for p in vae.parameters()),
+        # Per unit of rank.
+        "lora_unet": lora_params(unet, unet_targets),
+        "lora_te": sum(lora_params(te, te_targets) for te in tes),
+    }
+
+def _fallback_params(model_type: str, unet_targets, te_targets) -> dict:
+    """Stored counts; LoRA size is exact for attention projections and ignores other targets."""
+    unet, tes, vae = FALLBACK_PARAMS[model_type]
+    cfg = UNET_CONFIGS[model_type]
+    d = cfg["cross_attention_dim"]
+    lora_unet = 0
+    for c, layers, t in _attention_layers(cfg):
+        per_layer = {
+            "to_q": 4 * c,           # self + cross attention, c -> c
+            "to_k": 2 * c + d + c,   # self c -> c, cross d -> c
+            "to_v": 2 * c + d + c,
+            "to_out.0": 4 * c,
+        }
+        lora_unet += layers * t * sum(v for k, v in per_layer.items() if k in unet_targets)
+    lora_te = sum(
+        te["num_hidden_layers"] * 2 * te["hidden_size"] * sum(1 for t in DEFAULT_TE_TARGET_MODULES if t in te_targets)
+        for te in TEXT_ENCODER_CONFIGS[model_type]
+    )
+    return {"unet": unet, "text_encoders": list(tes), "vae": vae, "lora_unet": lora_unet, "lora_te": lora_te}
+
+def _attention_layers(cfg: dict) -> list[tuple[int, int, int]]:
+    """(channels, transformer blocks, layers per block) at each UNet level, down + up + mid."""
+    channels = cfg["block_out_channels"]
+    levels = len(channels)
+    depth = _per_level(cfg["transformer_layers_per_block"], levels)
+    n = cfg["layers_per_block"]
+    out = []
+    for i, kind in enumerate(cfg["down_block_types"]):
+        if "CrossAttn" in kind:
+            out.append((channels[i], n, depth[i]))
+    for i, kind in enumerate(cfg["up_block_types"]):
+        level = levels - 1 - i
+        if "CrossAttn" in kind:
+            out.append((channels[level], n + 1, depth[level]))
+    out.append((channels[-1], 1, depth[-1]))
+    return out
+
+def unet_activation_elements(model_type: str, pixels: int, gradient_checkpointing: bool) -> int:
+    """Elements saved for backward per sample, for an image of the given pixel count."""
+    cfg = UNET_CONFIGS[model_type]
+    channels = cfg["block_out_channels"]
+    levels = len(channels)
+    depth = _per_level(cfg["transformer_layers_per_block"], levels)
+    n = cfg["layers_per_block"]
+    latent = pixels / 64  # VAE downsamples 8x per side
+
+    # (channels, latent pixels, resnets, transformer layers) per level, down + up, and the mid block.
+    blocks = []
+    for i in range(levels):
+        hw = latent / 4**i
+        attn = "CrossAttn" in cfg["down_block_types"][i]
+        resnets = n + (n + 1)
+        layers = resnets * depth[i] if attn else 0
+        blocks.append((channels[i], hw, resnets, layers))
+    blocks.append((channels[-1], latent / 4 ** (levels - 1), 2, depth[-1]))
+
+    full = sum(c * hw * (r * RESNET_FACTOR + t * TRANSFORMER_FACTOR) for c, hw, r, t in blocks)
+    if not gradient_checkpointing:
+        return int(full)
+
+    # Checkpointed: the boundary tensors of each resnet/transformer layer, plus the largest
+    # single layer recomputed during backward.
+    boundaries = sum(c * hw * (r + t) * CHECKPOINT_FACTOR for c, hw, r, t in blocks)
+    largest = max(c * hw * (TRANSFORMER_FACTOR if t else RESNET_FACTOR) for c, hw, r, t in blocks)
+    return int(boundaries + largest)
+
+def estimate_peak_memory(config: dict, batch_size: int | None = None) -> dict:
+    """Peak VRAM in MB for the config (at batch_size if given), with a breakdown."""
+    model_type = config_model_type(config)
+    dataset = config.get("dataset", {})
+    precision = config.get("precision", {})
+    lora = config.get("lora", {})
+    training = config.get("training", {})
+
+    batch = max(int(batch_size if batch_size is not None else dataset.get("batch_size", 1)), 1)
+    resolution = int(dataset.get("resolution", 1024 if model_type == "sdxl" else 512))
+    pixels = _max_bucket_pixels(resolution, dataset.get("bucket", {}))
+    nbytes = BYTES_PER_PARAM.get(precision.get("mixed_precision", "fp16"), 2)
+    grad_ckpt = bool(precision.get("gradient_checkpointing", False))
+    cpu_offload = bool(precision.get("cpu_offload", False))
+    cache_latents = bool(dataset.get("cache_latents", False))
+    train_clip = float(training.get("learning_rates", {}).get("clip", 0) or 0) > 0
+    rank = int(lora.get("rank", 8))
+
+    targets = lora.get("target_modules")
+    if isinstance(targets, str):
+        targets = None if targets.lower() == "auto" else [t.strip() for t in targets.split(",") if t.strip()]
+    unet_targets = tuple(targets or DEFAULT_TARGET_MODULES)
+    params = _model_params(model_type, unet_targets, tuple(DEFAULT_TE_TARGET_MODULES))
+
+    mb = 2**20
+    weights_unet = params["unet"] * nbytes / mb
+    weights_te = sum(params["text_encoders"]) * nbytes / mb
+    weights_vae = params["vae"] * nbytes / mb
+
+    lora_count = params["lora_unet"] * rank + (params["lora_te"] * rank if train_clip else 0)
+    states = OPTIMIZER_STATES.get(str(config.get("optimizer", {}).get("type", "adamw")).lower(), 2)
+    lora_mb = lora_count * nbytes * (2 + states) / mb  # params, grads, optimizer states
+
+    activations = unet_activation_elements(model_type, pixels, grad_ckpt) * batch * nbytes / mb
+    if train_clip:
+        activations += sum(
+            77 * te["hidden_size"] * te["num_hidden_layers"] * CLIP_LAYER_FACTOR
+            for te in TEXT_ENCODER_CONFIGS[model_type]
+        ) * batch * nbytes / mb
+    vae_encode = 0.0 if cache_latents else pixels * VAE_ENCODE_FACTOR * batch * nbytes / mb
+
+    # Text encoders are freed once captions are cached unless CLIP is trained; the VAE leaves
+    # the GPU with cpu_offload (which requires cached latents).
+    resident = weights_unet + lora_mb
+    if train_clip:
+        resident += weights_te
+    if not cpu_offload:
+        resident += weights_vae
+
+    # The step's VAE encode finishes before the UNet forward starts, so only the larger counts.
+    training_peak = resident + max(activations, vae_encode)
+    loading_peak = weights_unet + weights_te + weights_vae
+    peak = max(training_peak, loading_peak) * FRAGMENTATION + CONTEXT_MB
+
+    return {
+        "peak_mb": int(peak),
+        "batch_size": batch,
+        "max_bucket_pixels": pixels,
+        "breakdown_mb": {
+            "unet": int(weights_unet),
+            "text_encoders": int(weights_te),
+            "vae": int(weights_vae),
+            "lora_and_optimizer": int(lora_mb),
+            "activations": int(activations),
+            "vae_encode": int(vae_encode),
+            "context": CONTEXT_MB,
+        },
+    }
+
+def plan_batch_size(config: dict, budget_mb: int) -> dict:
+    """
+    Largest batch size that fits budget_mb, and the accumulation that keeps the configured
+    effective batch (batch_size * gradient_accumulation) with it.
+    """
+    current = estimate_peak_memory(config)
+    batch = current["batch_size"]
+    accum = max(int(config.get("training", {}).get("gradient_accumulation", 1)), 1)
+    effective = batch * accum
+
+    max_batch = 0
+    for b in range(1, MAX_PLANNED_BATCH + 1):
+        if estimate_peak_memory(config, b)["peak_mb"] > budget_mb:
+            break
+        max_batch = b
+
+    plan = {"budget_mb": budget_mb, "current": current, "max_batch_size": max_batch}
+    if max_batch == 0:
+        plan["recommended"] = None
+    elif batch <= max_batch:
+        plan["recommended"] = {"batch_size": batch, "gradient_accumulation": accum}
+    else:
+        b = max(d for d in range(1, max_batch + 1) if effective % d == 0)
+        plan["recommended"] = {"batch_size": b, "gradient_accumulation": effective // b}
+    return plan
+
+def estimate_job_memory_mb(config: dict) -> int:
+    return estimate_peak_memory(config)["peak_mb"]
+
+def device_budget_mb() -> int | None:
+    """Total memory of GPU 0 via NVML, or None on hosts without one."""
+    try:
+        from pynvml import nvmlInit, nvmlDeviceGetHandleByIndex, nvmlDeviceGetMemoryInfo
+        nvmlInit()
+        return int(nvmlDeviceGetMemoryInfo(nvmlDeviceGetHandleByIndex(0)).total // 2**20)
+    except Exception:
+        return None
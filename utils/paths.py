@@ -15,6 +15,9 @@ LORAS_DIR       = MODELS_DIR / "loras"
 
 PROJECTS_DIR = REPO_ROOT / "projects"
 
+TRAINER_WORKER_DIR = REPO_ROOT / ".trainer_worker"
+TRAINING_JOBS_PATH = REPO_ROOT / "training_jobs.json"
+
 def project_dir(project_name: str) -> Path:
     return PROJECTS_DIR / project_name
 
@@ -24,6 +27,9 @@ def project_dataset_dir(project_name: str) -> Path:
 def project_output_dir(project_name: str) -> Path:
     return project_dir(project_name) / "output"
 
+def project_cache_dir(project_name: str) -> Path:
+    return project_dir(project_name) / "cache"
+
 def project_config_path(project_name: str) -> Path:
     return project_dir(project_name) / "config.yaml"
 
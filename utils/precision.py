@@ -13,6 +13,19 @@ def apply(form, config, issues):
     precision["xformers"] = "xformers" in form
     precision["cpu_offload"] = "cpu_offload" in form
 
+    budget = form.get("vram_budget_gb", "").strip()
+    if budget == "":
+        precision["vram_budget_gb"] = None
+    else:
+        try:
+            precision["vram_budget_gb"] = float(budget)
+        except ValueError:
+            issues.append({
+                "field": "vram_budget_gb",
+                "level": "fatal",
+                "message": "VRAM budget must be a number of GB (or empty to use the GPU's size). Value has been reverted."
+            })
+
     if precision.get("xformers"):
         try:
             import xformers
@@ -1,3 +1,7 @@
+from trainer.train.buckets import build_bucket_resolutions
+from utils.memory_estimate import config_model_type, device_budget_mb, plan_batch_size
+from utils.trainer_cli_adapter import BUCKET_DEFAULTS
+
 def analyze_training_risk(training):
     issues = []
 
@@ -72,3 +76,75 @@ def analyze_training_risk(training):
         })
 
     return issues
+
+def memory_budget_mb(config):
+    """precision.vram_budget_gb when set (e.g. on a CPU-only admin host), else GPU 0's size."""
+    budget_gb = config.get("precision", {}).get("vram_budget_gb")
+    if budget_gb:
+        return int(float(budget_gb) * 1024)
+    return device_budget_mb()
+
+def analyze_memory_risk(config):
+    budget = memory_budget_mb(config)
+    if budget is None:
+        return []
+
+    plan = plan_batch_size(config, budget)
+    peak = plan["current"]["peak_mb"]
+    if peak <= budget:
+        return []
+
+    message = (
+        f"Estimated peak VRAM {peak / 1024:.1f} GB exceeds the "
+        f"{budget / 1024:.1f} GB budget at batch size {plan['current']['batch_size']}. "
+    )
+    rec = plan["recommended"]
+    if rec is None:
+        precision = config.get("precision", {})
+        options = [
+            label for label, enabled in (
+                ("enable gradient checkpointing", precision.get("gradient_checkpointing")),
+                ("cache latents", config.get("dataset", {}).get("cache_latents")),
+                ("enable CPU offload", precision.get("cpu_offload")),
+            )
+            if not enabled
+        ] + ["lower the resolution"]
+        suggestion = options[0] if len(options) == 1 else f"{', '.join(options[:-1])} or {options[-1]}"
+        message += f"Even batch size 1 does not fit; {suggestion}."
+    else:
+        message += (
+            f"Largest batch size that fits: {plan['max_batch_size']}. "
+            f"Try batch size {rec['batch_size']} with gradient accumulation {rec['gradient_accumulation']} "
+            "for the same effective batch."
+        )
+
+    return [{
+        "field": "batch_size",
+        "level": "warn",
+        "message": message,
+    }]
+
+def analyze_bucket_risk(config):
+    """Bucketing that is enabled but leaves a single square bucket, as the trainer would build it."""
+    dataset = config.get("dataset", {})
+    bucket = dataset.get("bucket", {})
+    if not bucket.get("enabled", False):
+        return []
+
+    resolution = int(dataset.get("resolution", 1024 if config_model_type(config) == "sdxl" else 512))
+    min_res = int(bucket.get("min_res", BUCKET_DEFAULTS["min_res"]))
+    max_res = int(bucket.get("max_res", BUCKET_DEFAULTS["max_res"]))
+    step = int(bucket.get("step", BUCKET_DEFAULTS["step"]))
+    buckets = build_bucket_resolutions(resolution, min_res, max_res, step)
+    if len(buckets) > 1:
+        return []
+
+    return [{
+        "field": "bucket_min_res",
+        "level": "warn",
+        "message": (
+            f"Only one bucket ({buckets[0][0]}x{buckets[0][1]}) fits min_res {min_res} at resolution "
+            f"{resolution}, so aspect-ratio bucketing has no effect. "
+            f"Lower Min Res (e.g. {resolution // 2}) to get non-square buckets."
+        ),
+    }]
@@ -1,5 +1,8 @@
 from pathlib import Path
-from utils.paths import project_output_dir
+from utils.paths import project_output_dir, project_cache_dir
+
+# Defaults for dataset.bucket; min_res leaves room for 1:4 buckets at SD's 512**2 area.
+BUCKET_DEFAULTS = {"min_res": 256, "max_res": 1536, "step": 64}
 
 
 def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
@@ -10,7 +13,11 @@ def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
     lora = config["lora"]
     precision = config["precision"]
 
-    dataset_path = project_dir / Path(dataset["path"])
+    dataset_format = dataset.get("format", "folder")
+    if dataset_format == "shards":
+        dataset_path = project_dir / Path(dataset.get("shards_path", "dataset_shards"))
+    else:
+        dataset_path = project_dir / Path(dataset["path"])
     captions = dataset.get("captions", {})
     caption_ext = captions.get("extension", ".txt")
 
@@ -50,8 +57,10 @@ def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
     args = [
         "--model_type", model_type,
         "--base_model", base_model,
+        "--model_cache_gb", str(model.get("cache_gb", 0)),
         "--dataset", str(dataset_path),
         "--caption_ext", caption_ext,
+        "--dataset_format", dataset_format,
         "--resolution", str(dataset["resolution"]),
         "--batch_size", str(dataset["batch_size"]),
         "--epochs", str(training["epochs"]),
@@ -98,9 +107,9 @@ def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
     if bucket.get("enabled", False):
         args.append("--bucket")
         args += [
-            "--bucket_min_res", str(bucket.get("min_res", 512)),
-            "--bucket_max_res", str(bucket.get("max_res", 1536)),
-            "--bucket_step", str(bucket.get("step", 64)),
+            "--bucket_min_res", str(bucket.get("min_res", BUCKET_DEFAULTS["min_res"])),
+            "--bucket_max_res", str(bucket.get("max_res", BUCKET_DEFAULTS["max_res"])),
+            "--bucket_step", str(bucket.get("step", BUCKET_DEFAULTS["step"])),
         ]
 
     if precision.get("gradient_checkpointing", False):
@@ -123,6 +132,12 @@ def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
 
     if dataset.get("cache_latents", False):
         args.append("--cache_latents")
+        args += ["--cache_batch_size", str(dataset.get("cache_batch_size", 4))]
+
+    args += ["--num_workers", str(dataset.get("num_workers", 4))]
+    args += ["--tail_batches", str(dataset.get("tail_batches", "keep"))]
+    args += ["--cache_dir", str(project_cache_dir(project["name"]))]
+    args += ["--events_file", str(project_dir / "logs" / "events.jsonl")]
 
     ga = training.get("gradient_accumulation", 1)
     args += ["--grad_accum_steps", str(int(ga))]
@@ -133,6 +148,7 @@ def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
             "--inference_prompt", training.get("inference_prompt", "portrait photo, high quality"),
             "--inference_steps", str(training.get("inference_steps", 20)),
             "--inference_images", str(training.get("inference_images", 2)),
+            "--preview_mode", str(training.get("preview_mode", "auto")),
         ]
 
     conditioning = training.get("conditioning", {})
@@ -158,4 +174,11 @@ def build_train_lora_cli_args(config: dict, project_dir: Path) -> list[str]:
     if precision.get("cpu_offload"):
         args.append("--cpu_offload")
 
+    output = config.get("output", {})
+    if output.get("save_state", False):
+        args.append("--save_state")
+        args += ["--save_state_every", str(output.get("save_state_every", 0))]
+    if output.get("resume", False):
+        args.append("--resume")
+
     return args
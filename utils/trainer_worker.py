@@ -0,0 +1,82 @@
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+
+from utils.paths import TRAINER_WORKER_DIR
+
+QUEUE_DIR = TRAINER_WORKER_DIR / "queue"
+RUNNING_DIR = TRAINER_WORKER_DIR / "running"
+RESULTS_DIR = TRAINER_WORKER_DIR / "results"
+HEARTBEAT_PATH = TRAINER_WORKER_DIR / "heartbeat.json"
+
+# The worker refreshes its heartbeat every couple of seconds, even mid-job.
+HEARTBEAT_TIMEOUT = 15.0
+
+def _write_json_atomic(path: Path, data: dict) -> None:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+def write_heartbeat(job_id: str | None) -> None:
+    TRAINER_WORKER_DIR.mkdir(parents=True, exist_ok=True)
+    _write_json_atomic(HEARTBEAT_PATH, {"pid": os.getpid(), "time": time.time(), "job": job_id})
+
+def worker_alive() -> bool:
+    try:
+        beat = json.loads(HEARTBEAT_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return time.time() - beat.get("time", 0) < HEARTBEAT_TIMEOUT
+
+def submit_job(*, project: str, model_type: str, args: list[str], cwd: Path, log_path: Path) -> str:
+    """Queues a training run for the worker; jobs run in submission order. Returns the job id."""
+    QUEUE_DIR.mkdir(parents=True, exist_ok=True)
+    job_id = uuid.uuid4().hex[:12]
+    job = {
+        "id": job_id,
+        "project": project,
+        "model_type": model_type,
+        "args": args,
+        "cwd": str(cwd),
+        "log": str(log_path),
+        "submitted": time.time(),
+    }
+    _write_json_atomic(QUEUE_DIR / f"{time.time_ns()}_{job_id}.json", job)
+    return job_id
+
+def worker_job_active(job_id: str) -> bool:
+    """True while the job is queued or running on the worker."""
+    return any(QUEUE_DIR.glob(f"*_{job_id}.json")) or any(RUNNING_DIR.glob(f"*_{job_id}.json"))
+
+def cancel_job(job_id: str) -> None:
+    """A queued job is dropped; a running one gets a stop marker the worker acts on."""
+    for p in QUEUE_DIR.glob(f"*_{job_id}.json"):
+        p.unlink(missing_ok=True)
+        return
+    if any(RUNNING_DIR.glob(f"*_{job_id}.json")):
+        stop_marker(job_id).touch()
+
+def stop_marker(job_id: str) -> Path:
+    return RUNNING_DIR / f"{job_id}.stop"
+
+def write_job_result(job_id: str, status: str, exit_code: int | None) -> None:
+    """Written by the worker before it drops the running file, so the outcome is never lost."""
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    _write_json_atomic(RESULTS_DIR / f"{job_id}.json", {
+        "id": job_id,
+        "status": status,
+        "exit_code": exit_code,
+        "time": time.time(),
+    })
+
+def pop_job_result(job_id: str) -> dict | None:
+    """The worker's record for a finished job, removed once read; None if it never wrote one."""
+    path = RESULTS_DIR / f"{job_id}.json"
+    try:
+        result = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    path.unlink(missing_ok=True)
+    return result